@@ -0,0 +1,284 @@
+"""
+Pool de contas ATProto para a coleta.
+
+Com uma única conta (`BLSKY_USERNAME`/`BLSKY_PASSWORD`) a frota inteira divide um só orçamento de
+rate limit. O pool carrega N contas, cada uma com o seu cliente, os seus baldes de rate limit
+(`bsky:<handle>` e `bsky-session:<handle>`, ver `rate_limit.py`) e a sua sessão em cache, e
+entrega a cada requisição a conta com mais orçamento disponível (menor espera estimada no balde).
+
+Contas que falham por motivo da própria conta (token inválido, conta suspensa ou desativada,
+401/403) ficam em quarentena por `ACCOUNT_QUARANTINE_SECONDS`, dobrando a cada reincidência;
+outros erros só contam para a quarentena depois de `ACCOUNT_MAX_FAILURES` seguidos. Um 429 não é
+falha da conta: o balde dela já pausa até o reset.
+
+Observação: os limites do AppView também valem por IP; várias contas atrás do mesmo IP somam
+orçamento só até esse teto (os cabeçalhos `ratelimit-*` de cada resposta mostram qual vale).
+
+AppView público: com `set_public(client)`, o pool ganha uma "conta" sem sessão que fala direto
+com um AppView público (`PUBLIC_APPVIEW_URL`), com balde próprio (`bsky-public`). Ela é usada
+primeiro enquanto tiver orçamento; as contas autenticadas ficam como reserva para quando o balde
+público está esgotado ou o conteúdo exige login (`pick(authenticated=True)`). Sem contas
+autenticadas, só o AppView público é usado.
+
+Contas, em ordem de prioridade:
+  - BLSKY_ACCOUNTS_FILE: arquivo com uma conta `handle:senha` por linha (`#` comenta);
+  - BLSKY_ACCOUNTS: `handle1:senha1,handle2:senha2`;
+  - BLSKY_USERNAME / BLSKY_PASSWORD: uma conta só, como antes.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from atproto_client.exceptions import BadRequestError, LoginRequiredError, UnauthorizedError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PUBLIC_APPVIEW_URL = os.getenv("PUBLIC_APPVIEW_URL", "https://public.api.bsky.app")
+PUBLIC_BUCKET_KEY = "bsky-public"
+
+QUARANTINE_SECONDS = float(os.getenv("ACCOUNT_QUARANTINE_SECONDS", 900))
+QUARANTINE_MAX_SECONDS = 6 * 3600
+MAX_FAILURES = int(os.getenv("ACCOUNT_MAX_FAILURES", 3))
+
+# Erros XRPC que dizem respeito à conta, não à requisição
+ACCOUNT_ERRORS = {"ExpiredToken", "InvalidToken", "AuthMissing", "AccountTakedown", "AccountDeactivated"}
+
+
+def _parse_accounts(lines) -> list:
+    accounts = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        handle, sep, password = line.partition(":")
+        if not sep:
+            raise ValueError(f"Conta sem senha (esperado handle:senha): {handle}")
+        accounts.append((handle.strip(), password.strip()))
+    return accounts
+
+
+def load_credentials() -> list:
+    """
+    Lista de `(handle, senha)` configurada no ambiente.
+    """
+    path = os.getenv("BLSKY_ACCOUNTS_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return _parse_accounts(f)
+    if os.getenv("BLSKY_ACCOUNTS"):
+        return _parse_accounts(os.getenv("BLSKY_ACCOUNTS").split(","))
+    return [(os.getenv("BLSKY_USERNAME"), os.getenv("BLSKY_PASSWORD"))]
+
+
+def bucket_keys(handle: str) -> tuple:
+    """
+    Chaves dos baldes de leitura e de sessão de uma conta (iguais em todos os scripts, para que
+    compartilhem o orçamento no backend "mongo").
+    """
+    return f"bsky:{handle}", f"bsky-session:{handle}"
+
+
+def is_account_error(e: Exception) -> bool:
+    if isinstance(e, (UnauthorizedError, LoginRequiredError)):
+        return True
+    if isinstance(e, BadRequestError):
+        content = getattr(getattr(e, "response", None), "content", None)
+        return getattr(content, "error", None) in ACCOUNT_ERRORS
+    return False
+
+
+class Account:
+    def __init__(self, handle: str, password: str, client, public: bool = False):
+        self.handle = handle
+        self.password = password
+        self.client = client
+        self.public = public
+        # A conta pública não tem login; as demais só entram no rodízio depois do login
+        self.logged_in = public
+        self.failures = 0
+        self.quarantines = 0
+        self.quarantined_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float = None) -> bool:
+        return (now or time.time()) >= self.quarantined_until
+
+    def wait_estimate(self) -> float:
+        bucket = getattr(self.client, "bucket", None)
+        return bucket.peek() if bucket is not None else 0.0
+
+    @property
+    def blocking_io(self) -> bool:
+        return getattr(getattr(self.client, "bucket", None), "blocking_io", False)
+
+
+class AccountPool:
+    """
+    Thread-safe; no modo async as operações são rápidas o bastante para rodar no event loop,
+    exceto `pick` com baldes no Mongo (consulta o documento de cada balde): use `pick_async`.
+    """
+
+    def __init__(self, log=print):
+        self.accounts = []
+        self.public = None
+        self._lock = threading.Lock()
+        self._log = log
+        # Marcado quando uma rodada de login termina; até lá `pick` espera por uma conta logada
+        self._login_done = threading.Event()
+
+    def add(self, handle: str, password: str, client) -> Account:
+        account = Account(handle, password, client)
+        self.accounts.append(account)
+        return account
+
+    def set_public(self, client) -> Account:
+        self.public = Account("public", None, client, public=True)
+        return self.public
+
+    def __len__(self):
+        return len(self.accounts) + (self.public is not None)
+
+    def pick(self, authenticated: bool = False) -> Account:
+        """
+        AppView público enquanto tiver orçamento (a menos que `authenticated`); senão, a conta
+        logada disponível com a menor espera estimada no balde. Se todas estiverem em quarentena,
+        devolve a que sai primeiro. Contas sem sessão nunca são devolvidas: sem nenhuma logada,
+        espera o login em andamento e, se ele terminar sem sucesso, levanta `RuntimeError`.
+        """
+        while True:
+            account = self._pick(authenticated)
+            if account is not None:
+                return account
+            self._check_login_pending()
+            self._login_done.wait(1.0)
+
+    async def pick_async(self, authenticated: bool = False) -> Account:
+        """
+        `pick` para o modo async: com baldes no Mongo, roda numa thread (como o `observe` do
+        AsyncRateLimitedClient), para que as corrotinas não esperem em fila pelos round-trips.
+        A espera por um login em andamento também não bloqueia o event loop.
+        """
+        if any(a.blocking_io for a in self.accounts + ([self.public] if self.public is not None else [])):
+            return await asyncio.to_thread(self.pick, authenticated)
+        while True:
+            account = self._pick(authenticated)
+            if account is not None:
+                return account
+            self._check_login_pending()
+            await asyncio.sleep(1.0)
+
+    def _pick(self, authenticated: bool):
+        now = time.time()
+        with self._lock:
+            logged_in = [a for a in self.accounts if a.logged_in]
+        ready = [a for a in logged_in if a.available(now)]
+        public = self.public if self.public is not None and not authenticated and self.public.available(now) else None
+
+        if public is not None and (not ready or public.wait_estimate() <= 0):
+            return public
+        if public is not None:
+            ready = ready + [public]
+        if len(ready) == 1:
+            return ready[0]
+        if ready:
+            return min(ready, key=lambda a: (a.wait_estimate(), a.requests))
+
+        candidates = logged_in + ([self.public] if self.public is not None and not authenticated else [])
+        return min(candidates, key=lambda a: a.quarantined_until) if candidates else None
+
+    def _check_login_pending(self):
+        if not self.accounts or self._login_done.is_set():
+            raise RuntimeError("Nenhuma conta logada no pool para uma requisição que exige login.")
+
+    def report_success(self, account: Account):
+        with self._lock:
+            account.requests += 1
+            account.failures = 0
+
+    def report_failure(self, account: Account, e: Exception) -> bool:
+        """
+        Registra uma falha. Devolve True se ela é da conta (a requisição pode ser refeita com
+        outra conta).
+        """
+        account_error = is_account_error(e)
+        with self._lock:
+            account.requests += 1
+            account.errors += 1
+            # No AppView público, erro de autenticação quer dizer que o conteúdo exige login
+            if account.public and account_error:
+                return True
+            # Requisição inválida (ex.: DID inexistente) não diz nada sobre a conta
+            if isinstance(e, BadRequestError) and not account_error:
+                return False
+            account.failures += 1
+            if account_error or account.failures >= MAX_FAILURES:
+                self._quarantine(account, str(e))
+        return account_error
+
+    def _quarantine(self, account: Account, reason: str):
+        seconds = min(QUARANTINE_SECONDS * (2 ** account.quarantines), QUARANTINE_MAX_SECONDS)
+        account.quarantines += 1
+        account.failures = 0
+        account.quarantined_until = time.time() + seconds
+        self._log(f"[accounts] {account.handle} em quarentena por {seconds:.0f}s: {reason}")
+
+    def login_all(self, login_fn, required: bool = True):
+        """
+        Faz o login (com cache de sessão) de todas as contas; uma conta que não loga vai para a
+        quarentena. Com `required`, falha se nenhuma conta logar.
+        """
+        try:
+            for account in self.accounts:
+                try:
+                    account.client.login_cached(lambda c, a=account: login_fn(c, a.handle, a.password))
+                    account.logged_in = True
+                except Exception as e:
+                    with self._lock:
+                        self._quarantine(account, f"login falhou: {e}")
+        finally:
+            self._login_done.set()
+        self._report_logins(required)
+
+    def login_in_background(self, login_fn) -> threading.Thread:
+        """
+        Login das contas fora do caminho crítico (modo híbrido): o AppView público atende
+        enquanto isso.
+        """
+        thread = threading.Thread(target=self.login_all, args=(login_fn, False), name="accounts-login", daemon=True)
+        thread.start()
+        return thread
+
+    async def login_all_async(self, login_fn, required: bool = True):
+        try:
+            for account in self.accounts:
+                try:
+                    await account.client.login_cached(lambda c, a=account: login_fn(c, a.handle, a.password))
+                    account.logged_in = True
+                except Exception as e:
+                    with self._lock:
+                        self._quarantine(account, f"login falhou: {e}")
+        finally:
+            self._login_done.set()
+        self._report_logins(required)
+
+    def _report_logins(self, required: bool):
+        active = sum(a.logged_in and a.available() for a in self.accounts)
+        if not active:
+            if required:
+                raise RuntimeError("Nenhuma conta do pool conseguiu fazer login.")
+            self._log("[accounts] Nenhuma conta logada; seguindo só com o AppView público.")
+            return
+        self._log(f"[accounts] {active}/{len(self.accounts)} contas ativas.")
+
+    def stats(self) -> list:
+        now = time.time()
+        return [{
+            'handle':      a.handle,
+            'requests':    a.requests,
+            'errors':      a.errors,
+            'quarantined': max(a.quarantined_until - now, 0.0),
+        } for a in ([self.public] if self.public is not None else []) + self.accounts]
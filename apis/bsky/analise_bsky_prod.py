@@ -1,16 +1,34 @@
 import os
 import socket
-from datetime import datetime, timezone
-from pymongo import ReturnDocument
-from pymongo.errors import PyMongoError, DuplicateKeyError
+import argparse
+import asyncio
+from datetime import timedelta
+from pymongo.errors import PyMongoError
 from concurrent.futures import ThreadPoolExecutor
-from atproto import Client
+from atproto import Client, AsyncClient
 from atproto_client.exceptions import RequestException
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 import time
 import sys
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from apis.bsky.rate_limit import RateLimitedClient, AsyncRateLimitedClient, build_bucket, DEFAULT_RATE
+from apis.bsky.session_cache import (
+    CachedSessionClient, AsyncCachedSessionClient, build_request, build_session_cache, session_key, MAX_CONNECTIONS
+)
+from apis.bsky.accounts import AccountPool, load_credentials, bucket_keys, PUBLIC_APPVIEW_URL, PUBLIC_BUCKET_KEY
+from apis.bsky.task_leases import (
+    claim_batch, claim_batch_async, ack_op, retry_op, ack_batch, ack_batch_async,
+    LeaseKeeper, reap_expired, requeue_done, start_reaper, pending_filter, retry_wait, retry_wait_async,
+    MAX_ATTEMPTS
+)
+from apis.bsky.feed_collector import FeedCollector, task_since, parse_fields, DEFAULT_FIELDS
+from apis.bsky.posts_store import POSTS_COLLECTION, ensure_posts_indexes
+from apis.bsky.sharding import shard_query, ensure_shard_indexes, configured_shards, rebalance, MAX_SHARDS
+from apis.bsky.metrics import METRICS, METRICS_COLLECTION, MongoReporter, serve as serve_metrics
+
 load_dotenv()
 
 # MongoDB setup
@@ -29,140 +47,732 @@ db         = clientDB[DB_NAME]
 WORKER_ID  = os.getenv("WORKER_ID", socket.gethostname())
 
 # Collections
-tasks_coll = db[os.getenv("MONGO_COLLECTION_TASKS")]
-data_coll  = db[os.getenv("MONGO_COLLECTION_DATA")]
+TASKS_COLLECTION = os.getenv("MONGO_COLLECTION_TASKS")
+DATA_COLLECTION  = os.getenv("MONGO_COLLECTION_DATA")
+RATELIMITS_COLLECTION = os.getenv("MONGO_COLLECTION_RATELIMITS", "ratelimits")
+SESSIONS_COLLECTION = os.getenv("MONGO_COLLECTION_SESSIONS", "sessions")
+CHECKPOINTS_COLLECTION = os.getenv("MONGO_COLLECTION_CHECKPOINTS", "checkpoints")
+tasks_coll = db[TASKS_COLLECTION]
+data_coll  = db[DATA_COLLECTION]
+posts_coll = db[POSTS_COLLECTION]
 
-# ATProto client
-client = Client()
+# Contas ATProto (um cliente, baldes de rate limit e sessão por conta; preenchido em main())
+accounts = AccountPool()
 
 # Login ATProto
 max_retries = 5
-retries = 0
 
-while True:
-    try:
-        client.login(
-            os.getenv("BLSKY_USERNAME"),
-            os.getenv("BLSKY_PASSWORD")
-        )
-        print("Login bem-sucedido")
-        break
-
-    except RequestException as e:
-        resp    = getattr(e, 'response', None)
-        status  = resp.status_code if resp else None
-        headers = resp.headers     if resp else {}
-
-        # Se for rate-limit, espera até o reset
-        if status == 429 or 'RateLimitExceeded' in str(e):
-            reset_ts = int(headers.get('ratelimit-reset', 0))
-            wait = max(reset_ts - time.time(), 0) + 1
-            print(f"Rate limit atingido no login. Aguardando {wait:.0f}s…")
+
+def _rate_limit_wait(e: RequestException):
+    """
+    Se a exceção for um rate-limit (429), devolve quantos segundos esperar até o
+    `ratelimit-reset`. Para qualquer outro erro devolve None.
+    """
+    resp    = getattr(e, 'response', None)
+    status  = resp.status_code if resp else None
+    headers = resp.headers     if resp else {}
+
+    if status == 429 or 'RateLimitExceeded' in str(e):
+        reset_ts = int(headers.get('ratelimit-reset', 0))
+        return max(reset_ts - time.time(), 0) + 1
+    return None
+
+
+def login(atp_client: Client, handle: str = None, password: str = None):
+    retries = 0
+
+    while True:
+        try:
+            atp_client.login(
+                handle or os.getenv("BLSKY_USERNAME"),
+                password or os.getenv("BLSKY_PASSWORD")
+            )
+            print("Login bem-sucedido")
+            break
+
+        except RequestException as e:
+            wait = _rate_limit_wait(e)
+
+            # Se for rate-limit, o balde de sessão já está pausado até o reset
+            if wait is not None:
+                print(f"Rate limit atingido no login. Aguardando ~{wait:.0f}s…")
+                retries += 1
+                if retries >= max_retries:
+                    raise RuntimeError("Número máximo de tentativas de login excedido.")
+                continue
+
+            # Qualquer outro RequestException
+            print(f"Erro no login (RequestException): {e}")
+            raise
+
+        except Exception as e:
+            # Erros inesperados
+            print(f"Erro crítico no login: {e}")
+            raise
+
+
+async def login_async(atp_client: AsyncClient, handle: str = None, password: str = None):
+    retries = 0
+
+    while True:
+        try:
+            await atp_client.login(
+                handle or os.getenv("BLSKY_USERNAME"),
+                password or os.getenv("BLSKY_PASSWORD")
+            )
+            print("Login bem-sucedido (async)")
+            break
+
+        except RequestException as e:
+            wait = _rate_limit_wait(e)
+
+            if wait is not None:
+                print(f"Rate limit atingido no login. Aguardando ~{wait:.0f}s…")
+                retries += 1
+                if retries >= max_retries:
+                    raise RuntimeError("Número máximo de tentativas de login excedido.")
+                continue
+
+            print(f"Erro no login (RequestException): {e}")
+            raise
+
+
+def new_collector(did: str, since: dict = None, opts=None) -> FeedCollector:
+    return FeedCollector(
+        did,
+        since,
+        storage=getattr(opts, 'storage', 'embedded'),
+        incremental=getattr(opts, 'incremental', False),
+        fields=getattr(opts, 'fields', DEFAULT_FIELDS),
+        keep_reposts=getattr(opts, 'keep_reposts', False),
+        max_posts=getattr(opts, 'max_posts', None),
+        max_age=timedelta(days=opts.max_age_days) if getattr(opts, 'max_age_days', None) else None,
+        max_pages=getattr(opts, 'max_pages', None)
+    )
+
+
+def feed_params(did: str, cursor, opts=None) -> dict:
+    params = {'actor': did, 'limit': 100, 'cursor': cursor}
+    # Filtro aplicado pelo AppView: posts que não queremos nem chegam a ser baixados
+    if getattr(opts, 'feed_filter', None):
+        params['filter'] = opts.feed_filter
+    return params
+
+
+def done_op(task: dict, collector: FeedCollector):
+    """
+    Confirmação de uma task coletada: nova marca d'água e contadores do que foi descartado.
+    """
+    METRICS.inc('crawler_tasks_completed_total')
+    METRICS.inc('crawler_posts_stored_total', collector.count)
+    METRICS.set('crawler_last_task_timestamp', time.time())
+    return ack_op(task, 'done', **collector.watermark(),
+                  posts_stored=collector.count,
+                  stopped_by=collector.stopped_by,
+                  **{f"skipped_{kind}": n for kind, n in collector.skipped.items()})
+
+
+def failed_op(task: dict, error: Exception, opts):
+    METRICS.inc('crawler_tasks_failed_total')
+    return retry_op(task, str(error), opts.max_attempts)
+
+
+def storage_coll(opts=None):
+    """
+    Coleção onde o layout de armazenamento escolhido grava os posts.
+    """
+    return posts_coll if getattr(opts, 'storage', None) == "posts" else data_coll
+
+
+def get_all_posts_of_user(did: str, since: dict = None, opts=None) -> FeedCollector:
+    collector = new_collector(did, since, opts)
+    target = storage_coll(opts)
+    cursor = None
+    account_retries = 0
+    needs_auth = False
+
+    while True:
+        account = accounts.pick(authenticated=needs_auth)
+        try:
+            response = account.client.app.bsky.feed.get_author_feed(feed_params(did, cursor, opts))
+            accounts.report_success(account)
+            METRICS.inc('crawler_pages_fetched_total')
+
+            collector.add_page(response.feed or [])
+            cursor = response.cursor
+
+        except RequestException as e:
+            wait = _rate_limit_wait(e)
+
+            # O balde compartilhado já foi pausado até o reset: a próxima
+            # chamada espera a sua vez, escalonada com as outras threads
+            if wait is not None:
+                print(f"Rate limit atingido para {did}. Aguardando ~{wait:.0f}s…")
+                continue
+            # Qualquer outro erro sobe: a task volta com backoff em vez de ser confirmada pela metade
+            accounts.report_failure(account, e)
+            raise
+
+        except Exception as e:
+            # Falha da conta (token, suspensão): a conta vai para a quarentena e a página é refeita com outra
+            # No AppView público, o mesmo erro indica conteúdo que exige login: refaz autenticado
+            if accounts.report_failure(account, e) and account_retries < len(accounts):
+                account_retries += 1
+                needs_auth = needs_auth or account.public
+                continue
+            raise
+
+        # Layouts "buckets"/"posts": a página vai para o Mongo já; um erro aqui sobe e a task é refeita
+        ops = collector.drain()
+        if ops:
+            target.bulk_write(ops, ordered=True)
+
+        if collector.done or not cursor:
+            collector.finish()
+            break
+
+    return collector
+
+def process_tasks(opts, keeper: LeaseKeeper):
+    while True:
+        query = shard_query(opts.num_shards, opts.shard_index)
+        tasks = claim_batch(tasks_coll, WORKER_ID, opts.claim_batch, query=query)
+
+        if not tasks:
+            # Tasks em backoff ainda são desta execução: espera a primeira voltar
+            wait = retry_wait(tasks_coll, query)
+            if wait is None:
+                break
             time.sleep(wait)
-            retries += 1
-            if retries >= max_retries:
-                raise RuntimeError("Número máximo de tentativas de login excedido.")
             continue
 
-        # Qualquer outro RequestException
-        print(f"Erro no login (RequestException): {e}")
-        raise
+        METRICS.inc('crawler_tasks_claimed_total', len(tasks))
+        keeper.hold(tasks)
 
-    except Exception as e:
-        # Erros inesperados
-        print(f"Erro crítico no login: {e}")
-        raise
+        # Os documentos coletados e as confirmações do lote são gravados de uma vez
+        data_ops = []
+        acks     = []
+
+        for task in tasks:
+            did    = task['did']
+            print(f"[{WORKER_ID}] Processando {did} …")
+
+            try:
+                since = task_since(task) if opts.incremental else None
+                collector = get_all_posts_of_user(did, since, opts)
+                data_ops.extend(collector.drain(final=True))
+                acks.append(done_op(task, collector))
+                print(f"[{WORKER_ID}] Concluído: {collector.summary()} de {did}.")
+
+            except Exception as e:
+                # Volta para pending com backoff (ou failed após max_attempts) em vez de derrubar o worker
+                print(f"[{WORKER_ID}] Erro em {did}: {e}")
+                acks.append(failed_op(task, e, opts))
 
-def get_all_posts_of_user(did: str):
-    all_posts = []
+        try:
+            if data_ops:
+                storage_coll(opts).bulk_write(data_ops, ordered=False)
+            ack_batch(tasks_coll, acks)
+        except PyMongoError as e:
+            # Sem confirmação, os leases vencem e o reaper devolve as tasks para a fila
+            print(f"[{WORKER_ID}] Erro ao gravar o lote no Mongo: {e}")
+        finally:
+            keeper.release(tasks)
+
+
+# --------------------------------
+#  MODO ASSÍNCRONO (asyncio)
+# --------------------------------
+
+class FeedGovernor:
+    """
+    Limita quantas chamadas ao get_author_feed ficam em voo ao mesmo tempo no modo
+    assíncrono. O ritmo (fichas, pausa após 429) fica a cargo do balde de rate limit
+    compartilhado do AsyncRateLimitedClient.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self._sem = asyncio.Semaphore(max_in_flight)
+
+    async def __aenter__(self):
+        await self._sem.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._sem.release()
+        return False
+
+
+async def get_all_posts_of_user_async(pool: AccountPool, governor: FeedGovernor, data, did: str,
+                                      since: dict = None, opts=None) -> FeedCollector:
+    collector = new_collector(did, since, opts)
     cursor = None
+    account_retries = 0
+    needs_auth = False
 
     while True:
+        account = await pool.pick_async(authenticated=needs_auth)
         try:
-            response = client.app.bsky.feed.get_author_feed({
-                'actor': did,
-                'limit': 100,
-                'cursor': cursor
-            })
-
-            feed = response.feed or []
-            for post in feed:
-                all_posts.append({
-                    'text':       post.post.record.text,
-                    'created_at': post.post.record.created_at
-                })
+            async with governor:
+                response = await account.client.app.bsky.feed.get_author_feed(feed_params(did, cursor, opts))
+            pool.report_success(account)
+            METRICS.inc('crawler_pages_fetched_total')
 
+            collector.add_page(response.feed or [])
             cursor = response.cursor
-            if not cursor:
-                break
 
         except RequestException as e:
-            resp    = getattr(e, 'response', None)
-            status  = resp.status_code if resp else None
-            headers = resp.headers     if resp else {}
-
-            if status == 429 or 'RateLimitExceeded' in str(e):
-                reset_ts = int(headers.get('ratelimit-reset', 0))
-                wait = max(reset_ts - time.time(), 0) + 1
-                print(f"Rate limit atingido para {did}. Aguardando {wait:.0f}s…")
-                time.sleep(wait)
+            wait = _rate_limit_wait(e)
+
+            if wait is not None:
+                print(f"Rate limit atingido para {did}. Aguardando ~{wait:.0f}s…")
                 continue
-            else:
-                print(f"Erro crítico ao buscar posts de {did}: {e}")
-                break
+            pool.report_failure(account, e)
+            raise
 
         except Exception as e:
-            print(f"Erro ao buscar posts de {did}: {e}")
+            if pool.report_failure(account, e) and account_retries < len(pool):
+                account_retries += 1
+                needs_auth = needs_auth or account.public
+                continue
+            raise
+
+        ops = collector.drain()
+        if ops:
+            await data.bulk_write(ops, ordered=True)
+
+        if collector.done or not cursor:
+            collector.finish()
             break
 
-    return all_posts
+    return collector
+
+
+class ResultBuffer:
+    """
+    Acumula as escritas na coleção de dados e as confirmações das tasks do modo assíncrono e
+    grava tudo com dois `bulk_write` a cada `flush_size` DIDs concluídos.
+    """
 
-def process_tasks():
+    def __init__(self, tasks, data, flush_size: int, keeper: LeaseKeeper):
+        self._tasks = tasks
+        self.data = data
+        self._flush_size = flush_size
+        self._keeper = keeper
+        self._data_ops = []
+        self._acks = []
+        self._done = []
+
+    async def add(self, task: dict, ack, data_ops: list = None):
+        self._data_ops.extend(data_ops or [])
+        self._acks.append(ack)
+        self._done.append(task)
+        if len(self._acks) >= self._flush_size:
+            await self.flush()
+
+    async def flush(self):
+        data_ops, self._data_ops = self._data_ops, []
+        acks, self._acks = self._acks, []
+        done, self._done = self._done, []
+        try:
+            if data_ops:
+                await self.data.bulk_write(data_ops, ordered=False)
+            await ack_batch_async(self._tasks, acks)
+        except PyMongoError as e:
+            # Sem confirmação, os leases vencem e o reaper devolve as tasks para a fila
+            print(f"[{WORKER_ID}] Erro ao gravar o lote no Mongo: {e}")
+        finally:
+            self._keeper.release(done)
+
+
+async def claim_tasks_async(tasks, queue: asyncio.Queue, batch_size: int, num_workers: int, keeper: LeaseKeeper,
+                            query: dict = None):
+    """
+    Reserva tasks em lotes e alimenta a fila das corrotinas; a fila é limitada, então só
+    reserva mais quando há espaço. Tasks em backoff são esperadas; ao esgotar as pendentes,
+    envia um sentinela por worker.
+    """
     while True:
-        task = tasks_coll.find_one_and_update(
-            {'status': 'pending'},
-            {'$set': {
-                'status':    'processing',
-                'locked_by': WORKER_ID,
-                'locked_at': datetime.now(timezone.utc)
-            }},
-            return_document=ReturnDocument.AFTER
-        )
+        batch = await claim_batch_async(tasks, WORKER_ID, batch_size, query=query)
+        if not batch:
+            wait = await retry_wait_async(tasks, query)
+            if wait is None:
+                break
+            await asyncio.sleep(wait)
+            continue
+        METRICS.inc('crawler_tasks_claimed_total', len(batch))
+        keeper.hold(batch)
+        for task in batch:
+            await queue.put(task)
+
+    for _ in range(num_workers):
+        await queue.put(None)
 
-        if not task:
+
+async def process_tasks_async(pool: AccountPool, governor: FeedGovernor, queue: asyncio.Queue,
+                              results: ResultBuffer, opts):
+    while True:
+        task = await queue.get()
+
+        if task is None:
             break
 
         did    = task['did']
         print(f"[{WORKER_ID}] Processando {did} …")
 
         try:
-            posts = get_all_posts_of_user(did)
-            data_coll.insert_one({
-                'posts':     posts,
-                'fetched_at': datetime.now(timezone.utc)
-            })
-            tasks_coll.update_one(
-                {'_id': task['_id']},
-                {'$set': {
-                    'status':       'done',
-                    'processed_at': datetime.now(timezone.utc)
-                }}
-            )
-            print(f"[{WORKER_ID}] Concluído: {len(posts)} posts de {did}.")
+            since = task_since(task) if opts.incremental else None
+            collector = await get_all_posts_of_user_async(pool, governor, results.data, did, since, opts)
+            await results.add(task, done_op(task, collector), collector.drain(final=True))
+            print(f"[{WORKER_ID}] Concluído: {collector.summary()} de {did}.")
 
         except Exception as e:
+            # Uma falha não derruba as outras corrotinas: a task volta com backoff
             print(f"[{WORKER_ID}] Erro em {did}: {e}")
-            tasks_coll.update_one(
-                {'_id': task['_id']},
-                {'$set': {
-                    'status':       'failed',
-                    'error':        str(e),
-                    'processed_at': datetime.now(timezone.utc)
-                }}
-            )
-            sys.exit(1)
+            await results.add(task, failed_op(task, e, opts))
+
+
+def _log_login_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[{WORKER_ID}] Login das contas em background falhou: {task.exception()}")
+
+
+async def run_async(opts, keeper: LeaseKeeper, credentials: list, ratelimits_coll, session_cache):
+    """
+    Mantém `opts.concurrency` DIDs em processamento simultâneo num único event loop,
+    com no máximo `opts.max_in_flight` chamadas ao get_author_feed em voo.
+    """
+    pool = build_pool(AccountPool(), opts, credentials, ratelimits_coll, session_cache, async_=True)
+    login_task = None
+    if opts.appview == "auth":
+        await pool.login_all_async(login_async)
+    elif opts.appview == "hybrid":
+        # O AppView público atende enquanto as contas fazem login
+        login_task = asyncio.create_task(pool.login_all_async(login_async, required=False))
+        login_task.add_done_callback(_log_login_error)
+
+    mongo = AsyncMongoClient(uri)
+    adb   = mongo[DB_NAME]
+    tasks = adb[TASKS_COLLECTION]
+    data  = adb[POSTS_COLLECTION if opts.storage == "posts" else DATA_COLLECTION]
+
+    governor = FeedGovernor(opts.max_in_flight or opts.concurrency)
+    queue    = asyncio.Queue(maxsize=opts.concurrency)
+    METRICS.gauge_fn('crawler_queue_size', queue.qsize)
+    results  = ResultBuffer(tasks, data, flush_size=opts.claim_batch, keeper=keeper)
+    try:
+        await asyncio.gather(
+            claim_tasks_async(tasks, queue, opts.claim_batch, opts.concurrency, keeper,
+                              query=shard_query(opts.num_shards, opts.shard_index)),
+            *(process_tasks_async(pool, governor, queue, results, opts) for _ in range(opts.concurrency))
+        )
+        await results.flush()
+    finally:
+        if login_task is not None:
+            login_task.cancel()
+        await mongo.close()
+        log_account_stats(pool)
+
+
+def build_pool(pool: AccountPool, opts, credentials: list, ratelimits_coll, session_cache, async_: bool = False):
+    """
+    Preenche o pool conforme `--appview`: contas autenticadas ("auth"), só o AppView público
+    ("public") ou os dois ("hybrid"). O login fica a cargo de quem chama.
+    """
+    if opts.appview in ("public", "hybrid"):
+        bucket = build_bucket(opts.rate_backend, coll=ratelimits_coll, key=PUBLIC_BUCKET_KEY, rate=opts.public_rate)
+        cls = AsyncRateLimitedClient if async_ else RateLimitedClient
+        pool.set_public(cls(bucket, PUBLIC_APPVIEW_URL, request=build_request(
+            async_=async_, max_connections=(opts.max_in_flight or opts.concurrency) if async_ else MAX_CONNECTIONS
+        )))
+    if opts.appview in ("auth", "hybrid"):
+        for handle, password in credentials:
+            pool.add(handle, password, new_account_client(handle, opts, ratelimits_coll, session_cache, async_=async_))
+    return pool
+
+
+def new_account_client(handle: str, opts, ratelimits_coll, session_cache, async_: bool = False):
+    """
+    Cliente de uma conta do pool, com os seus baldes de rate limit (leitura e sessão, esta com o
+    limite próprio do createSession/refreshSession: 30 por 5 minutos) e a sua sessão em cache.
+    """
+    read_key, session_bucket_key = bucket_keys(handle)
+    bucket = build_bucket(opts.rate_backend, coll=ratelimits_coll, key=read_key, rate=opts.rate)
+    session_bucket = build_bucket(opts.rate_backend, coll=ratelimits_coll, key=session_bucket_key,
+                                  rate=30 / 300, burst=2, margin=0)
+
+    cls = AsyncCachedSessionClient if async_ else CachedSessionClient
+    max_connections = (opts.max_in_flight or opts.concurrency) if async_ else MAX_CONNECTIONS
+    atp_client = cls(bucket, session_bucket=session_bucket,
+                     request=build_request(async_=async_, max_connections=max_connections))
+    atp_client.session_cache = session_cache
+    atp_client.session_key = session_key(handle)
+    return atp_client
+
+
+def log_account_stats(pool: AccountPool):
+    for st in pool.stats():
+        print(f"[{WORKER_ID}] Conta {st['handle']}: {st['requests']} requisições, {st['errors']} erros"
+              + (f", em quarentena por mais {st['quarantined']:.0f}s" if st['quarantined'] else ""))
+
+
+def ensure_indexes():
+    try:
+        data_coll.create_index("did")
+    except Exception as e:
+        print(f"[WARN] create_index(data.did) ignorado: {e}")
+
+
+def start_metrics(opts):
+    """
+    Sobe o endpoint Prometheus e/ou o gravador periódico no Mongo, conforme as opções. A
+    profundidade da fila (tasks pendentes no shard) é lida do Mongo a cada leitura das métricas.
+    """
+    METRICS.gauge_fn('crawler_tasks_pending', lambda: tasks_coll.count_documents(
+        pending_filter(shard_query(opts.num_shards, opts.shard_index))
+    ))
+    if opts.metrics_port:
+        serve_metrics(opts.metrics_port)
+    if opts.metrics_interval > 0:
+        return MongoReporter(db[METRICS_COLLECTION], WORKER_ID, opts.metrics_interval).start()
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Coleta os posts de cada DID pendente na coleção de tasks."
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["crawl", "reap", "refresh", "rebalance"],
+        default="crawl",
+        help="crawl: coleta as tasks pendentes, esperando as que estão em backoff (padrão); reap: devolve à fila as tasks com lease vencido e sai; "
+             "refresh: devolve à fila as tasks concluídas há mais de --refresh-age-hours, para recoleta incremental; "
+             "rebalance: redistribui as tasks entre --num-shards shards (rodar uma vez ao mudar o número de hosts)."
+    )
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=int(os.getenv("NUM_SHARDS", 1)),
+        help="Quantidade total de shards (hosts) do crawler, de 1 a 256, no mesmo esquema do detect_lang (padrão: NUM_SHARDS ou 1)."
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=int(os.getenv("SHARD_INDEX", 0)),
+        help="Índice deste host (0 a num-shards-1); só reserva tasks desse shard (padrão: SHARD_INDEX ou 0)."
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["threads", "async"],
+        default=os.getenv("CRAWL_MODE", "threads"),
+        help="threads: um thread por núcleo (padrão); async: event loop com muitos DIDs em voo."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("CRAWL_CONCURRENCY", 200)),
+        help="Modo async: quantos DIDs processar simultaneamente (padrão: 200)."
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=None,
+        help="Modo async: máximo de requisições get_author_feed em voo (padrão: igual a --concurrency)."
+    )
+    parser.add_argument(
+        "--claim-batch",
+        type=int,
+        default=int(os.getenv("CLAIM_BATCH_SIZE", 10)),
+        help="Quantas tasks reservar por round-trip no Mongo; no modo async, também o tamanho dos flushes (padrão: 10)."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=os.getenv("CRAWL_INCREMENTAL", "").lower() in ("1", "true", "yes"),
+        help="Para de paginar ao alcançar o último post já armazenado do DID e mescla os novos no documento existente."
+    )
+    parser.add_argument(
+        "--storage",
+        choices=["embedded", "buckets", "posts"],
+        default=os.getenv("CRAWL_STORAGE", "embedded"),
+        help="embedded: um documento com todos os posts do DID, gravado no fim (padrão); "
+             "buckets: cada página é gravada ao chegar, em documentos-balde de tamanho limitado; "
+             "posts: um documento por post na coleção MONGO_COLLECTION_POSTS."
+    )
+    parser.add_argument(
+        "--fields",
+        type=parse_fields,
+        default=parse_fields(os.getenv("CRAWL_FIELDS", ",".join(DEFAULT_FIELDS))),
+        help="Campos guardados de cada post além de text/created_at, separados por vírgula: "
+             f"uri, cid, langs, reply, repost, facets, embed (padrão: {','.join(DEFAULT_FIELDS)}; "
+             "\"\" guarda só text/created_at)."
+    )
+    parser.add_argument(
+        "--feed-filter",
+        choices=["posts_with_replies", "posts_no_replies", "posts_and_author_threads",
+                 "posts_with_media", "posts_with_video"],
+        default=os.getenv("CRAWL_FEED_FILTER") or None,
+        help="Parâmetro filter do get_author_feed, aplicado no servidor. Opcional: sem ele (padrão) o AppView "
+             "devolve tudo, como posts_with_replies, e nada é economizado; posts_no_replies ou "
+             "posts_and_author_threads deixam de baixar as respostas (que também são texto do autor)."
+    )
+    parser.add_argument(
+        "--keep-reposts",
+        action="store_true",
+        default=os.getenv("CRAWL_KEEP_REPOSTS", "").lower() in ("1", "true", "yes"),
+        help="Guarda também os reposts de outras contas (por padrão são descartados e só contados)."
+    )
+    parser.add_argument(
+        "--max-posts",
+        type=int,
+        default=int(os.getenv("CRAWL_MAX_POSTS", 0)),
+        help="Para de paginar um DID depois de guardar N posts; 0 = sem limite (padrão). "
+             "Ex.: 400 cobre o que gemini.py usa. Ignorado com --incremental."
+    )
+    parser.add_argument(
+        "--max-age-days",
+        type=float,
+        default=float(os.getenv("CRAWL_MAX_AGE_DAYS", 0)),
+        help="Para de paginar ao chegar em posts mais antigos que N dias; 0 = sem limite (padrão)."
+    )
+    parser.add_argument(
+        "--max-pages",
+        type=int,
+        default=int(os.getenv("CRAWL_MAX_PAGES", 0)),
+        help="Máximo de páginas (de até 100 itens) do author feed por DID; 0 = sem limite (padrão). "
+             "Ignorado com --incremental."
+    )
+    parser.add_argument(
+        "--refresh-age-hours",
+        type=float,
+        default=24,
+        help="refresh: idade mínima (horas desde a última coleta) das tasks devolvidas à fila (padrão: 24)."
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=MAX_ATTEMPTS,
+        help=f"Tentativas por task antes de marcá-la como failed (padrão: {MAX_ATTEMPTS})."
+    )
+    parser.add_argument(
+        "--reap-interval",
+        type=float,
+        default=float(os.getenv("REAP_INTERVAL", 300)),
+        help="Segundos entre execuções do reaper em background durante o crawl; 0 desliga (padrão: 300)."
+    )
+    parser.add_argument(
+        "--rate-backend",
+        choices=["local", "mongo"],
+        default=os.getenv("RATE_LIMIT_BACKEND", "local"),
+        help="Onde fica o balde de rate limit: local (este processo) ou mongo (compartilhado entre máquinas)."
+    )
+    parser.add_argument(
+        "--appview",
+        choices=["auth", "public", "hybrid"],
+        default=os.getenv("APPVIEW_MODE", "auth"),
+        help="auth: tudo pelas contas autenticadas (padrão); public: só o AppView público, sem login "
+             "(PUBLIC_APPVIEW_URL); hybrid: AppView público primeiro, contas autenticadas como reserva."
+    )
+    parser.add_argument(
+        "--public-rate",
+        type=float,
+        default=float(os.getenv("PUBLIC_RATE_LIMIT_RATE", DEFAULT_RATE)),
+        help=f"Requisições/s no AppView público antes do primeiro cabeçalho ratelimit-* (padrão: {DEFAULT_RATE:g})."
+    )
+    parser.add_argument(
+        "--session-cache",
+        choices=["file", "mongo", "none"],
+        default=os.getenv("SESSION_CACHE", "file"),
+        help="Onde guardar a sessão ATProto para reaproveitá-la entre processos: file (SESSION_CACHE_DIR, padrão), "
+             "mongo (compartilhada entre máquinas) ou none (login a cada execução)."
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("METRICS_PORT", 0)),
+        help="Porta do endpoint Prometheus (/metrics) deste processo; 0 desliga (padrão: METRICS_PORT ou 0)."
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=float(os.getenv("METRICS_INTERVAL", 0)),
+        help="A cada N segundos grava as métricas deste processo em MONGO_COLLECTION_METRICS "
+             "(resumo da frota: apis/bsky/metrics.py summary); 0 desliga (padrão: METRICS_INTERVAL ou 0)."
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=float(os.getenv("RATE_LIMIT_RATE", DEFAULT_RATE)),
+        help=f"Requisições/s antes do primeiro cabeçalho ratelimit-* (padrão: {DEFAULT_RATE:g})."
+    )
+    args = parser.parse_args()
+
+    if not 1 <= args.num_shards <= MAX_SHARDS:
+        parser.error(f"--num-shards deve estar entre 1 e {MAX_SHARDS} (um shard por valor de shard_key).")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error(f"--shard-index deve estar entre 0 e {args.num_shards - 1}.")
+
+    if args.command == "rebalance":
+        counts = rebalance(tasks_coll, db[CHECKPOINTS_COLLECTION], args.num_shards)
+        print(f"[{WORKER_ID}] Tasks redistribuídas em {args.num_shards} shards: "
+              f"{counts['backfilled']} sem shard preenchidas, {counts['moved']} mudaram de shard.")
+        return
+
+    if args.command == "reap":
+        counts = reap_expired(tasks_coll, args.max_attempts)
+        print(f"[{WORKER_ID}] Leases vencidos: {counts['pending']} de volta a pending, {counts['failed']} failed.")
+        return
+
+    if args.command == "refresh":
+        requeued = requeue_done(tasks_coll, args.refresh_age_hours * 3600,
+                                query=shard_query(args.num_shards, args.shard_index))
+        print(f"[{WORKER_ID}] {requeued} tasks devolvidas à fila para recoleta.")
+        return
+
+    if args.num_shards > 1:
+        stored = configured_shards(db[CHECKPOINTS_COLLECTION])
+        if stored != args.num_shards:
+            print(f"[{WORKER_ID}] As tasks estão distribuídas em {stored or 'nenhum'} shard(s), não em "
+                  f"{args.num_shards}; rode `rebalance --num-shards {args.num_shards}` antes de coletar.")
+            return
+        ensure_shard_indexes(tasks_coll)
+
+    if args.storage == "posts":
+        ensure_posts_indexes(posts_coll)
+    else:
+        ensure_indexes()
+
+    reporter = start_metrics(args)
+
+    keeper = LeaseKeeper(tasks_coll, WORKER_ID).start()
+    if args.reap_interval > 0:
+        start_reaper(tasks_coll, args.reap_interval, args.max_attempts)
+
+    ratelimits_coll = db[RATELIMITS_COLLECTION] if args.rate_backend == "mongo" else None
+    session_cache = build_session_cache(args.session_cache, coll=db[SESSIONS_COLLECTION])
+    credentials = load_credentials()
+
+    try:
+        if args.mode == "async":
+            asyncio.run(run_async(args, keeper, credentials, ratelimits_coll, session_cache))
+            return
+
+        build_pool(accounts, args, credentials, ratelimits_coll, session_cache)
+        if args.appview == "auth":
+            accounts.login_all(login)
+        elif args.appview == "hybrid":
+            accounts.login_in_background(login)
+
+        num_threads = os.cpu_count() or 4
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            executor.map(lambda _: process_tasks(args, keeper), range(num_threads))
+        log_account_stats(accounts)
+    finally:
+        if reporter is not None:
+            reporter.stop()
+
 
 if __name__ == "__main__":
-    num_threads = os.cpu_count() or 4
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        executor.map(lambda _: process_tasks(), range(num_threads))
\ No newline at end of file
+    main()
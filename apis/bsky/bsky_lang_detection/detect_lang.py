@@ -4,14 +4,43 @@
 Script para varrer todos os documentos da collection `MONGO_COLLECTION_DATA` e, em cada `post`, adicionar
 campo "lang" com o idioma detectado de `text`.
 
+Posts que trazem `langs` (idiomas declarados pelo cliente no registro do Bluesky) com um único idioma
+usam esse valor direto, sem rodar o langdetect; a detecção estatística fica só para posts sem `langs`
+ou com mais de um idioma declarado. Ao final, o script informa quantos posts seguiram cada caminho.
+
 Os parâmetros de conexão (usuário, senha, host, porta, authDB, dbName e collection) são carregados de um
 arquivo `.env` (via python-dotenv). 
 
 Você ainda pode passar, opcionalmente, como argumentos:
-  --batch-size   (tamanho do lote de documentos para cada iteração)
+  --batch-size   (documentos por bulk_write)
+  --chunk-size   (documentos por tarefa de um worker)
+  --queue-depth  (fatias em voo entre os estágios do pipeline)
   --num-workers  (quantos processos filhos usar para detecção de idioma)
   --num-shards   (quantos shards/máquinas no total)
   --shard-index  (índice deste shard, de 0 a num-shards-1)
+  --always-detect (ignora os `langs` declarados e detecta o idioma de todos os posts)
+  --backend      (detector: langdetect, fasttext ou cld3; padrão: LANG_BACKEND ou langdetect)
+  --compare N    (não grava nada: compara acurácia e posts/s dos backends numa amostra de N posts)
+  --pt-prefilter (classificador rápido "pt / não-pt" antes do backend; só os ambíguos vão para ele)
+  --layout       (embedded: array `posts` em MONGO_COLLECTION_DATA; posts: um documento por post em
+                  MONGO_COLLECTION_POSTS)
+
+Só os códigos de idioma vão para o banco: `$set` de `posts.<i>.lang` (ou de `lang`, no layout
+normalizado) em `bulk_write` por lote, sem reenviar o corpo dos posts.
+
+A leitura do cursor (thread), a detecção (`imap_unordered` no pool) e a escrita (thread) rodam em
+paralelo, ligadas por filas limitadas: o pool não fica parado enquanto o Mongo grava.
+
+Backends: `langdetect` (Python puro, lento) é o padrão histórico. `fasttext` usa o modelo lid.176
+(`FASTTEXT_MODEL`, .ftz ou .bin) e classifica o lote inteiro de textos de um worker numa única chamada
+nativa; `cld3` usa o gcld3 (compilado, um texto por chamada). Os rótulos da comparação são os `langs`
+declarados nos próprios posts, que nenhum backend vê.
+
+Como só `lang == "pt"` importa adiante (gemini.py, posts_ideal_selection.py), o pré-classificador
+(`pt_prefilter`) conta palavras funcionais do português e de inglês, espanhol, italiano, francês,
+alemão e galego (e ã/õ/ñ) e decide sozinho quando um lado vence com folga; o resto segue para o
+backend. Palavras curtas que o português divide com outros idiomas ("e", "da", "um", "eu") nunca
+bastam sozinhas para um "pt".
 
 Se não passar `--num-shards` nem `--shard-index` na CLI, tentaremos usar as variáveis de ambiente
 NUM_SHARDS e SHARD_INDEX (ou cair nos padrões 1 e 0, respectivamente).
@@ -22,15 +51,21 @@ import argparse
 import hashlib
 import logging
 import multiprocessing as mp
+import queue
+import re
 import sys
+import threading
+import time
 import traceback
 
+from collections import Counter
 from itertools import islice
 from functools import partial
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
-from langdetect import DetectorFactory, detect, LangDetectException
+from langdetect import DetectorFactory, detect, detect_langs, LangDetectException
 from dotenv import load_dotenv
 from tqdm import tqdm
 
@@ -49,10 +84,15 @@ MONGO_AUTH_DB = os.getenv("MONGO_AUTH_DB")
 # Banco e coleção onde estão os dados
 MONGO_DB = os.getenv("MONGO_DB")
 MONGO_COLLECTION_DATA = os.getenv("MONGO_COLLECTION_DATA")
+MONGO_COLLECTION_POSTS = os.getenv("MONGO_COLLECTION_POSTS", "posts")
 
 # (Opcional) coleção de tasks, caso queira usar depois
 MONGO_COLLECTION_TASKS = os.getenv("MONGO_COLLECTION_TASKS")
 
+# Backend de detecção e modelo do fastText (lid.176.ftz ou lid.176.bin)
+LANG_BACKEND = os.getenv("LANG_BACKEND", "langdetect")
+FASTTEXT_MODEL = os.getenv("FASTTEXT_MODEL", "lid.176.ftz")
+
 # Shardização (caso queira dividir o processamento em N máquinas via ENV)
 ENV_NUM_SHARDS = os.getenv("NUM_SHARDS")
 ENV_SHARD_INDEX = os.getenv("SHARD_INDEX")
@@ -126,29 +166,342 @@ def detect_lang_for_post(post_dict: dict) -> str:
         return "und"
 
 
-def process_document(doc: dict) -> tuple:
+# --------------------------------
+#  BACKENDS DE DETECÇÃO
+# --------------------------------
+
+class LangdetectBackend:
+    """
+    langdetect, um texto por vez (comportamento original). Com `min_confidence`, usa as
+    probabilidades de `detect_langs` e grava 'und' abaixo do limite.
+    """
+    name = "langdetect"
+
+    def __init__(self, min_confidence: float = 0.0):
+        self.min_confidence = min_confidence
+
+    def _detect(self, texto: str) -> str:
+        texto = (texto or "").strip()
+        if len(texto) < 3:
+            return "und"
+        try:
+            melhor = detect_langs(texto)[0]
+        except LangDetectException:
+            return "und"
+        return melhor.lang if melhor.prob >= self.min_confidence else "und"
+
+    def detect_batch(self, textos: list) -> list:
+        if not self.min_confidence:
+            return [detect_lang_for_post({"text": t}) for t in textos]
+        return [self._detect(t) for t in textos]
+
+
+class FastTextBackend:
+    """
+    fastText lid.176: `predict` recebe a lista inteira e classifica tudo em C++ numa chamada.
+    Predições abaixo de `min_confidence` viram 'und'.
+    """
+    name = "fasttext"
+
+    def __init__(self, min_confidence: float = 0.0, model_path: str = FASTTEXT_MODEL):
+        try:
+            import fasttext
+        except ImportError:
+            raise RuntimeError("Backend 'fasttext' requer o pacote fasttext (pip install fasttext-wheel) "
+                               "e o modelo lid.176 em FASTTEXT_MODEL.")
+        self.min_confidence = min_confidence
+        self.model = fasttext.load_model(model_path)
+
+    def detect_batch(self, textos: list) -> list:
+        resultado = ["und"] * len(textos)
+        # O fastText trata cada linha como uma entrada: quebras de linha viram espaço
+        indices = [i for i, t in enumerate(textos) if len((t or "").strip()) >= 3]
+        if not indices:
+            return resultado
+        labels, probs = self.model.predict([textos[i].replace("\n", " ").strip() for i in indices], k=1)
+        for i, label, prob in zip(indices, labels, probs):
+            if label and prob[0] >= self.min_confidence:
+                resultado[i] = label[0].replace("__label__", "")
+        return resultado
+
+
+class Cld3Backend:
+    """
+    CLD3 (pacote gcld3): rede neural compilada; o binding não tem chamada em lote, mas cada
+    texto custa microssegundos.
     """
-    Função executada pelos workers (multiprocess). Recebe um documento (com '_id' e 'posts'),
-    adiciona 'lang' a cada post e retorna (doc_id, lista_de_posts_atualizada).
+    name = "cld3"
+
+    def __init__(self, min_confidence: float = 0.0):
+        try:
+            import gcld3
+        except ImportError:
+            raise RuntimeError("Backend 'cld3' requer o pacote gcld3 (pip install gcld3).")
+        self.min_confidence = min_confidence
+        self.detector = gcld3.NNetLanguageIdentifier(min_num_bytes=0, max_num_bytes=1000)
+
+    def detect_batch(self, textos: list) -> list:
+        resultado = []
+        for texto in textos:
+            texto = (texto or "").strip()
+            if len(texto) < 3:
+                resultado.append("und")
+                continue
+            r = self.detector.FindLanguage(text=texto)
+            ok = r.is_reliable and r.probability >= self.min_confidence
+            # Variantes como "zh-Latn" ficam só com o subtag primário
+            resultado.append(r.language.split("-")[0] if ok and r.language != "und" else "und")
+        return resultado
+
+
+BACKENDS = {
+    "langdetect": LangdetectBackend,
+    "fasttext":   FastTextBackend,
+    "cld3":       Cld3Backend,
+}
+
+# --------------------------------
+#  PRÉ-CLASSIFICADOR PT / NÃO-PT
+# --------------------------------
 
-    Se der erro, retorna (doc_id, None). O processo pai decide o retry ou pular.
+# Palavras que só o português usa entre os idiomas concorrentes abaixo (o galego fica com "non",
+# "moito", "tamén", "xa"; o espanhol com "muy", "cuando", "ya"). Só elas, ou ã/õ, autorizam um "pt"
+PT_DISTINTIVAS = frozenset("""
+não nao você voce vocês voces também tambem muito muita muitos muitas isso essa esse pra minha minhas
+nós são tô tá né já então entao hoje obrigado obrigada coisa coisas estava estão fazer acho tenho tinha
+dele cê vc vcs tbm mto kkk kkkk kkkkk disso nisso desse dessa nesse nessa ontem amanhã porém até uma
+depois
+""".split())
+
+# Palavras frequentes em português mas comuns a outros idiomas ("e", "da", "um", "sua", "eu", "em"
+# existem em italiano, alemão ou galego): só reforçam um texto que já tem sinal distintivo
+PT_COMPARTILHADAS = frozenset("""
+e o a os as da do dos das um eu em ao aos sua seu suas seus ser ele ela eles elas pelo pela sem tem
+vai bem foi tudo meu meus quero estou vou agora dela num numa nem só sei pode podem bom boa aqui isto
+quando ainda está acha
+""".split())
+
+# Marcadores dos concorrentes, também escolhidos para não colidir entre si nem com o português
+OUTROS_MARCADORES = {
+    "en": frozenset("""
+    the and is are was were of to you that it for this with my be have has not but they we what just
+    can will your at if or all like don it's i'm
+    """.split()),
+    "es": frozenset("""
+    el los las y es pero muy qué yo ella ahora hoy eso esto hay sí ya más cuando donde siempre tengo
+    tiene estoy pues gracias bueno hola aquí mucho muchos su sus ni soy eres fue hace hacer jaja jajaja
+    también
+    """.split()),
+    "it": frozenset("""
+    il che sono della delle degli questo questa anche perché però molto io mio mia gli nel nella alla
+    ieri oggi domani grazie ciao fatto più essere stato ho hai sorella
+    """.split()),
+    "fr": frozenset("""
+    les des est et une je pas qui dans pour avec sur ce cette mais très c'est j'ai suis nous vous ils
+    elle sont été aujourd'hui merci bien fait être avoir ça
+    """.split()),
+    "de": frozenset("""
+    der die das und ist nicht ich sie wir ein eine einen mit auf für von zu den dem auch aber nach hause
+    uhr gehe heute danke sehr wie noch dann hin schon mal nur bin hat habe
+    """.split()),
+    "gl": frozenset("""
+    non moito moita tamén xa unha polo pola coma dende aínda grazas iso ti nin cando hoxe mañá xente
+    facer
+    """.split()),
+}
+
+_PALAVRA_RE = re.compile(r"[a-zà-öø-ÿ']+")
+PT_PREFILTER_MARGIN = 2
+PT_PREFILTER_MIN_TOKENS = 3
+
+
+def pt_prefilter(texto: str, margem: int = PT_PREFILTER_MARGIN):
     """
-    doc_id = doc["_id"]
-    posts = doc.get("posts", [])
-    updated_posts = []
+    Decide "pt" só com sinal positivo (palavra distintiva ou ã/õ) e pontuação de pelo menos 3
+    (distintivas valem 2, compartilhadas e "ç" valem 1) e `margem` vezes a do concorrente mais
+    forte. Decide um concorrente quando ele tem pelo menos 2 marcadores e `margem` vezes os do
+    português e dos outros concorrentes. Caso contrário (texto curto, empate, idioma fora da
+    lista) retorna None e o post vai para o backend completo.
+    """
+    texto = (texto or "").lower()
+    tokens = _PALAVRA_RE.findall(texto)
+    if len(tokens) < PT_PREFILTER_MIN_TOKENS:
+        return None
+
+    distintivas = sum(t in PT_DISTINTIVAS for t in tokens) + ("ã" in texto or "õ" in texto)
+    pt = 2 * distintivas + sum(t in PT_COMPARTILHADAS for t in tokens) + ("ç" in texto)
+
+    placar = sorted(
+        ((sum(t in marcadores for t in tokens) + (lang == "es" and "ñ" in texto), lang)
+         for lang, marcadores in OUTROS_MARCADORES.items()),
+        reverse=True
+    )
+    (n_outro, outro), (n_segundo, _) = placar[0], placar[1]
+
+    if distintivas and pt >= 3 and pt >= margem * n_outro:
+        return "pt"
+    if n_outro >= 2 and n_outro >= margem * pt and n_outro >= margem * n_segundo:
+        return outro
+    return None
+
+
+# Backend de cada processo do pool (criado uma vez em `init_worker`, não a cada lote)
+_BACKEND = None
+
 
+def build_backend(name: str, min_confidence: float = 0.0):
+    if name not in BACKENDS:
+        raise ValueError(f"Backend desconhecido: {name} (opções: {', '.join(BACKENDS)})")
+    return BACKENDS[name](min_confidence=min_confidence)
+
+
+def init_worker(backend_name: str, min_confidence: float = 0.0):
+    global _BACKEND
+    _BACKEND = build_backend(backend_name, min_confidence)
+
+
+def declared_lang(post_dict: dict):
+    """
+    Idioma declarado no próprio registro (`langs`), se não for ambíguo: todas as tags com o mesmo
+    subtag primário ("pt" e "pt-BR" viram "pt"). Sem `langs`, ou com idiomas diferentes, retorna None.
+    """
+    langs = post_dict.get("langs")
+    if not langs or not isinstance(langs, (list, tuple)):
+        return None
+    primarios = {str(tag).strip().replace("_", "-").split("-")[0].lower() for tag in langs if tag}
+    primarios.discard("")
+    if len(primarios) != 1:
+        return None
+    return primarios.pop()
+
+
+def process_documents(docs: list, always_detect: bool = False, prefilter: bool = False) -> list:
+    """
+    Função executada pelos workers (multiprocess). Recebe uma fatia de documentos (com '_id' e
+    'posts') e retorna, para cada um, (doc_id, tamanho_do_array, {índice: idioma},
+    contagem_por_caminho) — só os idiomas novos, não os posts, que não voltam a trafegar.
+
+    Com `prefilter`, o pré-classificador pt/não-pt decide primeiro; os textos que ainda precisam
+    de detecção de todos os documentos da fatia vão para o backend numa única chamada. Um
+    documento malformado retorna (doc_id, tamanho, None, contagem) sem afetar os outros da fatia;
+    se a chamada em lote falhar, os textos são detectados um a um.
+    """
+    backend = _BACKEND or build_backend("langdetect")
+    resultados = []
+    pendentes = []  # (idiomas do documento, índice do post, texto) dos posts que vão ao backend
+
+    for doc in docs:
+        try:
+            posts = doc.get("posts", [])
+            novos = {}
+            caminhos = Counter()
+            do_documento = []
+            for i, post in enumerate(posts):
+                # Documentos mesclados pela coleta incremental já têm idioma nos posts antigos
+                if post.get("lang"):
+                    caminhos["existente"] += 1
+                    continue
+                lang = None if always_detect else declared_lang(post)
+                if lang:
+                    caminhos["declarado"] += 1
+                    novos[i] = lang
+                elif prefilter and (lang := pt_prefilter(post.get("text", ""))):
+                    caminhos["prefiltro"] += 1
+                    novos[i] = lang
+                else:
+                    caminhos["detectado"] += 1
+                    do_documento.append((novos, i, post.get("text", "") or ""))
+        except Exception as e:
+            tb = traceback.format_exc()
+            logger.error(f"[Worker] Erro ao processar doc {doc.get('_id')}: {e}\n{tb}")
+            resultados.append((doc.get("_id"), 0, None, Counter()))
+            continue
+        pendentes.extend(do_documento)
+        resultados.append((doc["_id"], len(posts), novos, caminhos))
+
+    if pendentes:
+        textos = [texto for _, _, texto in pendentes]
+        try:
+            langs = backend.detect_batch(textos)
+        except Exception as e:
+            logger.error(f"[Worker] Erro na detecção em lote de {len(textos)} textos ({backend.name}): {e}; "
+                         f"detectando um a um")
+            langs = [detect_one(backend, texto) for texto in textos]
+        for (novos, i, _), lang in zip(pendentes, langs):
+            novos[i] = lang
+    return resultados
+
+
+def detect_one(backend, texto: str) -> str:
     try:
-        for post in posts:
-            # Clona campos originais do post para não alterar diretamente o doc que veio do cursor
-            novo_post = dict(post)
-            lang = detect_lang_for_post(novo_post)
-            novo_post["lang"] = lang
-            updated_posts.append(novo_post)
-        return (doc_id, updated_posts)
-    except Exception as e:
-        tb = traceback.format_exc()
-        logger.error(f"[Worker] Erro ao processar doc_id={doc_id}: {e}\n{tb}")
-        return (doc_id, None)
+        return backend.detect_batch([texto])[0]
+    except Exception:
+        return "und"
+
+
+def lang_update(doc_id, tamanho: int, novos: dict, layout: str = "embedded") -> UpdateOne:
+    """
+    Grava só os idiomas novos. No layout embutido, `posts.<i>.lang` por índice, com o tamanho do
+    array no filtro: se a coleta incremental mesclou posts no documento nesse meio tempo (os
+    índices mudaram), a atualização não casa e o documento volta na próxima execução. No layout
+    normalizado (um documento por post), `lang` direto.
+    """
+    if layout == "posts":
+        return UpdateOne({"_id": doc_id}, {"$set": {"lang": novos[0]}})
+    return UpdateOne(
+        {"_id": doc_id, "posts": {"$size": tamanho}},
+        {"$set": {f"posts.{i}.lang": lang for i, lang in novos.items()}}
+    )
+
+
+def compare_backends(coll, sample_size: int, backend_names: list, min_confidence: float = 0.0):
+    """
+    Acurácia e vazão de cada backend numa amostra de posts com um único idioma declarado
+    (o rótulo), sem gravar nada.
+    """
+    pipeline = [
+        {"$sample": {"size": max(sample_size // 5, 1)}},
+        {"$unwind": "$posts"},
+        {"$match": {"posts.langs": {"$size": 1}, "posts.text": {"$type": "string"}}},
+        {"$project": {"_id": 0, "text": "$posts.text", "langs": "$posts.langs"}},
+        {"$limit": sample_size},
+    ]
+    amostra = [(p["text"], declared_lang(p)) for p in coll.aggregate(pipeline) if len(p["text"].strip()) >= 3]
+    amostra = [(texto, rotulo) for texto, rotulo in amostra if rotulo]
+    if not amostra:
+        logger.error("Nenhum post com `langs` declarado na amostra; não há rótulos para comparar.")
+        return
+    textos = [texto for texto, _ in amostra]
+    rotulos = [rotulo for _, rotulo in amostra]
+    logger.info(f"Amostra: {len(amostra)} posts rotulados pelo idioma declarado "
+                f"({Counter(rotulos).most_common(1)[0][0]} é o mais comum).")
+
+    inicio = time.perf_counter()
+    decididos = [(pt_prefilter(t), r) for t, r in zip(textos, rotulos)]
+    duracao = time.perf_counter() - inicio
+    decididos = [(p, r) for p, r in decididos if p]
+    if decididos:
+        vp = sum(1 for p, r in decididos if p == "pt" and r == "pt")
+        previstos_pt = sum(1 for p, _ in decididos if p == "pt")
+        reais_pt = rotulos.count("pt")
+        logger.info(f"pt-prefilter: decide {len(decididos) / len(textos):.1%} da amostra "
+                    f"({len(textos) / duracao:,.0f} posts/s); entre os decididos, pt vs não-pt acerta "
+                    f"{sum(1 for p, r in decididos if (p == 'pt') == (r == 'pt')) / len(decididos):.1%}, "
+                    f"precisão pt {vp / max(previstos_pt, 1):.1%}, cobertura dos pt {vp / max(reais_pt, 1):.1%}")
+
+    for name in backend_names:
+        try:
+            backend = build_backend(name, min_confidence)
+        except RuntimeError as e:
+            logger.warning(f"{name}: ignorado ({e})")
+            continue
+        inicio = time.perf_counter()
+        previstos = backend.detect_batch(textos)
+        duracao = time.perf_counter() - inicio
+        acertos = sum(1 for p, r in zip(previstos, rotulos) if p.split("-")[0].lower() == r)
+        und = previstos.count("und")
+        logger.info(f"{name:>10}: acurácia {acertos / len(textos):.1%}, {und} 'und', "
+                    f"{len(textos) / duracao:,.0f} posts/s em 1 núcleo ({duracao:.2f}s)")
 
 
 def chunked_cursor(cursor, size):
@@ -164,6 +517,149 @@ def chunked_cursor(cursor, size):
         yield batch
 
 
+# --------------------------------
+#  PIPELINE: LEITURA → DETECÇÃO → ESCRITA
+# --------------------------------
+
+_FIM = object()
+
+
+def read_chunks(cursor, chunk_size: int, out_q: queue.Queue, num_shards: int = 1, shard_index: int = 0,
+                layout: str = "embedded", erros: list = None):
+    """
+    Estágio de leitura (thread): percorre o cursor, descarta documentos de outros shards e põe na
+    fila fatias de `chunk_size` documentos. A fila é limitada, então a leitura espera quando a
+    detecção está atrasada.
+    """
+    try:
+        for batch in chunked_cursor(cursor, chunk_size):
+            if num_shards > 1:
+                batch = [doc for doc in batch if compute_shard_for_id(doc["_id"], num_shards) == shard_index]
+            if layout == "posts":
+                # Cada post é um documento: vira um "documento" de um post só para os workers
+                batch = [{"_id": doc["_id"], "posts": [doc]} for doc in batch]
+            if batch:
+                out_q.put(batch)
+    except Exception as e:
+        logger.error(f"Falha ao ler o cursor: {e}")
+        if erros is not None:
+            erros.append(e)
+    finally:
+        out_q.put(_FIM)
+
+
+def bounded_chunks(in_q: queue.Queue, in_flight: threading.Semaphore):
+    """
+    Entrada do `imap_unordered`. O pool consome o iterável o mais rápido que pode; o semáforo
+    (liberado a cada resultado) limita quantas fatias ficam em voo, para a leitura não trazer o
+    cursor inteiro para a memória.
+    """
+    while True:
+        in_flight.acquire()
+        chunk = in_q.get()
+        if chunk is _FIM:
+            return
+        yield chunk
+
+
+class LangWriter(threading.Thread):
+    """
+    Estágio de escrita: recebe os resultados dos workers por uma fila limitada e grava os
+    idiomas em `bulk_write` não ordenados de até `batch_size` documentos, enquanto o pool segue
+    detectando.
+    """
+
+    def __init__(self, coll, layout: str, batch_size: int, max_pending: int):
+        super().__init__(name="lang-writer", daemon=True)
+        self.coll = coll
+        self.layout = layout
+        self.batch_size = batch_size
+        self.fila = queue.Queue(maxsize=max_pending)
+        self.atualizados = 0
+        self.alterados = 0
+        self.lotes = 0
+        self.caminhos = Counter()
+        self._ops = []
+
+    def submit(self, resultados: list):
+        self.fila.put(resultados)
+
+    def close(self):
+        self.fila.put(_FIM)
+        self.join()
+
+    def run(self):
+        while True:
+            resultados = self.fila.get()
+            if resultados is _FIM:
+                break
+            for doc_id, tamanho, novos, caminhos in resultados:
+                self.caminhos.update(caminhos)
+                if novos is None:
+                    logger.warning(f"Pulando update do doc_id={doc_id} (detect_lang falhou).")
+                elif novos:
+                    self._ops.append(lang_update(doc_id, tamanho, novos, self.layout))
+            if len(self._ops) >= self.batch_size:
+                self._flush()
+        self._flush()
+
+    def _flush(self):
+        ops, self._ops = self._ops, []
+        if not ops:
+            return
+        self.lotes += 1
+        atualizados = 0
+        try:
+            atualizados = self.coll.bulk_write(ops, ordered=False).matched_count
+        except BulkWriteError as e:
+            atualizados = e.details.get("nMatched", 0)
+            logger.error(f"Falha ao atualizar {len(e.details.get('writeErrors', []))} docs do lote: "
+                         f"{e.details.get('writeErrors', [])[:1]}")
+        except Exception as e:
+            logger.error(f"Falha no bulk_write do lote #{self.lotes}: {e}")
+        # Documentos que mudaram durante o lote (posts mesclados) ficam para a próxima execução
+        self.alterados += len(ops) - atualizados
+        self.atualizados += atualizados
+        logger.info(f"Lote #{self.lotes} gravado: {atualizados} docs. Posts: {self.caminhos['declarado']} por "
+                    f"idioma declarado, {self.caminhos['prefiltro']} pelo pré-classificador pt, "
+                    f"{self.caminhos['detectado']} detectados (acumulado).")
+
+
+def run_pipeline(pool, worker_fn, cursor, coll, args, num_workers: int, num_shards: int, shard_index: int):
+    """
+    Leitura do cursor, detecção no pool e escrita no Mongo em paralelo, ligadas por filas
+    limitadas: os workers não esperam pelo banco e o banco não espera pelos workers.
+    """
+    em_voo = args.queue_depth or 2 * num_workers
+    leitura_q = queue.Queue(maxsize=em_voo)
+    erros = []
+    leitor = threading.Thread(
+        target=read_chunks,
+        args=(cursor, args.chunk_size, leitura_q, num_shards, shard_index, args.layout, erros),
+        name="lang-reader", daemon=True
+    )
+    escritor = LangWriter(coll, args.layout, args.batch_size, max_pending=em_voo)
+    slots = threading.Semaphore(em_voo)
+
+    leitor.start()
+    escritor.start()
+    try:
+        for resultados in pool.imap_unordered(worker_fn, bounded_chunks(leitura_q, slots)):
+            slots.release()
+            escritor.submit(resultados)
+    finally:
+        # Grava o que já foi detectado mesmo se o pool falhar
+        escritor.close()
+    leitor.join()
+
+    if erros:
+        logger.error("A leitura terminou com erro; os documentos restantes ficam para a próxima execução.")
+    if escritor.alterados:
+        logger.warning(f"{escritor.alterados} docs mudaram durante a execução (posts mesclados) "
+                       f"e ficam para a próxima.")
+    return escritor
+
+
 # --------------------------------
 #  FUNÇÃO PRINCIPAL
 # --------------------------------
@@ -176,7 +672,19 @@ def main():
         "--batch-size",
         type=int,
         default=1000,
-        help="Número de documentos por lote (batch) para cada iteração (padrão: 1000)."
+        help="Documentos atualizados por bulk_write (padrão: 1000)."
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100,
+        help="Documentos por tarefa enviada a um worker; os textos da fatia vão ao backend numa chamada (padrão: 100)."
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=0,
+        help="Fatias em voo entre leitura, detecção e escrita (padrão: 2 × num-workers)."
     )
     parser.add_argument(
         "--num-workers",
@@ -196,6 +704,43 @@ def main():
         default=None,
         help="Índice deste shard (0 a num-shards-1). Se não informado, busca ENV_SHARD_INDEX ou assume 0."
     )
+    parser.add_argument(
+        "--always-detect",
+        action="store_true",
+        help="Ignora os idiomas declarados (`langs`) e roda a detecção em todos os posts."
+    )
+    parser.add_argument(
+        "--backend",
+        choices=sorted(BACKENDS),
+        default=LANG_BACKEND,
+        help="Detector de idioma: langdetect (padrão histórico), fasttext (lid.176, em lote) ou cld3."
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=0.0,
+        help="Probabilidade mínima para aceitar a predição do backend; abaixo disso grava 'und' (padrão: 0)."
+    )
+    parser.add_argument(
+        "--pt-prefilter",
+        action="store_true",
+        default=os.getenv("LANG_PT_PREFILTER", "false").lower() in ("1", "true", "yes"),
+        help="Classificador rápido pt/não-pt (palavras funcionais) antes do backend; só os ambíguos vão para ele."
+    )
+    parser.add_argument(
+        "--layout",
+        choices=["embedded", "posts"],
+        default="embedded",
+        help="embedded: posts embutidos em MONGO_COLLECTION_DATA (padrão); posts: um documento por post "
+             "em MONGO_COLLECTION_POSTS (layout normalizado do crawler)."
+    )
+    parser.add_argument(
+        "--compare",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Não grava nada: compara acurácia e posts/s de todos os backends instalados numa amostra de N posts."
+    )
 
     args = parser.parse_args()
 
@@ -226,7 +771,7 @@ def main():
     num_workers = args.num_workers
 
     logger.info(f"Parâmetros de shardização: num_shards={num_shards}, shard_index={shard_index}")
-    logger.info(f"Batch size={batch_size}, Num workers={num_workers}")
+    logger.info(f"Batch size={batch_size}, chunk size={args.chunk_size}, Num workers={num_workers}")
 
     # 2) Monta URI e abre conexão MongoDB
     mongo_uri = build_mongo_uri()
@@ -238,7 +783,7 @@ def main():
         sys.exit(1)
 
     db = client[MONGO_DB]
-    coll = db[MONGO_COLLECTION_DATA]
+    coll = db[MONGO_COLLECTION_POSTS if args.layout == "posts" else MONGO_COLLECTION_DATA]
 
     # 3) Contagem aproximada (estimated) de documentos
     try:
@@ -252,61 +797,44 @@ def main():
     else:
         logger.info("Não foi possível obter contagem estimada de documentos.")
 
-    # 4) Cria pool de workers
-    logger.info(f"Criando pool de {num_workers} processos (multiprocessing).")
-    pool = mp.Pool(processes=num_workers)
+    if args.compare:
+        compare_backends(coll, args.compare, list(BACKENDS), args.min_confidence)
+        client.close()
+        return
 
-    # 5) Monta cursor — apenas _id e posts, para economizar banda/CPU
+    # Falha cedo (ex.: pacote ou modelo ausente) em vez de em cada worker
     try:
-        cursor = coll.find({"posts.lang": {"$exists": False}}, {"posts": 1})
+        build_backend(args.backend, args.min_confidence)
     except Exception as e:
-        logger.error(f"Falha ao criar cursor: {e}")
+        logger.error(f"🛑 Backend '{args.backend}' indisponível: {e}")
         client.close()
         sys.exit(1)
 
-    processed = 0
-    batch_number = 0
-
-    # 6) Itera em batches de tamanho batch_size
-    for batch in chunked_cursor(cursor, batch_size):
-        batch_number += 1
-        logger.info(f"Iniciando batch #{batch_number} (tamanho lido: {len(batch)})")
-
-        # 6.1) Filtra localmente somente documentos que pertencem a este shard
-        if num_shards > 1:
-            filtered = []
-            for doc in batch:
-                if compute_shard_for_id(doc["_id"], num_shards) == shard_index:
-                    filtered.append(doc)
-            if not filtered:
-                # Nenhum documento deste lote pertence a este shard
-                continue
-            to_process = filtered
-        else:
-            to_process = batch
-
-        # 6.2) Mapeia os documentos para o pool de workers (detecta idioma)
-        try:
-            results = pool.map(process_document, to_process)
-        except Exception as e:
-            logger.error(f"Erro no pool.map: {e}")
-            break
+    # 4) Cria pool de workers (cada um carrega o backend uma vez)
+    logger.info(f"Criando pool de {num_workers} processos (multiprocessing), backend={args.backend}.")
+    pool = mp.Pool(processes=num_workers, initializer=init_worker, initargs=(args.backend, args.min_confidence))
 
-        # 6.3) Processa resultados e executa update no MongoDB (somente no processo principal)
-        for doc_id, updated_posts in results:
-            if updated_posts is None:
-                logger.warning(f"Pulando update do doc_id={doc_id} (detect_lang falhou).")
-                continue
+    # 5) Monta cursor — apenas os campos de cada post que a detecção usa, para economizar banda/CPU.
+    #    $elemMatch pega também documentos em que só parte dos posts (os novos, mesclados
+    #    pela coleta incremental) ainda não tem idioma. A projeção de subcampos mantém a ordem
+    #    (e portanto os índices) do array.
+    try:
+        if args.layout == "posts":
+            cursor = coll.find({"lang": {"$exists": False}}, {"text": 1, "langs": 1})
+        else:
+            cursor = coll.find({"posts": {"$elemMatch": {"lang": {"$exists": False}}}},
+                               {"posts.text": 1, "posts.langs": 1, "posts.lang": 1})
+    except Exception as e:
+        logger.error(f"Falha ao criar cursor: {e}")
+        client.close()
+        sys.exit(1)
 
-            filtro = {"_id": doc_id}
-            update = {"$set": {"posts": updated_posts}}
-            try:
-                coll.update_one(filtro, update)
-                processed += 1
-            except Exception as e:
-                logger.error(f"Falha ao atualizar doc_id={doc_id}: {e}")
+    worker_fn = partial(process_documents, always_detect=args.always_detect, prefilter=args.pt_prefilter)
 
-        logger.info(f"Batch #{batch_number} concluído. Atualizados: {len(results)} docs neste lote.")
+    # 6) Pipeline: leitura, detecção (imap_unordered) e bulk_write sobrepostos
+    escritor = run_pipeline(pool, worker_fn, cursor, coll, args, num_workers, num_shards, shard_index)
+    processed = escritor.atualizados
+    caminhos_total = escritor.caminhos
 
     # 7) Finaliza pool e conexão
     pool.close()
@@ -314,6 +842,14 @@ def main():
     client.close()
 
     logger.info(f"✨ Processamento finalizado. Total aproximado de documentos atualizados: {processed}")
+    total_posts = caminhos_total["declarado"] + caminhos_total["prefiltro"] + caminhos_total["detectado"]
+    if total_posts:
+        logger.info(
+            f"Idioma por caminho: {caminhos_total['declarado']} declarados "
+            f"({caminhos_total['declarado'] / total_posts:.1%}), {caminhos_total['prefiltro']} pelo pré-classificador "
+            f"({caminhos_total['prefiltro'] / total_posts:.1%}), {caminhos_total['detectado']} detectados "
+            f"por {args.backend}, {caminhos_total['existente']} já tinham idioma."
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,381 @@
+"""
+Acumula, página a página, os posts do author feed de um DID.
+
+Concentra a lógica por item que é igual nos modos de threads e async do crawler
+(`analise_bsky_prod.py`): o que guardar de cada post, quando parar de paginar e como gravar o
+resultado no Mongo.
+
+Modo incremental: recebendo `since` (URI e `created_at` do post mais novo já armazenado, salvos
+na task), o coletor para assim que alcança posts já conhecidos, e o resultado é mesclado no
+documento existente do DID com `$push`/`$each` em vez de gerar um documento novo.
+
+Layouts de armazenamento (`storage`):
+
+  - "embedded" (padrão): todos os posts do DID num único documento `{did, posts}`, gravado no
+    fim da coleta (uma coleta completa substitui o documento; a incremental mescla nele). Simples, mas a memória cresce com o histórico e contas prolíficas estouram o limite de 16 MB
+    do documento no Mongo;
+  - "buckets": cada página é gravada assim que chega (`drain`), no documento-balde aberto do DID
+    (`{did, posts, n, bytes}`), com o padrão de bucketing do Mongo: um upsert filtrado por
+    `n`/`bytes` empurra a página no balde que ainda cabe, ou cria um novo. A memória por DID fica
+    limitada a uma página e nenhum documento passa de `BUCKET_MAX_POSTS`/`BUCKET_MAX_BYTES`.
+    A ordem dos posts dentro de um balde não é garantida; use `created_at`. Cada coleta grava
+    em baldes próprios, marcados com a sua geração (`gen`) e com `partial: true` até terminar
+    (`finish` + `drain(final=True)`). A coleta seguinte do DID, completa ou incremental, começa
+    apagando os baldes parciais de outras gerações: uma tentativa que falhou no meio (e não
+    avançou a marca d'água) nunca deixa posts que a nova tentativa gravaria de novo. Uma coleta
+    completa só apaga os baldes anteriores do DID depois da última página, então se falhar os
+    antigos continuam lá. Cada coleta incremental abre ao menos um balde novo (pequeno, só com os
+    posts novos). Quem grava tudo de uma vez (o stream em tempo real) usa `staged=False`: sem
+    geração, empurra no balde aberto do DID que não seja parcial;
+  - "posts": um documento por post na coleção normalizada (`posts_store.py`), também gravado a
+    cada página. O upsert é por `(did, uri)`, então recoletar é idempotente e não precisa apagar
+    nada antes.
+
+Projeção (`fields`): além de `text` e `created_at`, que sempre são guardados, cada post leva os
+campos pedidos entre `POST_FIELDS`, com chaves e valores curtos para não inflar os documentos:
+
+  - uri, cid: identificam o post (dedupe, recoleta incremental, re-fetch pontual);
+  - langs: idiomas declarados pelo autor no record (`langs`, omitido se vazio);
+  - reply, repost: flags `is_reply`/`is_repost`;
+  - facets: tipos de facet presentes, sem o namespace (`["link", "mention", "tag"]`);
+  - embed: tipo do embed (`"images"`, `"external"`, `"record"`, ...).
+
+O layout "posts" sempre inclui uri, reply e repost.
+
+Reposts (conteúdo de outras contas no feed do autor) são descartados antes de guardar, a menos
+que `keep_reposts=True`; `skipped` conta o que foi descartado.
+
+Orçamento por DID: a paginação também para ao guardar `max_posts` posts, ao chegar num post
+próprio mais antigo que `max_age` ou depois de `max_pages` páginas (0/None = sem limite).
+`stopped_by` registra o motivo da parada. No modo incremental, `max_posts` e `max_pages` são
+ignorados: a marca d'água avança para o post mais novo, então parar antes de alcançar os posts
+conhecidos deixaria para sempre uma lacuna entre eles. `max_age` continua valendo, porque o que
+fica de fora já está fora da janela.
+"""
+
+import os
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from pymongo import DeleteMany, ReplaceOne, UpdateMany, UpdateOne
+
+load_dotenv()
+
+BUCKET_MAX_POSTS = int(os.getenv("BUCKET_MAX_POSTS", 1000))
+# Bem abaixo dos 16 MB do Mongo: o tamanho é estimado pelo texto, sem o overhead do BSON
+BUCKET_MAX_BYTES = int(os.getenv("BUCKET_MAX_BYTES", 4 * 1024 * 1024))
+
+POST_FIELDS = ("uri", "cid", "langs", "reply", "repost", "facets", "embed")
+DEFAULT_FIELDS = ("uri", "cid", "langs", "reply", "repost", "facets")
+
+
+def parse_created_at(value):
+    """
+    Converte o `created_at` de um record (ISO 8601, com `Z` ou offset) em datetime com fuso.
+    Devolve None se o valor não puder ser interpretado.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def is_repost(item) -> bool:
+    reason = getattr(item, "reason", None)
+    return reason is not None and str(getattr(reason, "py_type", "")).endswith("reasonRepost")
+
+
+def parse_fields(value) -> tuple:
+    """
+    Lista de campos separada por vírgulas (`"uri,langs,reply"`) -> tupla validada.
+    """
+    if isinstance(value, (list, tuple)):
+        fields = tuple(value)
+    else:
+        fields = tuple(f.strip() for f in (value or "").split(",") if f.strip())
+    unknown = [f for f in fields if f not in POST_FIELDS]
+    if unknown:
+        raise ValueError(f"Campos desconhecidos: {', '.join(unknown)} (válidos: {', '.join(POST_FIELDS)})")
+    return fields
+
+
+def _attr(obj, name: str, json_name: str = None):
+    # Records chegam como modelos do atproto (author feed) ou como dicts JSON (stream)
+    if isinstance(obj, dict):
+        return obj.get(json_name or name)
+    return getattr(obj, name, None)
+
+
+def _short_type(obj):
+    """
+    `app.bsky.richtext.facet#link` -> `link`, `app.bsky.embed.images` -> `images`.
+    """
+    nsid = obj.get("$type") if isinstance(obj, dict) else getattr(obj, "py_type", None)
+    return str(nsid).rsplit(".", 1)[-1].split("#")[-1] if nsid else None
+
+
+def project_post(record, uri: str = None, cid: str = None, repost: bool = False,
+                 fields=DEFAULT_FIELDS) -> dict:
+    """
+    Monta o dict guardado de um post a partir do seu record, com os campos de `fields`.
+    """
+    post = {
+        'text':       _attr(record, 'text') or '',
+        'created_at': _attr(record, 'created_at', 'createdAt'),
+    }
+    if 'uri' in fields:
+        post['uri'] = uri
+    if 'cid' in fields:
+        post['cid'] = cid
+    if 'langs' in fields:
+        langs = _attr(record, 'langs')
+        if langs:
+            post['langs'] = list(langs)
+    if 'reply' in fields:
+        post['is_reply'] = _attr(record, 'reply') is not None
+    if 'repost' in fields:
+        post['is_repost'] = repost
+    if 'facets' in fields:
+        types = {
+            _short_type(feature)
+            for facet in (_attr(record, 'facets') or [])
+            for feature in (_attr(facet, 'features') or [])
+        }
+        types.discard(None)
+        if types:
+            post['facets'] = sorted(types)
+    if 'embed' in fields:
+        embed = _attr(record, 'embed')
+        if embed is not None:
+            post['embed'] = _short_type(embed)
+    return post
+
+
+def task_since(task: dict) -> dict:
+    """
+    Marca d'água salva na task pela última coleta incremental (ou None se nunca houve uma).
+    """
+    if not task.get("last_post_uri") and not task.get("last_post_at"):
+        return None
+    return {"uri": task.get("last_post_uri"), "created_at": task.get("last_post_at")}
+
+
+def legacy_uri(post: dict) -> str:
+    """
+    Posts coletados antes de guardarmos a URI recebem uma chave estável derivada do conteúdo.
+    """
+    key = f"{post.get('created_at', '')}|{post.get('text', '')}"
+    return "legacy:" + hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def post_upsert(did: str, post: dict, **extra) -> UpdateOne:
+    """
+    Upsert de um post (dict no formato do coletor) no layout normalizado "posts". `created_at`
+    é gravado como datetime; `lang`, se já detectado, é preservado.
+    """
+    uri = post.get('uri') or legacy_uri(post)
+    fields = {k: v for k, v in post.items() if k not in ('uri', 'created_at')}
+    fields['created_at'] = parse_created_at(post.get('created_at'))
+    fields.update(extra)
+
+    return UpdateOne(
+        {'did': did, 'uri': uri},
+        {'$set': fields, '$setOnInsert': {'fetched_at': datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+def _post_size(post: dict) -> int:
+    return sum(len(str(v)) for v in post.values()) + 16 * len(post)
+
+
+class FeedCollector:
+    def __init__(self, did: str, since: dict = None, storage: str = "embedded", incremental: bool = False,
+                 fields=DEFAULT_FIELDS, keep_reposts: bool = False,
+                 max_posts: int = None, max_age: timedelta = None, max_pages: int = None,
+                 staged: bool = True):
+        self.did = did
+        self.keep_reposts = keep_reposts
+        # Uma coleta incremental sempre vai até os posts já armazenados (ver docstring do módulo)
+        self.max_posts = None if incremental else max_posts or None
+        self.max_pages = None if incremental else max_pages or None
+        self.oldest_allowed = datetime.now(timezone.utc) - max_age if max_age else None
+        self.fields = set(fields) | ({'uri', 'reply', 'repost'} if storage == "posts" else set())
+        self.since_uri = (since or {}).get("uri")
+        self.since_at = parse_created_at((since or {}).get("created_at"))
+        self.storage = storage
+        self.incremental = incremental
+        # No layout "buckets", só os posts ainda não gravados
+        self.posts = []
+        self.count = 0
+        self.pages = 0
+        self.skipped = {'reposts': 0}
+        # Geração dos baldes desta coleta (ver docstring do módulo)
+        self.generation = uuid.uuid4().hex if storage == "buckets" and staged else None
+        # True depois que os baldes parciais de tentativas anteriores entraram num `drain`
+        self._cleaned = False
+        # Post próprio mais novo visto nesta coleta (vira a nova marca d'água)
+        self.newest = None
+        # True quando a paginação deve parar: alcançou posts já armazenados ou estourou o orçamento
+        self.done = False
+        self.stopped_by = None
+        # True só depois que a paginação terminou sem erro (`finish`); antes disso a marca d'água não avança
+        self.complete = False
+
+    def _reached_known(self, item) -> bool:
+        if self.since_uri and item.post.uri == self.since_uri:
+            return True
+        # Reposts carregam o created_at do post original, que pode ser antigo
+        if self.since_at and not is_repost(item):
+            created = parse_created_at(item.post.record.created_at)
+            return created is not None and created < self.since_at
+        return False
+
+    def _stop(self, reason: str):
+        self.done = True
+        self.stopped_by = reason
+
+    def _too_old(self, item, repost: bool) -> bool:
+        # Reposts carregam o created_at do post original, então não limitam a janela
+        if self.oldest_allowed is None or repost:
+            return False
+        created = parse_created_at(item.post.record.created_at)
+        return created is not None and created < self.oldest_allowed
+
+    def add_page(self, feed: list):
+        self.pages += 1
+        for item in feed:
+            if self._reached_known(item):
+                self._stop("known")
+                break
+
+            repost = is_repost(item)
+            if self._too_old(item, repost):
+                self._stop("max_age")
+                break
+            if repost and not self.keep_reposts:
+                self.skipped['reposts'] += 1
+                continue
+
+            if self.newest is None and not repost:
+                self.newest = {"uri": item.post.uri, "created_at": item.post.record.created_at}
+
+            self.posts.append(project_post(
+                item.post.record, item.post.uri, item.post.cid, repost, self.fields
+            ))
+            self.count += 1
+            if self.max_posts and self.count >= self.max_posts:
+                self._stop("max_posts")
+                break
+
+        if not self.done and self.max_pages and self.pages >= self.max_pages:
+            self._stop("max_pages")
+
+    def extend(self, posts: list):
+        """
+        Acrescenta posts que não vieram do author feed (ex.: do stream em tempo real), já no
+        formato de `add_page`.
+        """
+        self.posts.extend(posts)
+        self.count += len(posts)
+
+    def finish(self):
+        """
+        Chamado quando a paginação acabou (fim do feed ou parada pelo coletor), sem erro.
+        """
+        self.complete = True
+
+    def summary(self) -> str:
+        skipped = ", ".join(f"{n} {kind}" for kind, n in self.skipped.items() if n)
+        return f"{self.count} posts" + (f" ({skipped} ignorados)" if skipped else "")
+
+    def watermark(self) -> dict:
+        """
+        Campos a gravar na task junto com a confirmação (vazio se não houve post novo ou se a
+        paginação não terminou: uma coleta interrompida não pode pular os posts que faltaram).
+        """
+        if self.newest is None or not self.complete:
+            return {}
+        return {"last_post_uri": self.newest["uri"], "last_post_at": self.newest["created_at"]}
+
+    def data_op(self):
+        """
+        Operação de escrita na coleção de dados para o `bulk_write` (layout "embedded"). Uma coleta
+        completa substitui o documento do DID; no modo incremental, os posts novos entram no início
+        do array `posts` desse mesmo documento.
+        """
+        now = datetime.now(timezone.utc)
+        # `n` só existe nos baldes, que podem dividir a coleção com o layout embutido
+        if not self.incremental:
+            return ReplaceOne({'did': self.did, 'n': {'$exists': False}},
+                              {'did': self.did, 'posts': self.posts, 'fetched_at': now}, upsert=True)
+        return UpdateOne(
+            {'did': self.did, 'n': {'$exists': False}},
+            {
+                '$push': {'posts': {'$each': self.posts, '$position': 0}},
+                '$set':  {'fetched_at': now},
+            },
+            upsert=True
+        )
+
+    def _bucket_op(self, posts: list, complete: bool = False) -> UpdateOne:
+        size = sum(_post_size(p) for p in posts)
+        now = datetime.now(timezone.utc)
+        query = {
+            'did':   self.did,
+            'n':     {'$lte': max(BUCKET_MAX_POSTS - len(posts), 0)},
+            'bytes': {'$lte': max(BUCKET_MAX_BYTES - size, 0)},
+        }
+        update = {
+            '$push':        {'posts': {'$each': posts}},
+            '$inc':         {'n': len(posts), 'bytes': size},
+            '$set':         {'fetched_at': now},
+            '$setOnInsert': {'opened_at': now},
+        }
+        if not self.generation:
+            query['partial'] = {'$ne': True}
+        elif complete:
+            # A última página já nasce confirmada, em qualquer ordem do bulk_write
+            query['gen'] = self.generation
+            update['$unset'] = {'partial': ''}
+        else:
+            query['gen'] = self.generation
+            update['$setOnInsert']['partial'] = True
+        return UpdateOne(query, update, upsert=True)
+
+    def drain(self, final: bool = False) -> list:
+        """
+        Operações a gravar agora. Nos layouts "buckets" e "posts" devolve os posts acumulados
+        desde a última chamada (chamada a cada página) e libera a memória; no "embedded" só
+        devolve algo com `final=True`. Nos baldes, a primeira escrita apaga os baldes parciais de
+        tentativas anteriores, e `final=True` depois de `finish` confirma os baldes desta coleta
+        (e, numa coleta completa, apaga os das gerações anteriores do DID).
+        """
+        if self.storage == "posts":
+            ops = [post_upsert(self.did, p) for p in self.posts]
+            self.posts = []
+            return ops
+        if self.storage != "buckets":
+            return [self.data_op()] if final else []
+
+        ops = []
+        buckets = {'did': self.did, 'n': {'$exists': True}}
+        if self.generation and (self.posts or final) and not self._cleaned:
+            ops.append(DeleteMany({**buckets, 'partial': True, 'gen': {'$ne': self.generation}}))
+            self._cleaned = True
+        complete = final and self.complete
+        if self.posts:
+            ops.append(self._bucket_op(self.posts, complete=complete))
+        if complete and self.generation:
+            ops.append(UpdateMany({**buckets, 'gen': self.generation, 'partial': True}, {'$unset': {'partial': ''}}))
+            if not self.incremental:
+                ops.append(DeleteMany({**buckets, 'gen': {'$ne': self.generation}}))
+        self.posts = []
+        return ops
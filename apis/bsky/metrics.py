@@ -0,0 +1,383 @@
+"""
+Métricas de coleta: contadores, gauges e histogramas em memória, expostos de duas formas.
+
+  - Endpoint HTTP no formato texto do Prometheus (`serve(port)`, rota `/metrics`), para
+    raspagem direta de cada worker.
+  - Documentos periódicos no Mongo (`MongoReporter`, coleção `MONGO_COLLECTION_METRICS`), um
+    por processo (`<worker>:<pid>`), com os valores acumulados e as taxas do último intervalo;
+    `python apis/bsky/metrics.py summary` soma os documentos recentes em uma visão da frota
+    (posts/s, 429s, latência, atraso de cada worker).
+
+O registro é um só por processo (`METRICS`); `rate_limit.py` alimenta as métricas de XRPC
+(latência por método, bytes, status, esperas do balde) e o crawler as de tasks, páginas e posts.
+Sem dependência externa: o formato do Prometheus é gerado aqui.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+
+METRICS_COLLECTION = os.getenv("MONGO_COLLECTION_METRICS", "metrics")
+# Documentos de processos que pararam de reportar somem depois disso (índice TTL)
+METRICS_TTL_SECONDS = int(os.getenv("METRICS_TTL_SECONDS", 86400))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'crawler_tasks_claimed_total':           ("counter", "Tasks reservadas por este processo."),
+    'crawler_tasks_completed_total':         ("counter", "Tasks concluídas."),
+    'crawler_tasks_failed_total':            ("counter", "Tasks com erro (devolvidas com backoff ou failed)."),
+    'crawler_pages_fetched_total':           ("counter", "Páginas do get_author_feed recebidas."),
+    'crawler_posts_stored_total':            ("counter", "Posts gravados."),
+    'crawler_last_task_timestamp':           ("gauge",   "Horário (epoch) da última task concluída."),
+    'crawler_tasks_pending':                 ("gauge",   "Tasks pendentes no shard deste worker."),
+    'crawler_queue_size':                    ("gauge",   "Tasks reservadas aguardando uma corrotina (modo async)."),
+    'xrpc_requests_total':                   ("counter", "Chamadas XRPC por método e status."),
+    'xrpc_response_bytes_total':             ("counter", "Bytes recebidos (content-length) por método."),
+    'xrpc_request_seconds':                  ("histogram", "Latência das chamadas XRPC por método, sem a espera do balde."),
+    'ratelimit_sleeps_total':                ("counter", "Vezes em que o balde de rate limit fez a chamada esperar."),
+    'ratelimit_sleep_seconds_total':         ("counter", "Tempo total de espera no balde de rate limit."),
+    'ratelimit_429_total':                   ("counter", "Respostas 429 recebidas."),
+}
+
+# Contadores cuja taxa por segundo vai para os documentos do Mongo
+RATE_COUNTERS = (
+    'crawler_tasks_completed_total', 'crawler_pages_fetched_total', 'crawler_posts_stored_total',
+    'xrpc_requests_total', 'xrpc_response_bytes_total', 'ratelimit_429_total',
+)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimativa pelo limite superior do bucket (como o `histogram_quantile` do Prometheus,
+        sem interpolação).
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        acc = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            acc += n
+            if acc >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Registro thread-safe. Séries são identificadas por nome + labels (`inc('x', method='y')`).
+    Gauges podem ser funções (`gauge_fn`), avaliadas só na leitura.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_fns = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, n: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def gauge_fn(self, name: str, fn, **labels):
+        with self._lock:
+            self._gauge_fns[self._key(name, labels)] = fn
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def _read_gauges(self) -> dict:
+        gauges = dict(self._gauges)
+        for key, fn in list(self._gauge_fns.items()):
+            try:
+                gauges[key] = fn()
+            except Exception as e:
+                print(f"[WARN] gauge {key[0]} ignorado: {e}")
+        return gauges
+
+    def totals(self) -> dict:
+        """
+        Contadores somados por nome (todas as labels).
+        """
+        out = {}
+        with self._lock:
+            for (name, _), value in self._counters.items():
+                out[name] = out.get(name, 0) + value
+        return out
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (h.bounds, list(h.counts), h.sum, h.count, h.quantile(0.5), h.quantile(0.95))
+                          for k, h in self._histograms.items()}
+        gauges = self._read_gauges()
+
+        def series(items):
+            return [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in items]
+
+        return {
+            'counters':   series(sorted(counters.items())),
+            'gauges':     series(sorted(gauges.items())),
+            'histograms': [{
+                'name': name, 'labels': dict(labels), 'count': count, 'sum': total,
+                'p50': p50, 'p95': p95,
+                'le': [str(b) for b in bounds] + ["+Inf"], 'counts': counts,
+            } for (name, labels), (bounds, counts, total, count, p50, p95) in sorted(histograms.items())],
+        }
+
+    def render(self) -> str:
+        """
+        Formato texto de exposição do Prometheus (0.0.4).
+        """
+        snap = self.snapshot()
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name in typed:
+                return
+            typed.add(name)
+            help_kind, text = HELP.get(name, (kind, ""))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {help_kind}")
+
+        for kind in ('counters', 'gauges'):
+            for s in snap[kind]:
+                header(s['name'], 'counter' if kind == 'counters' else 'gauge')
+                lines.append(f"{s['name']}{_labels(s['labels'])} {_num(s['value'])}")
+
+        for h in snap['histograms']:
+            header(h['name'], 'histogram')
+            acc = 0
+            for bound, n in zip(h['le'], h['counts']):
+                acc += n
+                lines.append(f"{h['name']}_bucket{_labels({**h['labels'], 'le': bound})} {acc}")
+            lines.append(f"{h['name']}_sum{_labels(h['labels'])} {_num(h['sum'])}")
+            lines.append(f"{h['name']}_count{_labels(h['labels'])} {h['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                    for k, v in labels.items())
+    return "{" + body + "}"
+
+
+def _num(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+METRICS = Metrics()
+
+
+def xrpc_method(url: str) -> str:
+    return str(url or "").rsplit("/", 1)[-1] or "unknown"
+
+
+# --------------------------------
+#  EXPOSIÇÃO
+# --------------------------------
+
+def serve(port: int, registry: Metrics = METRICS, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Sobe o endpoint `/metrics` numa thread daemon.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[metrics] Endpoint Prometheus em http://{host}:{port}/metrics")
+    return server
+
+
+class MongoReporter:
+    """
+    Grava a cada `interval` segundos um documento `<worker>:<pid>` com o snapshot do registro e
+    as taxas por segundo do intervalo. `stop()` faz a última gravação.
+    """
+
+    def __init__(self, coll, worker_id: str, interval: float, registry: Metrics = METRICS):
+        self.coll = coll
+        self.worker_id = worker_id
+        self.interval = interval
+        self.registry = registry
+        self.doc_id = f"{worker_id}:{os.getpid()}"
+        self.started_at = datetime.now(timezone.utc)
+        self._last = (registry.totals(), time.monotonic())
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        ensure_metrics_indexes(self.coll)
+        self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+        self.report()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                print(f"[{self.worker_id}] Erro ao gravar métricas: {e}")
+
+    def report(self):
+        totals = self.registry.totals()
+        prev, prev_t = self._last
+        now_t = time.monotonic()
+        elapsed = max(now_t - prev_t, 1e-9)
+        self._last = (totals, now_t)
+
+        self.coll.update_one(
+            {'_id': self.doc_id},
+            {'$set': {
+                'worker':     self.worker_id,
+                'host':       socket.gethostname(),
+                'pid':        os.getpid(),
+                'started_at': self.started_at,
+                'updated_at': datetime.now(timezone.utc),
+                'totals':     totals,
+                'rates':      {name: (totals.get(name, 0) - prev.get(name, 0)) / elapsed for name in RATE_COUNTERS},
+                **self.registry.snapshot(),
+            }},
+            upsert=True
+        )
+
+
+def ensure_metrics_indexes(coll):
+    try:
+        coll.create_index("updated_at", expireAfterSeconds=METRICS_TTL_SECONDS)
+    except Exception as e:
+        print(f"[WARN] create_index(metrics.updated_at) ignorado: {e}")
+
+
+def fleet_summary(coll, max_age_seconds: float = 300) -> dict:
+    """
+    Soma os documentos dos processos que reportaram nos últimos `max_age_seconds`.
+    """
+    now = datetime.now(timezone.utc)
+    docs = list(coll.find({'updated_at': {'$gte': now - timedelta(seconds=max_age_seconds)}}))
+    fleet = {'workers': len(docs), 'totals': {}, 'rates': {}}
+    workers = []
+    for doc in docs:
+        for kind in ('totals', 'rates'):
+            for name, value in (doc.get(kind) or {}).items():
+                fleet[kind][name] = fleet[kind].get(name, 0) + value
+
+        last_task = next((g['value'] for g in doc.get('gauges', []) if g['name'] == 'crawler_last_task_timestamp'), None)
+        feed = next((h for h in doc.get('histograms', [])
+                     if h['name'] == 'xrpc_request_seconds' and h['labels'].get('method') == 'app.bsky.feed.getAuthorFeed'),
+                    None)
+        updated = doc['updated_at'].replace(tzinfo=doc['updated_at'].tzinfo or timezone.utc)
+        workers.append({
+            'id':              doc['_id'],
+            'posts_per_s':     (doc.get('rates') or {}).get('crawler_posts_stored_total', 0),
+            'pages_per_s':     (doc.get('rates') or {}).get('crawler_pages_fetched_total', 0),
+            'tasks_done':      (doc.get('totals') or {}).get('crawler_tasks_completed_total', 0),
+            'rate_limited_s':  (doc.get('totals') or {}).get('ratelimit_sleep_seconds_total', 0),
+            'feed_p95_s':      feed['p95'] if feed else None,
+            'report_lag_s':    (now - updated).total_seconds(),
+            'idle_s':          time.time() - last_task if last_task else None,
+        })
+    fleet['workers_detail'] = sorted(workers, key=lambda w: w['id'])
+    return fleet
+
+
+def print_summary(summary: dict):
+    rates, totals = summary['rates'], summary['totals']
+    print(f"Workers ativos: {summary['workers']}")
+    print(f"  posts/s: {rates.get('crawler_posts_stored_total', 0):.1f}  "
+          f"páginas/s: {rates.get('crawler_pages_fetched_total', 0):.1f}  "
+          f"tasks/s: {rates.get('crawler_tasks_completed_total', 0):.2f}  "
+          f"429/s: {rates.get('ratelimit_429_total', 0):.2f}  "
+          f"MB/s: {rates.get('xrpc_response_bytes_total', 0) / 1e6:.2f}")
+    print(f"  total: {totals.get('crawler_tasks_completed_total', 0):.0f} tasks, "
+          f"{totals.get('crawler_tasks_failed_total', 0):.0f} com erro, "
+          f"{totals.get('crawler_posts_stored_total', 0):.0f} posts, "
+          f"{totals.get('ratelimit_sleep_seconds_total', 0):.0f}s esperando o rate limit")
+    for w in summary['workers_detail']:
+        p95 = f"{w['feed_p95_s']:g}s" if w['feed_p95_s'] is not None else "-"
+        idle = f"{w['idle_s']:.0f}s" if w['idle_s'] is not None else "-"
+        print(f"  {w['id']}: {w['posts_per_s']:.1f} posts/s, {w['tasks_done']:.0f} tasks, "
+              f"p95 getAuthorFeed {p95}, espera no balde {w['rate_limited_s']:.0f}s, "
+              f"último report há {w['report_lag_s']:.0f}s, sem concluir task há {idle}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumo das métricas da frota de coletores.")
+    parser.add_argument("command", choices=["summary"],
+                        help="summary: soma os documentos de métricas recentes de todos os workers.")
+    parser.add_argument("--max-age", type=float, default=300,
+                        help="Considera só processos que reportaram nos últimos N segundos (padrão: 300).")
+    args = parser.parse_args()
+
+    uri = (
+        f"mongodb://{os.getenv('MONGO_USER')}:{os.getenv('MONGO_PASS')}@{os.getenv('MONGO_HOST')}:"
+        f"{os.getenv('MONGO_PORT')}/?authSource={os.getenv('MONGO_AUTH_DB')}"
+    )
+    client = MongoClient(uri)
+    print_summary(fleet_summary(client[os.getenv("MONGO_DB")][METRICS_COLLECTION], args.max_age))
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
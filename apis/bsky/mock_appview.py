@@ -0,0 +1,502 @@
+"""
+AppView falso para exercitar a coleta offline, e benchmark do crawler em cima dele.
+
+O servidor (`MockAppView`) responde, com dados sintéticos e determinísticos por DID:
+
+  - `app.bsky.feed.getAuthorFeed`: posts paginados (cursor = deslocamento), com respostas,
+    reposts e `langs` variados; respeita `limit` e `filter=posts_no_replies`;
+  - `app.bsky.graph.getFollowers` / `getFollows`: perfis paginados;
+  - `com.atproto.identity.resolveHandle`.
+
+Latência configurável (`latency` ± `jitter` segundos por requisição) e dois tipos de 429: uma
+cota do servidor (`limit` requisições por `window` segundos, anunciada nos cabeçalhos
+`ratelimit-*` como no Bluesky) e 429 aleatórios (`error_rate`), com `ratelimit-reset` curto.
+
+Comandos:
+  - `serve`: sobe só o servidor; aponte `PUBLIC_APPVIEW_URL` para ele e rode o crawler ou o
+    populate_tasks com `APPVIEW_MODE=public`;
+  - `benchmark`: sobe o servidor, cria N tasks num banco descartável (mongomock, ou um mongod
+    local com `--mongo-uri`), roda o crawler (`crawl --appview public`) no mesmo processo e
+    mostra DIDs/s, posts/s, 429s e a latência observada. Argumentos depois de `--` vão para o
+    crawler (ex.: `-- --mode async --concurrency 64`; o modo async exige um mongod).
+
+O mongomock não usa índices (cada upsert varre a coleção): serve para medir o caminho do
+cliente e do limitador, mas a gravação pesa mais do que no DocumentDB. Para comparar mudanças de
+batching/armazenamento, use um mongod local.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from pymongo import MongoClient, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from apis.bsky.sharding import shard_fields
+
+HANDLE_DOMAIN = "mock.test"
+LANGS = (["pt"], ["pt"], ["en"], ["pt", "en"], ["es"], None)
+
+
+def _h(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+
+def mock_did(seed: str) -> str:
+    return f"did:plc:{hashlib.sha1(seed.encode('utf-8')).hexdigest()[:24]}"
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _profile(did: str) -> dict:
+    return {'did': did, 'handle': f"{did.rsplit(':', 1)[-1][:12]}.{HANDLE_DOMAIN}"}
+
+
+class MockData:
+    """
+    Conteúdo sintético: o número de posts, seguidores e o conteúdo de cada post dependem só do
+    DID, então duas execuções do benchmark veem exatamente os mesmos dados.
+    """
+
+    def __init__(self, posts_min: int = 50, posts_max: int = 500, followers_max: int = 300, epoch: datetime = None):
+        self.posts_min = posts_min
+        self.posts_max = posts_max
+        self.followers_max = followers_max
+        self.epoch = epoch or datetime.now(timezone.utc).replace(microsecond=0)
+
+    def feed_size(self, did: str) -> int:
+        return self.posts_min + _h(f"size:{did}") % (self.posts_max - self.posts_min + 1)
+
+    def feed_item(self, did: str, idx: int) -> dict:
+        """
+        Item `idx` do author feed (0 = mais recente): um a cada 10 é repost, um a cada 4 é resposta.
+        """
+        step = 600 + _h(f"step:{did}") % 7200
+        created = self.epoch - timedelta(seconds=idx * step)
+        repost = idx % 10 == 9
+        author = mock_did(f"repost:{did}:{idx}") if repost else did
+        rkey = f"3mock{idx:09d}"
+        uri = f"at://{author}/app.bsky.feed.post/{rkey}"
+        record = {
+            '$type':     'app.bsky.feed.post',
+            'text':      f"Post sintético {idx} de {author}",
+            'createdAt': _iso(created),
+        }
+        langs = LANGS[idx % len(LANGS)]
+        if langs:
+            record['langs'] = langs
+        if idx % 4 == 3 and not repost:
+            parent = {'uri': f"at://{mock_did(f'parent:{idx}')}/app.bsky.feed.post/3parent", 'cid': "bafyreiparent"}
+            record['reply'] = {'root': parent, 'parent': parent}
+
+        item = {'post': {
+            'uri':       uri,
+            'cid':       f"bafyrei{hashlib.sha1(uri.encode('utf-8')).hexdigest()[:40]}",
+            'author':    _profile(author),
+            'record':    record,
+            'indexedAt': _iso(created),
+        }}
+        if repost:
+            item['reason'] = {
+                '$type':     'app.bsky.feed.defs#reasonRepost',
+                'by':        _profile(did),
+                'indexedAt': _iso(created),
+            }
+        return item
+
+    def author_feed(self, did: str, cursor: int, limit: int, no_replies: bool = False):
+        size = self.feed_size(did)
+        feed = []
+        idx = cursor
+        while idx < size and len(feed) < limit:
+            item = self.feed_item(did, idx)
+            idx += 1
+            if no_replies and 'reply' in item['post']['record'] and 'reason' not in item:
+                continue
+            feed.append(item)
+        return feed, (str(idx) if idx < size else None)
+
+    def graph(self, actor: str, relation: str, cursor: int, limit: int):
+        total = _h(f"{relation}:{actor}") % (self.followers_max + 1)
+        end = min(cursor + limit, total)
+        profiles = [_profile(mock_did(f"{relation}:{actor}:{i}")) for i in range(cursor, end)]
+        return profiles, (str(end) if end < total else None)
+
+
+class ServerQuota:
+    """
+    Cota do servidor no estilo do Bluesky: `limit` requisições por janela fixa de `window` s.
+    """
+
+    def __init__(self, limit: int, window: float, error_rate: float = 0.0, reset_seconds: float = 1.0):
+        self.limit = limit
+        self.window = window
+        self.error_rate = error_rate
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._used = 0
+        self.served = 0
+        self.rejected = 0
+
+    def take(self):
+        """
+        Devolve `(permitido, cabeçalhos ratelimit-*)`.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._window_start >= self.window:
+                self._window_start = now
+                self._used = 0
+            self._used += 1
+            reset = self._window_start + self.window
+            allowed = self._used <= self.limit
+            injected = allowed and self.error_rate > 0 and random.random() < self.error_rate
+            if injected:
+                reset = now + self.reset_seconds
+            remaining = 0 if injected else max(self.limit - self._used, 0)
+            if allowed and not injected:
+                self.served += 1
+            else:
+                self.rejected += 1
+
+        headers = {
+            'ratelimit-limit':     str(self.limit),
+            'ratelimit-remaining': str(remaining),
+            'ratelimit-reset':     str(int(reset + 0.999)),
+            'ratelimit-policy':    f"{self.limit};w={int(self.window)}",
+        }
+        return allowed and not injected, headers
+
+
+class MockAppView:
+    def __init__(self, data: MockData = None, quota: ServerQuota = None, latency: float = 0.0,
+                 jitter: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.data = data or MockData()
+        self.quota = quota or ServerQuota(limit=3000, window=300)
+        self.latency = latency
+        self.jitter = jitter
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-appview", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def route(self, method: str, params: dict):
+        """
+        Devolve `(status, corpo)` de uma chamada XRPC.
+        """
+        limit = min(int(params.get('limit', 50)), 100)
+        cursor = int(params.get('cursor') or 0)
+
+        if method == "app.bsky.feed.getAuthorFeed":
+            feed, next_cursor = self.data.author_feed(
+                params['actor'], cursor, limit, no_replies=params.get('filter') == "posts_no_replies"
+            )
+            return 200, {'feed': feed, **({'cursor': next_cursor} if next_cursor else {})}
+
+        if method in ("app.bsky.graph.getFollowers", "app.bsky.graph.getFollows"):
+            relation = "followers" if method.endswith("Followers") else "follows"
+            actor = params['actor'] if params['actor'].startswith("did:") else mock_did(params['actor'])
+            profiles, next_cursor = self.data.graph(actor, relation, cursor, limit)
+            return 200, {'subject': _profile(actor), relation: profiles,
+                         **({'cursor': next_cursor} if next_cursor else {})}
+
+        if method == "com.atproto.identity.resolveHandle":
+            return 200, {'did': mock_did(params['handle'])}
+
+        return 501, {'error': "MethodNotImplemented", 'message': f"Mock não implementa {method}"}
+
+    def _handler(self):
+        appview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                method = parsed.path.rsplit("/", 1)[-1]
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+
+                if appview.latency or appview.jitter:
+                    time.sleep(max(appview.latency + random.uniform(-appview.jitter, appview.jitter), 0))
+
+                allowed, headers = appview.quota.take()
+                if not allowed:
+                    status, body = 429, {'error': "RateLimitExceeded", 'message': "Rate Limit Exceeded"}
+                else:
+                    try:
+                        status, body = appview.route(method, params)
+                    except (KeyError, ValueError) as e:
+                        status, body = 400, {'error': "InvalidRequest", 'message': str(e)}
+                self._send(status, body, headers)
+
+            def _send(self, status: int, body: dict, headers: dict):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# --------------------------------
+#  BANCO DESCARTÁVEL
+# --------------------------------
+
+class MockCollection:
+    """
+    Coleção do mongomock com `bulk_write` aplicado operação a operação (o `bulk_write` do
+    mongomock não acompanha as classes de operação do pymongo 4.x).
+    """
+
+    def __init__(self, coll):
+        self._coll = coll
+
+    def __getattr__(self, name):
+        return getattr(self._coll, name)
+
+    def bulk_write(self, ops, ordered: bool = True):
+        result = {'inserted': 0, 'matched': 0, 'modified': 0, 'deleted': 0, 'upserted': 0, 'errors': []}
+        for i, op in enumerate(ops):
+            try:
+                self._apply(op, result)
+            except DuplicateKeyError as e:
+                result['errors'].append({'index': i, 'code': 11000, 'errmsg': str(e)})
+                if ordered:
+                    break
+        if result['errors']:
+            raise BulkWriteError({'writeErrors': result['errors'], 'nInserted': result['inserted'],
+                                  'nUpserted': result['upserted'], 'nMatched': result['matched'],
+                                  'nModified': result['modified'], 'nRemoved': result['deleted']})
+        return _BulkResult(result)
+
+    def _apply(self, op, result: dict):
+        if isinstance(op, InsertOne):
+            self._coll.insert_one(op._doc)
+            result['inserted'] += 1
+            return
+        if isinstance(op, (DeleteOne, DeleteMany)):
+            fn = self._coll.delete_one if isinstance(op, DeleteOne) else self._coll.delete_many
+            result['deleted'] += fn(op._filter).deleted_count
+            return
+        if isinstance(op, ReplaceOne):
+            res = self._coll.replace_one(op._filter, op._doc, upsert=op._upsert)
+        elif isinstance(op, UpdateOne):
+            res = self._coll.update_one(op._filter, op._doc, upsert=op._upsert)
+        elif isinstance(op, UpdateMany):
+            res = self._coll.update_many(op._filter, op._doc, upsert=op._upsert)
+        else:
+            raise TypeError(f"Operação de bulk_write não suportada: {type(op).__name__}")
+        result['matched'] += res.matched_count
+        result['modified'] += res.modified_count
+        result['upserted'] += res.upserted_id is not None
+
+
+class _BulkResult:
+    def __init__(self, result: dict):
+        self.inserted_count = result['inserted']
+        self.matched_count = result['matched']
+        self.modified_count = result['modified']
+        self.deleted_count = result['deleted']
+        self.upserted_count = result['upserted']
+
+
+def open_bench_db(mongo_uri: str = None, db_name: str = "bsky_bench"):
+    """
+    `(client, db, wrap)`: um mongod local (`mongo_uri`) ou o mongomock em memória. `wrap` adapta
+    as coleções ao que o crawler usa.
+    """
+    if mongo_uri:
+        client = MongoClient(mongo_uri)
+        return client, client[db_name], lambda coll: coll
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("Instale o mongomock (pip install mongomock) ou informe --mongo-uri de um mongod local.")
+    client = mongomock.MongoClient()
+    return client, client[db_name], MockCollection
+
+
+def seed_tasks(coll, n: int, num_shards: int = 1) -> list:
+    dids = [mock_did(f"bench:{i}") for i in range(n)]
+    coll.delete_many({})
+    coll.insert_many([{
+        'did':       did,
+        'handle':    _profile(did)['handle'],
+        'status':    'pending',
+        'locked_by': None,
+        **shard_fields(did, num_shards),
+    } for did in dids])
+    return dids
+
+
+# --------------------------------
+#  BENCHMARK
+# --------------------------------
+
+def run_benchmark(args, crawler_args: list) -> dict:
+    appview = MockAppView(
+        MockData(args.posts_min, args.posts_max),
+        ServerQuota(args.limit, args.window, args.error_rate, args.reset_seconds),
+        latency=args.latency, jitter=args.jitter
+    ).start()
+
+    # O crawler lê a configuração do ambiente ao ser importado
+    os.environ["PUBLIC_APPVIEW_URL"] = appview.url
+    for key, default in (("MONGO_HOST", "localhost"), ("MONGO_PORT", "27017"), ("MONGO_DB", args.mongo_db),
+                         ("MONGO_COLLECTION_TASKS", "tasks"), ("MONGO_COLLECTION_DATA", "bsky")):
+        os.environ.setdefault(key, default)
+    from apis.bsky import analise_bsky_prod as crawler
+    from apis.bsky.metrics import METRICS
+
+    # Se o crawler já tinha sido importado (ex.: nos testes), a URL lida no import está velha
+    crawler.PUBLIC_APPVIEW_URL = appview.url
+
+    if "--mode" in crawler_args and "async" in crawler_args and not args.mongo_uri:
+        raise SystemExit("O modo async usa o AsyncMongoClient: informe --mongo-uri de um mongod local.")
+
+    client, db, wrap = open_bench_db(args.mongo_uri, args.mongo_db)
+    tasks = wrap(db[crawler.TASKS_COLLECTION])
+    crawler.clientDB, crawler.db = client, db
+    crawler.tasks_coll = tasks
+    crawler.data_coll = wrap(db[crawler.DATA_COLLECTION])
+    crawler.posts_coll = wrap(db[crawler.POSTS_COLLECTION])
+    crawler.DB_NAME = args.mongo_db
+    if args.mongo_uri:
+        crawler.uri = args.mongo_uri
+    for name in (crawler.DATA_COLLECTION, crawler.POSTS_COLLECTION):
+        db[name].delete_many({})
+    seed_tasks(tasks, args.dids)
+
+    sys.argv = [crawler.__file__, "crawl", "--appview", "public", "--session-cache", "none",
+                "--public-rate", str(args.client_rate), "--reap-interval", "0",
+                "--num-shards", "1", "--shard-index", "0", *crawler_args]
+    print(f"Mock AppView em {appview.url}: {args.dids} DIDs, {args.posts_min}-{args.posts_max} posts cada, "
+          f"latência {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms, cota {args.limit}/{args.window:g}s, "
+          f"429 aleatório {args.error_rate:.1%}")
+    print(f"Crawler: {' '.join(sys.argv[1:])}")
+    if not args.mongo_uri:
+        print("[WARN] mongomock: gravação sem índices, mais lenta que no Mongo; use --mongo-uri para medir o armazenamento.")
+
+    started = time.monotonic()
+    try:
+        crawler.main()
+    finally:
+        elapsed = time.monotonic() - started
+        appview.stop()
+
+    done = tasks.count_documents({'status': 'done'})
+    posts = sum(t.get('posts_stored', 0) for t in tasks.find({'status': 'done'}, {'posts_stored': 1}))
+    feed = next((h for h in METRICS.snapshot()['histograms']
+                 if h['name'] == 'xrpc_request_seconds' and h['labels'].get('method') == 'app.bsky.feed.getAuthorFeed'),
+                None)
+    totals = METRICS.totals()
+    return {
+        'elapsed':        elapsed,
+        'dids_done':      done,
+        'dids_pending':   tasks.count_documents({'status': {'$ne': 'done'}}),
+        'posts':          posts,
+        'dids_per_s':     done / elapsed if elapsed else 0.0,
+        'posts_per_s':    posts / elapsed if elapsed else 0.0,
+        'pages':          totals.get('crawler_pages_fetched_total', 0),
+        'served':         appview.quota.served,
+        'rejected_429':   appview.quota.rejected,
+        'sleep_seconds':  totals.get('ratelimit_sleep_seconds_total', 0),
+        'feed_p50':       feed['p50'] if feed else None,
+        'feed_p95':       feed['p95'] if feed else None,
+    }
+
+
+def print_report(r: dict):
+    print("=" * 60)
+    print(f"Tempo total:        {r['elapsed']:.2f}s")
+    print(f"DIDs concluídos:    {r['dids_done']} ({r['dids_pending']} não concluídos)")
+    print(f"DIDs/s:             {r['dids_per_s']:.2f}")
+    print(f"Posts/s:            {r['posts_per_s']:.1f} ({r['posts']} posts)")
+    print(f"Páginas:            {r['pages']:.0f}")
+    print(f"Requisições:        {r['served']} atendidas, {r['rejected_429']} com 429")
+    print(f"Espera no balde:    {r['sleep_seconds']:.1f}s (somando threads/corrotinas)")
+    if r['feed_p50'] is not None:
+        print(f"getAuthorFeed:      p50 ≤ {r['feed_p50']:g}s, p95 ≤ {r['feed_p95']:g}s")
+
+
+def main():
+    argv = sys.argv[1:]
+    crawler_args = []
+    if "--" in argv:
+        idx = argv.index("--")
+        argv, crawler_args = argv[:idx], argv[idx + 1:]
+
+    parser = argparse.ArgumentParser(
+        description="AppView falso (getAuthorFeed/getFollowers sintéticos) e benchmark offline do crawler."
+    )
+    parser.add_argument("command", choices=["serve", "benchmark"],
+                        help="serve: só o servidor; benchmark: servidor + crawler com um banco descartável.")
+    parser.add_argument("--port", type=int, default=8787, help="serve: porta do servidor (padrão: 8787).")
+    parser.add_argument("--posts-min", type=int, default=50, help="Posts mínimos por DID (padrão: 50).")
+    parser.add_argument("--posts-max", type=int, default=500, help="Posts máximos por DID (padrão: 500).")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latência média por requisição, em s (padrão: 0.05).")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Variação uniforme da latência, em s (padrão: 0.02).")
+    parser.add_argument("--limit", type=int, default=3000, help="Cota do servidor por janela (padrão: 3000).")
+    parser.add_argument("--window", type=float, default=300, help="Janela da cota, em s (padrão: 300).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 429 aleatórias (padrão: 0).")
+    parser.add_argument("--reset-seconds", type=float, default=1.0,
+                        help="ratelimit-reset dos 429 aleatórios, em s a partir de agora (padrão: 1).")
+    parser.add_argument("--dids", type=int, default=200, help="benchmark: tasks criadas (padrão: 200).")
+    parser.add_argument("--client-rate", type=float, default=50,
+                        help="benchmark: --public-rate do crawler, antes do primeiro cabeçalho ratelimit-* (padrão: 50).")
+    parser.add_argument("--mongo-uri", default=None,
+                        help="benchmark: mongod local descartável; sem ele, usa o mongomock em memória.")
+    parser.add_argument("--mongo-db", default="bsky_bench", help="benchmark: banco usado (padrão: bsky_bench).")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        appview = MockAppView(
+            MockData(args.posts_min, args.posts_max),
+            ServerQuota(args.limit, args.window, args.error_rate, args.reset_seconds),
+            latency=args.latency, jitter=args.jitter, port=args.port
+        )
+        print(f"Mock AppView em {appview.url} (PUBLIC_APPVIEW_URL={appview.url} APPVIEW_MODE=public)")
+        try:
+            appview.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    print_report(run_benchmark(args, crawler_args))
+
+
+if __name__ == "__main__":
+    main()
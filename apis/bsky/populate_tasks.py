@@ -1,13 +1,26 @@
 import os
 import sys
 import socket
+import argparse
+import hashlib
+import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from atproto import Client
 from atproto_client.exceptions import RequestException, AtProtocolError
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError, DuplicateKeyError
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import PyMongoError, BulkWriteError
 import time
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from apis.bsky.rate_limit import RateLimitedClient, build_bucket, DEFAULT_RATE
+from apis.bsky.session_cache import CachedSessionClient, build_request, build_session_cache, session_key
+from apis.bsky.accounts import bucket_keys, PUBLIC_APPVIEW_URL, PUBLIC_BUCKET_KEY
+from apis.bsky.sharding import shard_fields, configured_shards, ensure_shard_indexes, check_num_shards
+
 # Load environment variables
 load_dotenv()
 
@@ -19,129 +32,509 @@ PORT = os.getenv("MONGO_PORT")
 AUTH_DB = os.getenv("MONGO_AUTH_DB")
 DB_NAME = os.getenv("MONGO_DB")
 TASKS_COLLECTION = os.getenv("MONGO_COLLECTION_TASKS", "tasks")
+RATELIMITS_COLLECTION = os.getenv("MONGO_COLLECTION_RATELIMITS", "ratelimits")
+SESSIONS_COLLECTION = os.getenv("MONGO_COLLECTION_SESSIONS", "sessions")
+CHECKPOINTS_COLLECTION = os.getenv("MONGO_COLLECTION_CHECKPOINTS", "checkpoints")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+# The graph endpoints are public: "public" and "hybrid" both read from the public AppView without logging in
+APPVIEW_MODE = os.getenv("APPVIEW_MODE", "auth")
+# Followers buffered before each bulk_write (several pages of 100)
+FLUSH_SIZE = int(os.getenv("TASKS_FLUSH_SIZE", 500))
+# Graph expansion: expected number of distinct DIDs and Bloom filter false-positive rate
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", 5_000_000))
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", 0.001))
+# Crawler shard count stamped on new tasks (the value saved by `rebalance` takes precedence)
+TASK_SHARDS = int(os.getenv("NUM_SHARDS", 1))
 
 # Build MongoDB URI and client
 uri = f"mongodb://{USER}:{PASS}@{HOST}:{PORT}/?authSource={AUTH_DB}"
 client_db = MongoClient(uri)
 db = client_db[DB_NAME]
 tasks_coll = db[TASKS_COLLECTION]
+checkpoints_coll = db[CHECKPOINTS_COLLECTION]
 
-# ATProto client setup
-auto_client = Client()
+# Rate limit buckets: shared with the crawler when RATE_LIMIT_BACKEND=mongo
+ratelimits_coll = db[RATELIMITS_COLLECTION] if RATE_LIMIT_BACKEND == "mongo" else None
+read_key, session_bucket_key = bucket_keys(os.getenv("BLSKY_USERNAME"))
+bucket = build_bucket(RATE_LIMIT_BACKEND, coll=ratelimits_coll, key=read_key,
+                      rate=float(os.getenv("RATE_LIMIT_RATE", DEFAULT_RATE)))
+session_bucket = build_bucket(RATE_LIMIT_BACKEND, coll=ratelimits_coll, key=session_bucket_key,
+                              rate=30 / 300, burst=2, margin=0)
+
+# ATProto client setup: reuses the session cached by the crawler or a previous run (SESSION_CACHE)
+auto_client = CachedSessionClient(bucket, session_bucket=session_bucket, request=build_request())
+auto_client.session_cache = build_session_cache(os.getenv("SESSION_CACHE", "file"), coll=db[SESSIONS_COLLECTION])
+auto_client.session_key = session_key(os.getenv("BLSKY_USERNAME"))
 
 # Login ATProto
 max_retries = 5
-retries = 0
 
-while True:
-    try:
-        auto_client.login(
-            os.getenv("BLSKY_USERNAME"),
-            os.getenv("BLSKY_PASSWORD")
-        )
-        print("Login bem-sucedido")
-        break
-
-    except RequestException as e:
-        resp    = getattr(e, 'response', None)
-        status  = resp.status_code if resp else None
-        headers = resp.headers     if resp else {}
-
-        # Se for rate-limit, espera até o reset
-        if status == 429 or 'RateLimitExceeded' in str(e):
-            reset_ts = int(headers.get('ratelimit-reset', 0))
-            wait = max(reset_ts - time.time(), 0) + 1
-            print(f"Rate limit atingido no login. Aguardando {wait:.0f}s…")
-            time.sleep(wait)
-            retries += 1
-            if retries >= max_retries:
-                raise RuntimeError("Número máximo de tentativas de login excedido.")
-            continue
 
-        # Qualquer outro RequestException
-        print(f"Erro no login (RequestException): {e}")
-        raise
+def login(atp_client):
+    retries = 0
 
-    except Exception as e:
-        # Erros inesperados
-        print(f"Erro crítico no login: {e}")
-        raise
+    while True:
+        try:
+            atp_client.login(
+                os.getenv("BLSKY_USERNAME"),
+                os.getenv("BLSKY_PASSWORD")
+            )
+            print("Login bem-sucedido")
+            break
+
+        except RequestException as e:
+            resp    = getattr(e, 'response', None)
+            status  = resp.status_code if resp else None
+            headers = resp.headers     if resp else {}
+
+            # Se for rate-limit, o balde de sessão já está pausado até o reset
+            if status == 429 or 'RateLimitExceeded' in str(e):
+                reset_ts = int(headers.get('ratelimit-reset', 0))
+                wait = max(reset_ts - time.time(), 0) + 1
+                print(f"Rate limit atingido no login. Aguardando ~{wait:.0f}s…")
+                retries += 1
+                if retries >= max_retries:
+                    raise RuntimeError("Número máximo de tentativas de login excedido.")
+                continue
+
+            # Qualquer outro RequestException
+            print(f"Erro no login (RequestException): {e}")
+            raise
+
+        except Exception as e:
+            # Erros inesperados
+            print(f"Erro crítico no login: {e}")
+            raise
+
+
+if APPVIEW_MODE in ("public", "hybrid"):
+    public_bucket = build_bucket(RATE_LIMIT_BACKEND, coll=ratelimits_coll, key=PUBLIC_BUCKET_KEY,
+                                 rate=float(os.getenv("PUBLIC_RATE_LIMIT_RATE", DEFAULT_RATE)))
+    auto_client = RateLimitedClient(public_bucket, PUBLIC_APPVIEW_URL, request=build_request())
+    print(f"Using the public AppView ({PUBLIC_APPVIEW_URL}) without logging in")
+else:
+    auto_client.login_cached(login)
 
 # Worker identifier for logging (hostname)
 WORKER_ID = socket.gethostname()
 
 
-def get_all_followers(handle: str) -> int:
+def follower_upsert(f, **extra) -> UpdateOne:
+    return UpdateOne(
+        {'did': f['did']},
+        {'$setOnInsert': {
+            'did':       f['did'],
+            'handle':    f['handle'],
+            'status':    'pending',
+            'locked_by': None,
+            **shard_fields(f['did'], TASK_SHARDS),
+            **extra
+        }},
+        upsert=True
+    )
+
+
+def flush_followers(ops: list) -> int:
     """
-    Fetches all followers of the specified handle and upserts entries into `tasks_coll`.
-    Returns the number of followers scheduled.
+    Writes the buffered upserts as a single unordered `bulk_write`.
+    Duplicate-key errors (two workers upserting the same DID at once) are expected and ignored;
+    any other write error is reported and re-raised, so callers never checkpoint past followers
+    that were not written. Returns the number of new tasks inserted.
     """
-    try:
-        profile = auto_client.com.atproto.identity.resolve_handle({'handle': handle})
-        did = profile['did']
-    except AtProtocolError as e:
-        print(f"API error while resolving handle {handle}: {e}")
+    if not ops:
         return 0
+    try:
+        result = tasks_coll.bulk_write(ops, ordered=False)
+        return result.upserted_count
+    except BulkWriteError as e:
+        details = e.details or {}
+        errors = [err for err in details.get('writeErrors', []) if err.get('code') != 11000]
+        for err in errors:
+            print(f"Warning: could not upsert task #{err.get('index')}: {err.get('errmsg')}")
+        if errors or details.get('writeConcernErrors'):
+            raise
+        return details.get('nUpserted', 0)
 
-    cursor = None
-    total = 0
 
+def iter_graph_pages(did: str, relation: str = 'followers', cursor=None):
+    """
+    Pages through the followers (`relation='followers'`) or follows (`relation='follows'`) of `did`,
+    yielding `(profiles, next_cursor)` for each page. Rate limits are paced by the shared bucket.
+    Only a clean end of pagination yields a page with `next_cursor=None`; on any other error the
+    generator just stops, so callers can tell the two apart by the last cursor they saw.
+    """
     while True:
         try:
-            resp = auto_client.app.bsky.graph.get_followers({
-                'actor': did,
-                'limit': 100,
-                'cursor': cursor
-            })
+            if relation == 'follows':
+                resp = auto_client.app.bsky.graph.get_follows({
+                    'actor': did,
+                    'limit': 100,
+                    'cursor': cursor
+                })
+                batch = resp['follows'] or []
+            else:
+                resp = auto_client.app.bsky.graph.get_followers({
+                    'actor': did,
+                    'limit': 100,
+                    'cursor': cursor
+                })
+                batch = resp['followers'] or []
 
         except RequestException as e:
             resp_obj = getattr(e, 'response', None)
             status   = resp_obj.status_code if resp_obj else None
             headers  = resp_obj.headers     if resp_obj else {}
 
-            # Rate limit handling
+            # Rate limit handling: the bucket is already paused until the reset,
+            # so the retry simply waits for its turn
             if status == 429 or 'RateLimitExceeded' in str(e):
                 reset_ts = int(headers.get('ratelimit-reset', 0))
-                wait = max(reset_ts - time.time(), 0) + 1
-                print(f"[{WORKER_ID}] Rate limit atingido para {did}. Aguardando {wait:.0f}s…")
-                time.sleep(wait)
+                wait_s = max(reset_ts - time.time(), 0) + 1
+                print(f"[{WORKER_ID}] Rate limit atingido para {did}. Aguardando ~{wait_s:.0f}s…")
                 continue
             else:
-                print(f"[{WORKER_ID}] Erro crítico ao buscar followers de {did}: {e}")
-                return total
-
-        batch = resp['followers'] or []
-        total += len(batch)
-        print(f"[{WORKER_ID}] Collected {total} followers so far...")
-
-        for f in batch:
-            try:
-                tasks_coll.update_one(
-                    {'did': f['did']},
-                    {'$setOnInsert': {
-                        'did':       f['did'],
-                        'handle':    f['handle'],
-                        'status':    'pending',
-                        'locked_by': None
-                    }},
-                    upsert=True
-                )
-            except (DuplicateKeyError, PyMongoError) as e:
-                print(f"Warning: could not upsert task for {f['did']}: {e}")
+                print(f"[{WORKER_ID}] Erro crítico ao buscar {relation} de {did}: {e}")
+                return
 
         cursor = resp.cursor
+        yield batch, cursor
         if not cursor:
-            break
+            return
+
+
+def load_checkpoint(did: str):
+    return checkpoints_coll.find_one({'_id': f"followers:{did}"})
+
+
+def save_checkpoint(did: str, handle: str, cursor, pages: int, total: int, inserted: int, done: bool = False):
+    """
+    Stores the pagination state of a follower enumeration. Only called right after a flush,
+    so the saved cursor never points past followers that are not yet in `tasks_coll`.
+    """
+    try:
+        checkpoints_coll.update_one(
+            {'_id': f"followers:{did}"},
+            {'$set': {
+                'kind':       'followers',
+                'did':        did,
+                'handle':     handle,
+                'cursor':     cursor,
+                'pages':      pages,
+                'total':      total,
+                'inserted':   inserted,
+                'status':     'done' if done else 'running',
+                'worker':     WORKER_ID,
+                'updated_at': datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+    except PyMongoError as e:
+        print(f"Warning: could not save checkpoint for {did}: {e}")
+
+
+def resolve_did(handle: str):
+    try:
+        profile = auto_client.com.atproto.identity.resolve_handle({'handle': handle})
+        return profile['did']
+    except AtProtocolError as e:
+        print(f"API error while resolving handle {handle}: {e}")
+        return None
+
+
+def get_all_followers(handle: str, resume: bool = False) -> int:
+    """
+    Fetches all followers of the specified handle and upserts entries into `tasks_coll`.
+    Upserts are buffered and flushed every `FLUSH_SIZE` followers as one unordered bulk write,
+    and the cursor and counters are checkpointed after every flush.
+    With `resume=True`, continues from the last checkpoint of this handle instead of page one.
+    Returns the number of followers scheduled.
+    """
+    did = resolve_did(handle)
+    if not did:
+        return 0
 
-    print(f"[{WORKER_ID}] Done: scheduled {total} followers tasks.")
+    cursor = None
+    pages = 0
+    total = 0
+    inserted = 0
+    buffer = []
+    finished = False
+
+    checkpoint = load_checkpoint(did) if resume else None
+    if checkpoint:
+        if checkpoint.get('status') == 'done':
+            print(f"[{WORKER_ID}] {handle} already fully scheduled ({checkpoint.get('total', 0)} followers).")
+            return checkpoint.get('total', 0)
+        cursor   = checkpoint.get('cursor')
+        pages    = checkpoint.get('pages', 0)
+        total    = checkpoint.get('total', 0)
+        inserted = checkpoint.get('inserted', 0)
+        print(f"[{WORKER_ID}] Resuming {handle} from page {pages} ({total} followers so far).")
+
+    saved_total = total
+    try:
+        for batch, next_cursor in iter_graph_pages(did, 'followers', cursor):
+            pages += 1
+            total += len(batch)
+            print(f"[{WORKER_ID}] Collected {total} followers so far...")
+
+            buffer.extend(follower_upsert(f) for f in batch)
+            cursor = next_cursor
+            finished = not next_cursor
+
+            if len(buffer) >= FLUSH_SIZE:
+                inserted += flush_followers(buffer)
+                buffer = []
+                save_checkpoint(did, handle, cursor, pages, total, inserted)
+                saved_total = total
+
+        inserted += flush_followers(buffer)
+    except PyMongoError as e:
+        # The checkpoint still points at the last page that was actually written
+        print(f"[{WORKER_ID}] Could not write followers of {handle}: {e}; "
+              f"rerun with --resume to continue from follower {saved_total}.")
+        return saved_total
+
+    # An error before the last page leaves the checkpoint 'running', so --resume retries it
+    save_checkpoint(did, handle, cursor, pages, total, inserted, done=finished)
+
+    if finished:
+        print(f"[{WORKER_ID}] Done: scheduled {total} followers tasks ({inserted} new).")
+    else:
+        print(f"[{WORKER_ID}] Stopped early: scheduled {total} followers tasks ({inserted} new); "
+              f"rerun with --resume to continue {handle}.")
     return total
 
 
+# --------------------------------
+#  GRAPH EXPANSION (multi-seed, multi-hop)
+# --------------------------------
+
+class BloomFilter:
+    """
+    Thread-safe in-memory Bloom filter over DIDs, sized for `capacity` items at `error_rate`
+    false positives (5M DIDs at 0.1% take ~9 MB). A false positive only means a new DID is
+    skipped, never that a duplicate task is written.
+    """
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item: str) -> bool:
+        """
+        Adds `item` and returns True if it was (probably) already present.
+        """
+        positions = self._positions(item)
+        with self._lock:
+            seen = True
+            for p in positions:
+                byte, mask = p >> 3, 1 << (p & 7)
+                if not self._bits[byte] & mask:
+                    seen = False
+                    self._bits[byte] |= mask
+            return seen
+
+
+def preload_bloom(bloom: BloomFilter) -> int:
+    """
+    Adds every DID already in `tasks_coll` to the filter so the expansion skips them.
+    """
+    count = 0
+    for doc in tasks_coll.find({}, {'did': 1, '_id': 0}).batch_size(10_000):
+        if doc.get('did'):
+            bloom.add(doc['did'])
+            count += 1
+    return count
+
+
+def mark_new(bloom: BloomFilter, dids: list) -> list:
+    """
+    Marks DIDs whose tasks were just written as seen. Returns the ones this call marked first,
+    so a DID reached by two nodes at once enters the next frontier level only once.
+    """
+    return [did for did in dids if not bloom.add(did)]
+
+
+def mark_expanded(did: str, level: int, seed: str):
+    """
+    Records that `did` was fully expanded, so `expand_graph(resume=True)` skips it: seeds in
+    `checkpoints_coll`, every other node on its own task. A failure here only means the node
+    is expanded again on the next resume.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        if level == 0:
+            checkpoints_coll.update_one(
+                {'_id': f"expand:{did}"},
+                {'$set': {'kind': 'expand', 'did': did, 'seed': seed, 'status': 'done',
+                          'worker': WORKER_ID, 'updated_at': now}},
+                upsert=True
+            )
+        else:
+            tasks_coll.update_one({'did': did}, {'$set': {'expanded_at': now}})
+    except PyMongoError as e:
+        print(f"Warning: could not mark {did} as expanded: {e}")
+
+
+def expand_node(did: str, level: int, relations: list, bloom: BloomFilter, seed: str):
+    """
+    Fetches every neighbour of `did` over `relations` and schedules the unseen ones as tasks at
+    `level + 1`. Neighbours are only marked in the Bloom filter after their flush succeeds, so a
+    failed write never hides a DID from a later run. Returns `(new_dids, inserted)`; `new_dids`
+    feeds the next frontier level.
+    """
+    new_dids = []
+    buffer = []
+    pending = []
+    inserted = 0
+
+    for relation in relations:
+        for batch, _ in iter_graph_pages(did, relation):
+            for profile in batch:
+                if profile['did'] in bloom:
+                    continue
+                pending.append(profile['did'])
+                buffer.append(follower_upsert(profile, depth=level + 1, seed=seed))
+
+            if len(buffer) >= FLUSH_SIZE:
+                inserted += flush_followers(buffer)
+                new_dids.extend(mark_new(bloom, pending))
+                buffer = []
+                pending = []
+
+    inserted += flush_followers(buffer)
+    new_dids.extend(mark_new(bloom, pending))
+    mark_expanded(did, level, seed)
+    print(f"[{WORKER_ID}] Expanded {did} (level {level}): {len(new_dids)} new DIDs.")
+    return new_dids, inserted
+
+
+def load_frontier(depth: int):
+    """
+    Yields `(did, level, seed)` for every scheduled task below `depth` that was never expanded:
+    the frontier left behind by an interrupted or failed expansion.
+    """
+    query = {'depth': {'$gte': 1, '$lt': depth}, 'expanded_at': {'$exists': False}}
+    for doc in tasks_coll.find(query, {'did': 1, 'depth': 1, 'seed': 1, '_id': 0}).batch_size(10_000):
+        yield doc['did'], doc['depth'], doc.get('seed')
+
+
+def expand_graph(handles: list, depth: int = 1, relations: list = None, workers: int = 8,
+                 bloom: BloomFilter = None, resume: bool = False) -> int:
+    """
+    BFS over the social graph from many seeds at once: every seed is level 0, and each DID at a
+    level below `depth` has its followers and/or follows scheduled as tasks at the next level.
+    Nodes are expanded concurrently by `workers` threads that share the client's rate-limit
+    bucket; already-known DIDs are filtered by a Bloom filter preloaded from `tasks_coll`
+    before anything is written. Returns the number of new tasks inserted.
+
+    The frontier only lives in memory, but every expanded node is recorded (see `mark_expanded`).
+    Without `resume` an interrupted expansion restarts from the seeds and, since their
+    neighbours are already in the Bloom filter, goes no deeper; with `resume=True` the seeds
+    already expanded are skipped and the frontier is rebuilt from the unexpanded tasks below
+    `depth`.
+    """
+    relations = relations or ['followers']
+    bloom = bloom or BloomFilter()
+    print(f"[{WORKER_ID}] Preloaded {preload_bloom(bloom)} existing tasks into the Bloom filter.")
+
+    frontier = deque()
+    for handle in handles:
+        did = resolve_did(handle)
+        if not did:
+            continue
+        bloom.add(did)
+        checkpoint = checkpoints_coll.find_one({'_id': f"expand:{did}"}) if resume else None
+        if checkpoint and checkpoint.get('status') == 'done':
+            print(f"[{WORKER_ID}] Seed {handle} already expanded.")
+            continue
+        frontier.append((did, 0, handle))
+    if resume:
+        frontier.extend(load_frontier(depth))
+        print(f"[{WORKER_ID}] Resuming with {len(frontier)} nodes in the frontier.")
+
+    inserted = 0
+    expanded = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while frontier or running:
+            # Keep the pool busy without materialising futures for the whole frontier
+            while frontier and len(running) < workers * 2:
+                did, level, seed = frontier.popleft()
+                fut = executor.submit(expand_node, did, level, relations, bloom, seed)
+                running[fut] = (level, seed)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                level, seed = running.pop(fut)
+                try:
+                    new_dids, count = fut.result()
+                except Exception as e:
+                    print(f"[{WORKER_ID}] Error expanding a level {level} node (retried on --resume): {e}")
+                    continue
+                inserted += count
+                expanded += 1
+                if level + 1 < depth:
+                    frontier.extend((d, level + 1, seed) for d in new_dids)
+
+            print(f"[{WORKER_ID}] Frontier: {len(frontier)} queued, {expanded} expanded, {inserted} new tasks.")
+
+    return inserted
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python populate_tasks.py <bluesky_handle>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Schedules one task per follower of one or more Bluesky handles.")
+    parser.add_argument("handles", nargs="+", help="Bluesky handle(s) used as seeds.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last checkpoint of this handle instead of the first page; in graph mode, "
+             "skip the seeds already expanded and rebuild the frontier from the unexpanded tasks."
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=1,
+        help="Number of hops to expand from the seeds (default: 1, i.e. only the seeds' followers)."
+    )
+    parser.add_argument(
+        "--relation",
+        choices=["followers", "follows", "both"],
+        default="followers",
+        help="Which edges to follow when expanding the graph (default: followers)."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Nodes expanded concurrently in graph mode, all under the shared rate-limit bucket (default: 8)."
+    )
+    args = parser.parse_args()
+
+    relations = ['followers', 'follows'] if args.relation == 'both' else [args.relation]
+    try:
+        TASK_SHARDS = check_num_shards(configured_shards(checkpoints_coll) or TASK_SHARDS)
+    except ValueError as e:
+        parser.error(f"NUM_SHARDS: {e}")
+    ensure_shard_indexes(tasks_coll)
 
-    target_handle = sys.argv[1]
-    count = get_all_followers(target_handle)
-    print(f"Scheduled a total of {count} tasks for handle: {target_handle}")
\ No newline at end of file
+    if len(args.handles) == 1 and args.depth == 1 and relations == ['followers']:
+        target_handle = args.handles[0]
+        count = get_all_followers(target_handle, resume=args.resume)
+        print(f"Scheduled a total of {count} tasks for handle: {target_handle}")
+    else:
+        count = expand_graph(args.handles, depth=args.depth, relations=relations, workers=args.workers,
+                             resume=args.resume)
+        print(f"Scheduled {count} new tasks from {len(args.handles)} seed(s), depth {args.depth}.")
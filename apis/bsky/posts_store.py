@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Layout normalizado de armazenamento: um documento por post na coleção `MONGO_COLLECTION_POSTS`
+(padrão "posts"), em vez do array `posts` embutido em cada documento de `MONGO_COLLECTION_DATA`.
+
+Cada documento tem `did`, `uri`, `created_at` (datetime), `text`, `lang` e as flags do post
+(`is_repost`, `is_reply`). Índices:
+
+  - `(did, uri)` único: o upsert da coleta é idempotente, recoletar não duplica posts;
+  - `(did, created_at)`: "últimos N posts do usuário X" sem varrer o histórico;
+  - `(lang, did)`: filtros por idioma (ex.: usuários com posts em "pt") sem reescrever arrays.
+
+Atualizações por post (ex.: o idioma detectado) viram um `$set` de poucos bytes num documento
+pequeno, em vez de reescrever o array inteiro.
+
+Uso como script (migração a partir do layout embutido):
+  python apis/bsky/posts_store.py migrate [--batch-size 200] [--limit N]
+"""
+
+import os
+import sys
+import argparse
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from apis.bsky.feed_collector import post_upsert
+
+load_dotenv()
+
+POSTS_COLLECTION = os.getenv("MONGO_COLLECTION_POSTS", "posts")
+
+
+def ensure_posts_indexes(coll):
+    try:
+        coll.create_index([("did", ASCENDING), ("uri", ASCENDING)], unique=True)
+        coll.create_index([("did", ASCENDING), ("created_at", DESCENDING)])
+        coll.create_index([("lang", ASCENDING), ("did", ASCENDING)])
+    except Exception as e:
+        print(f"[WARN] create_index(posts) ignorado: {e}")
+
+
+def latest_posts(coll, did: str, n: int = 80, lang: str = None, projection: dict = None) -> list:
+    """
+    Os `n` posts mais recentes de `did` (opcionalmente só no idioma `lang`), pelo índice
+    `(did, created_at)`.
+    """
+    query = {"did": did}
+    if lang:
+        query["lang"] = lang
+    return list(coll.find(query, projection).sort("created_at", DESCENDING).limit(n))
+
+
+def write_posts(coll, ops: list) -> int:
+    """
+    `bulk_write` não ordenado; chaves duplicadas (dois upserts do mesmo post em paralelo) são
+    ignoradas. Devolve quantos posts novos foram inseridos. Qualquer outro erro de escrita sobe
+    (`BulkWriteError`), para que quem chama não dê o lote por gravado.
+    """
+    if not ops:
+        return 0
+    try:
+        return coll.bulk_write(ops, ordered=False).upserted_count
+    except BulkWriteError as e:
+        details = e.details or {}
+        fatal = [err for err in details.get("writeErrors", []) if err.get("code") != 11000]
+        for err in fatal:
+            print(f"[WARN] Falha ao gravar post #{err.get('index')}: {err.get('errmsg')}")
+        if fatal or details.get("writeConcernErrors"):
+            raise
+        return details.get("nUpserted", 0)
+
+
+def migrate_embedded(data_coll, posts_coll, batch_size: int = 200, limit: int = None) -> dict:
+    """
+    Copia os posts dos documentos do layout embutido (array `posts`) para a coleção normalizada.
+    Cada documento migrado recebe `migrated_to_posts: True` só depois que o lote dele foi gravado
+    sem erro, então a migração pode ser interrompida e retomada: se um lote falha, a migração
+    para e esses documentos são refeitos na próxima execução (o upsert é idempotente).
+    Documentos antigos sem `did` usam o `_id` do documento de origem como `did` (prefixo
+    "doc:"), para que continuem agrupáveis por usuário.
+    O layout embutido não é apagado.
+    """
+    ensure_posts_indexes(posts_coll)
+
+    query = {"migrated_to_posts": {"$ne": True}, "posts": {"$exists": True}}
+    cursor = data_coll.find(query, {"did": 1, "posts": 1}, no_cursor_timeout=True).batch_size(batch_size)
+    stats = {"docs": 0, "posts": 0, "inserted": 0}
+
+    try:
+        ops = []
+        migrated = []
+        for doc in cursor:
+            did = doc.get("did") or f"doc:{doc['_id']}"
+            for post in doc.get("posts") or []:
+                ops.append(post_upsert(did, post, source_id=doc["_id"]))
+            migrated.append(doc["_id"])
+            stats["docs"] += 1
+            stats["posts"] += len(doc.get("posts") or [])
+
+            if len(migrated) >= batch_size:
+                stats["inserted"] += write_posts(posts_coll, ops)
+                data_coll.update_many({"_id": {"$in": migrated}}, {"$set": {"migrated_to_posts": True}})
+                print(f"Migrados {stats['docs']} documentos ({stats['posts']} posts) até agora…")
+                ops, migrated = [], []
+
+            if limit and stats["docs"] >= limit:
+                break
+
+        stats["inserted"] += write_posts(posts_coll, ops)
+        if migrated:
+            data_coll.update_many({"_id": {"$in": migrated}}, {"$set": {"migrated_to_posts": True}})
+    finally:
+        cursor.close()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ferramentas do layout normalizado de posts (um documento por post)."
+    )
+    parser.add_argument("command", choices=["migrate", "indexes"],
+                        help="migrate: copia os posts do layout embutido; indexes: só cria os índices.")
+    parser.add_argument("--batch-size", type=int, default=200,
+                        help="Documentos do layout embutido por bulk_write (padrão: 200).")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Migra no máximo N documentos (útil para testar).")
+    args = parser.parse_args()
+
+    uri = (
+        f"mongodb://{os.getenv('MONGO_USER')}:{os.getenv('MONGO_PASS')}@{os.getenv('MONGO_HOST')}:"
+        f"{os.getenv('MONGO_PORT')}/?authSource={os.getenv('MONGO_AUTH_DB')}"
+    )
+    client = MongoClient(uri)
+    db = client[os.getenv("MONGO_DB")]
+    posts_coll = db[POSTS_COLLECTION]
+
+    if args.command == "indexes":
+        ensure_posts_indexes(posts_coll)
+    else:
+        stats = migrate_embedded(db[os.getenv("MONGO_COLLECTION_DATA")], posts_coll, args.batch_size, args.limit)
+        print(f"Migração concluída: {stats['docs']} documentos, {stats['posts']} posts, "
+              f"{stats['inserted']} novos em '{POSTS_COLLECTION}'.")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
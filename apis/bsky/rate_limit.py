@@ -0,0 +1,433 @@
+"""
+Limitador de requisições (token bucket) guiado pelos cabeçalhos `ratelimit-*` do Bluesky.
+
+Em vez de reagir ao 429 depois que ele acontece (cada thread dormindo até o `ratelimit-reset`
+por conta própria e todas acordando juntas), o limitador:
+
+  - cadencia as chamadas antes do limite: a taxa de reposição é recalculada a cada resposta
+    como `ratelimit-remaining / (ratelimit-reset - agora)`;
+  - trabalha por reserva: quem chega com o balde vazio recebe um horário próprio de espera,
+    então N chamadores bloqueados acordam espaçados em 1/taxa segundos, não todos juntos;
+  - pode ser compartilhado entre threads (`TokenBucket`) e entre processos e máquinas
+    (`MongoTokenBucket`, um documento por balde).
+
+`RateLimitedClient` / `AsyncRateLimitedClient` são o `Client` / `AsyncClient` do atproto com o
+limitador aplicado em toda chamada XRPC; cada chamada e cada espera no balde também alimentam as
+métricas de `metrics.py`.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from atproto import Client, AsyncClient
+from atproto_client.exceptions import RequestErrorBase
+from pymongo.errors import DuplicateKeyError
+
+from apis.bsky.metrics import METRICS, xrpc_method
+
+# Padrão do AppView/PDS do Bluesky: 3000 requisições por janela de 5 minutos
+DEFAULT_RATE = 3000 / 300
+DEFAULT_BURST = 10
+# Quantas requisições deixar de folga em cada janela (outros processos, retries, etc.)
+DEFAULT_MARGIN = 50
+
+_FIELDS = ("tokens", "rate", "capacity", "updated", "paused_until", "reset_at", "window", "limit", "margin")
+
+
+def parse_ratelimit_headers(headers) -> dict:
+    """
+    Extrai `ratelimit-limit`, `ratelimit-remaining`, `ratelimit-reset` (epoch em segundos) e a
+    janela de `ratelimit-policy` ("3000;w=300"). Retorna None se a resposta não trouxer os cabeçalhos.
+    """
+    if not headers:
+        return None
+    headers = {str(k).lower(): v for k, v in dict(headers).items()}
+    if "ratelimit-remaining" not in headers or "ratelimit-reset" not in headers:
+        return None
+    try:
+        info = {
+            "remaining": int(headers["ratelimit-remaining"]),
+            "reset":     float(headers["ratelimit-reset"]),
+            "limit":     int(headers.get("ratelimit-limit", 0)) or None,
+            "window":    None,
+        }
+    except (TypeError, ValueError):
+        return None
+
+    for part in str(headers.get("ratelimit-policy", "")).split(";")[1:]:
+        key, _, value = part.strip().partition("=")
+        if key == "w" and value.isdigit():
+            info["window"] = float(value)
+    return info
+
+
+# --------------------------------
+#  LÓGICA DO BALDE (independente de onde o estado mora)
+# --------------------------------
+
+def new_state(rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, margin: int = DEFAULT_MARGIN, now: float = None) -> dict:
+    now = time.time() if now is None else now
+    return {
+        "tokens":       float(burst),
+        "rate":         float(rate),
+        "capacity":     float(burst),
+        "updated":      now,
+        "paused_until": 0.0,
+        "reset_at":     0.0,
+        "window":       0.0,
+        "limit":        0.0,
+        "margin":       float(margin),
+    }
+
+
+def _refill(s: dict, now: float):
+    # Janela do servidor virou: volta à taxa nominal (limite / janela)
+    if s["reset_at"] and now >= s["reset_at"]:
+        if s["limit"] and s["window"]:
+            s["rate"] = max(s["limit"] - s["margin"], 1) / s["window"]
+        s["reset_at"] = 0.0
+
+    start = max(s["updated"], s["paused_until"])
+    if now > start:
+        s["tokens"] = min(s["capacity"], s["tokens"] + (now - start) * s["rate"])
+    s["updated"] = max(now, s["updated"])
+
+
+def reserve_tokens(s: dict, n: float, now: float) -> float:
+    """
+    Consome `n` fichas (o saldo pode ficar negativo) e devolve quantos segundos o chamador deve
+    esperar antes de fazer a requisição.
+    """
+    _refill(s, now)
+    s["tokens"] -= n
+    wait = max(s["paused_until"] - now, 0.0)
+    if s["tokens"] < 0:
+        wait += -s["tokens"] / max(s["rate"], 1e-6)
+    return wait
+
+
+def peek_wait(s: dict, n: float, now: float) -> float:
+    """
+    Quanto `reserve_tokens` faria esperar agora, sem consumir nada.
+    """
+    return reserve_tokens(dict(s), n, now)
+
+
+def apply_headers(s: dict, info: dict, now: float):
+    """
+    Ajusta o balde ao orçamento real informado pelo servidor: nunca mais fichas do que o
+    `remaining` (menos a margem) e taxa suficiente para gastá-las até o `reset`.
+    """
+    _refill(s, now)
+    usable = max(info["remaining"] - s["margin"], 0)
+    until_reset = max(info["reset"] - now, 1.0)
+
+    s["tokens"] = min(s["tokens"], float(usable))
+    s["reset_at"] = info["reset"]
+    if info["limit"]:
+        s["limit"] = float(info["limit"])
+    if info["window"]:
+        s["window"] = info["window"]
+
+    if usable > 0:
+        s["rate"] = usable / until_reset
+    else:
+        # Orçamento esgotado: ninguém sai antes do reset, e depois dele vale a taxa nominal
+        s["paused_until"] = max(s["paused_until"], info["reset"])
+        if s["limit"] and s["window"]:
+            s["rate"] = max(s["limit"] - s["margin"], 1) / s["window"]
+
+
+def apply_penalty(s: dict, reset_ts: float, now: float):
+    """
+    Recebemos um 429: zera o saldo e pausa o balde inteiro até o reset (mais um pequeno jitter),
+    para que ninguém mais tente antes disso.
+    """
+    _refill(s, now)
+    if not reset_ts or reset_ts <= now:
+        reset_ts = now + 1.0
+    s["tokens"] = min(s["tokens"], 0.0)
+    s["paused_until"] = max(s["paused_until"], reset_ts + random.uniform(0.5, 2.0))
+    s["reset_at"] = reset_ts
+
+
+# --------------------------------
+#  BACKENDS
+# --------------------------------
+
+class _BaseBucket:
+    # Backends cuja operação faz I/O bloqueante (Mongo) rodam em thread no modo async
+    blocking_io = False
+
+    def reserve(self, n: float = 1) -> float:
+        raise NotImplementedError
+
+    def observe(self, headers):
+        raise NotImplementedError
+
+    def penalize(self, reset_ts: float = None):
+        raise NotImplementedError
+
+    def peek(self, n: float = 1) -> float:
+        """
+        Espera estimada para `n` fichas, sem reservá-las (para escolher entre vários baldes).
+        """
+        raise NotImplementedError
+
+    def acquire(self, n: float = 1):
+        wait = self.reserve(n)
+        if wait > 0:
+            _record_sleep(wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, n: float = 1):
+        if self.blocking_io:
+            wait = await asyncio.to_thread(self.reserve, n)
+        else:
+            wait = self.reserve(n)
+        if wait > 0:
+            _record_sleep(wait)
+            await asyncio.sleep(wait)
+
+    def observe_exception(self, e: Exception):
+        """
+        Aplica os cabeçalhos de uma resposta de erro e, se for 429, pausa o balde.
+        """
+        resp = getattr(e, "response", None)
+        if resp is None:
+            return
+        headers = getattr(resp, "headers", None) or {}
+        self.observe(headers)
+        if getattr(resp, "status_code", None) == 429 or "RateLimitExceeded" in str(e):
+            METRICS.inc('ratelimit_429_total')
+            info = parse_ratelimit_headers(headers)
+            self.penalize(info["reset"] if info else None)
+
+
+class TokenBucket(_BaseBucket):
+    """
+    Balde em memória, protegido por lock: compartilhado entre as threads de um processo.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, margin: int = DEFAULT_MARGIN):
+        self._lock = threading.Lock()
+        self._state = new_state(rate, burst, margin)
+
+    def reserve(self, n: float = 1) -> float:
+        with self._lock:
+            return reserve_tokens(self._state, n, time.time())
+
+    def peek(self, n: float = 1) -> float:
+        with self._lock:
+            return peek_wait(self._state, n, time.time())
+
+    def observe(self, headers):
+        info = parse_ratelimit_headers(headers)
+        if info is None:
+            return
+        with self._lock:
+            apply_headers(self._state, info, time.time())
+
+    def penalize(self, reset_ts: float = None):
+        with self._lock:
+            apply_penalty(self._state, reset_ts, time.time())
+
+
+class MongoTokenBucket(_BaseBucket):
+    """
+    Balde compartilhado entre máquinas: o estado fica num documento `{_id: key}` e cada operação
+    é um compare-and-set pelo campo `version` (funciona também no DocumentDB, sem transações).
+
+    Para não pagar um round-trip por requisição, `local_batch` fichas são reservadas de uma vez e
+    gastas localmente; as observações de cabeçalho são gravadas no máximo a cada `sync_interval`
+    segundos (um 429 é sempre gravado).
+    """
+
+    blocking_io = True
+
+    def __init__(self, coll, key: str = "bsky", rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 margin: int = DEFAULT_MARGIN, local_batch: int = 1, sync_interval: float = 1.0):
+        self._coll = coll
+        self._key = key
+        self._local_batch = max(int(local_batch), 1)
+        self._sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._local_tokens = 0
+        self._local_ready_at = 0.0
+        self._last_sync = 0.0
+        self._initial = new_state(rate, burst, margin)
+        self._create()
+
+    def _create(self):
+        """
+        Cria o documento do balde se ele não existir (primeira execução, ou apagado enquanto o
+        processo rodava); um upsert concorrente de outro processo não é erro.
+        """
+        try:
+            self._coll.update_one({"_id": self._key}, {"$setOnInsert": {"version": 0, **self._initial}}, upsert=True)
+        except DuplicateKeyError:
+            pass
+
+    def _load(self):
+        while True:
+            doc = self._coll.find_one({"_id": self._key})
+            if doc is not None:
+                return doc
+            self._create()
+
+    def _cas(self, fn, *args):
+        """
+        Compare-and-set pelo `version`. Chamado sem `self._lock`: threads que esperam pelo Mongo
+        não seguram as que ainda têm fichas locais.
+        """
+        while True:
+            doc = self._load()
+            s = {f: float(doc[f]) for f in _FIELDS}
+            result = fn(s, *args)
+            res = self._coll.update_one(
+                {"_id": self._key, "version": doc["version"]},
+                {"$set": s, "$inc": {"version": 1}}
+            )
+            if res.modified_count == 1:
+                return result
+
+    def reserve(self, n: float = 1) -> float:
+        now = time.time()
+        with self._lock:
+            if self._local_tokens >= n:
+                self._local_tokens -= n
+                return max(self._local_ready_at - now, 0.0)
+        # Sem fichas locais: reserva um lote no Mongo fora do lock; o que sobrar fica para as
+        # próximas chamadas, liberadas a partir do mesmo horário
+        wait = self._cas(reserve_tokens, self._local_batch, now)
+        with self._lock:
+            self._local_tokens += self._local_batch - n
+            self._local_ready_at = max(self._local_ready_at, now + wait)
+        return max(wait, 0.0)
+
+    def peek(self, n: float = 1) -> float:
+        now = time.time()
+        with self._lock:
+            if self._local_tokens >= n:
+                return max(self._local_ready_at - now, 0.0)
+        doc = self._load()
+        return peek_wait({f: float(doc[f]) for f in _FIELDS}, self._local_batch, now)
+
+    def observe(self, headers):
+        info = parse_ratelimit_headers(headers)
+        if info is None:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._last_sync < self._sync_interval:
+                return
+            self._last_sync = now
+        self._cas(apply_headers, info, now)
+
+    def penalize(self, reset_ts: float = None):
+        with self._lock:
+            self._local_tokens = 0
+        self._cas(apply_penalty, reset_ts, time.time())
+
+
+def build_bucket(backend: str = "local", coll=None, key: str = "bsky", **kwargs) -> _BaseBucket:
+    """
+    Cria o balde pelo nome do backend: "local" (threads de um processo) ou "mongo" (vários
+    processos ou máquinas; exige `coll`).
+    """
+    if backend == "local":
+        return TokenBucket(**kwargs)
+    if backend == "mongo":
+        if coll is None:
+            raise ValueError("O backend 'mongo' exige uma collection para o estado do balde.")
+        return MongoTokenBucket(coll, key=key, **kwargs)
+    raise ValueError(f"Backend de rate limit desconhecido: {backend}")
+
+
+# --------------------------------
+#  CLIENTES ATPROTO COM LIMITADOR
+# --------------------------------
+
+def _record_sleep(wait: float):
+    METRICS.inc('ratelimit_sleeps_total')
+    METRICS.inc('ratelimit_sleep_seconds_total', wait)
+
+
+def _record_call(url: str, started: float, response=None, error: Exception = None):
+    """
+    Latência (sem a espera do balde), status e bytes de uma chamada XRPC.
+    """
+    method = xrpc_method(url)
+    resp = response if response is not None else getattr(error, "response", None)
+    status = getattr(resp, "status_code", None) or "error"
+    METRICS.observe('xrpc_request_seconds', time.monotonic() - started, method=method)
+    METRICS.inc('xrpc_requests_total', method=method, status=status)
+    headers = {str(k).lower(): v for k, v in dict(getattr(resp, "headers", None) or {}).items()}
+    if headers.get("content-length"):
+        METRICS.inc('xrpc_response_bytes_total', int(headers["content-length"]), method=method)
+
+
+class RateLimitedClient(Client):
+    """
+    `Client` do atproto que pede ficha ao balde antes de cada chamada XRPC e alimenta o balde com
+    os cabeçalhos de cada resposta (inclusive de erro). Chamadas de sessão (createSession /
+    refreshSession) têm limite próprio no servidor e usam `session_bucket`, se informado.
+    """
+
+    def __init__(self, bucket: _BaseBucket, *args, session_bucket: _BaseBucket = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bucket = bucket
+        self.session_bucket = session_bucket
+
+    def _invoke(self, invoke_type, **kwargs):
+        bucket = self.session_bucket if kwargs.get("ignore_session_check") else self.bucket
+        if bucket is None:
+            return super()._invoke(invoke_type, **kwargs)
+
+        bucket.acquire()
+        started = time.monotonic()
+        try:
+            response = super()._invoke(invoke_type, **kwargs)
+        except RequestErrorBase as e:
+            _record_call(kwargs.get("url"), started, error=e)
+            bucket.observe_exception(e)
+            raise
+        _record_call(kwargs.get("url"), started, response)
+        bucket.observe(response.headers)
+        return response
+
+
+class AsyncRateLimitedClient(AsyncClient):
+    """
+    Versão assíncrona de `RateLimitedClient`.
+    """
+
+    def __init__(self, bucket: _BaseBucket, *args, session_bucket: _BaseBucket = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bucket = bucket
+        self.session_bucket = session_bucket
+
+    async def _invoke(self, invoke_type, **kwargs):
+        bucket = self.session_bucket if kwargs.get("ignore_session_check") else self.bucket
+        if bucket is None:
+            return await super()._invoke(invoke_type, **kwargs)
+
+        await bucket.acquire_async()
+        started = time.monotonic()
+        try:
+            response = await super()._invoke(invoke_type, **kwargs)
+        except RequestErrorBase as e:
+            _record_call(kwargs.get("url"), started, error=e)
+            if bucket.blocking_io:
+                await asyncio.to_thread(bucket.observe_exception, e)
+            else:
+                bucket.observe_exception(e)
+            raise
+        _record_call(kwargs.get("url"), started, response)
+        if bucket.blocking_io:
+            await asyncio.to_thread(bucket.observe, response.headers)
+        else:
+            bucket.observe(response.headers)
+        return response
@@ -0,0 +1,299 @@
+"""
+Sessão ATProto compartilhada entre processos e cliente HTTP com pool de conexões.
+
+Cada script fazia `client.login(...)` (um `createSession`) ao iniciar; reiniciar uma frota de
+workers gerava uma rajada de `createSession`, que tem limite próprio no servidor (30 por 5
+minutos). Com um cache de sessão, a string de sessão (access + refresh JWT) fica em disco ou no
+Mongo e é reaproveitada:
+
+  - o login primeiro tenta importar a sessão do cache, sem nenhum round-trip; só se não houver
+    sessão válida um único processo (sob um lock do cache) faz o `createSession`, e os demais
+    importam a sessão que ele gravou;
+  - o refresh do access JWT (feito pelo atproto quando faltam 15 min para expirar) também é
+    coordenado pelo lock: quem chega depois importa o token já renovado em vez de gastar o
+    refresh JWT, que o servidor rotaciona a cada uso;
+  - toda sessão nova ou renovada é gravada de volta no cache (`on_session_change`).
+
+Backends: "file" (um arquivo por conta em `SESSION_CACHE_DIR`, lock com `flock`, permissão 600)
+e "mongo" (coleção `MONGO_COLLECTION_SESSIONS`, lock por documento com validade).
+
+`build_request` monta o `Request` do atproto com keep-alive e, se o pacote `h2` estiver
+instalado, HTTP/2: as requisições de todas as threads/corrotinas são multiplexadas em poucas
+conexões, sem handshake TLS por requisição.
+"""
+
+import asyncio
+import fcntl
+import importlib.util
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from atproto_client.client.session import Session, SessionEvent
+from atproto_client.request import Request, AsyncRequest
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+
+from apis.bsky.rate_limit import RateLimitedClient, AsyncRateLimitedClient
+
+load_dotenv()
+
+SESSION_CACHE_DIR = os.getenv("SESSION_CACHE_DIR", ".bsky_sessions")
+# Depois disso um lock de sessão é considerado abandonado (processo morto no meio do login)
+LOCK_SECONDS = 60
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+HTTP2 = os.getenv("ATP_HTTP2", "true").lower() in ("1", "true", "yes")
+MAX_CONNECTIONS = int(os.getenv("ATP_MAX_CONNECTIONS", 100))
+KEEPALIVE_SECONDS = float(os.getenv("ATP_KEEPALIVE_SECONDS", 60))
+REQUEST_TIMEOUT = float(os.getenv("ATP_TIMEOUT", 30))
+
+
+def build_request(async_: bool = False, http2: bool = HTTP2, max_connections: int = MAX_CONNECTIONS):
+    """
+    `Request`/`AsyncRequest` do atproto com pool de conexões do tamanho da concorrência e
+    HTTP/2 quando disponível (sem o pacote `h2`, cai para HTTP/1.1 com keep-alive).
+    """
+    if http2 and not HTTP2_AVAILABLE:
+        print("[WARN] Pacote 'h2' não instalado; usando HTTP/1.1 com keep-alive.")
+        http2 = False
+
+    kwargs = {
+        'http2':   http2,
+        'timeout': REQUEST_TIMEOUT,
+        'limits':  httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_SECONDS,
+        ),
+    }
+    return AsyncRequest(**kwargs) if async_ else Request(**kwargs)
+
+
+def session_key(handle: str) -> str:
+    return f"bsky:{handle}"
+
+
+def _is_usable(session_string: str) -> bool:
+    """
+    A sessão ainda pode ser usada sem login se o refresh JWT não venceu (o access JWT vencido é
+    renovado pelo próprio cliente na primeira chamada).
+    """
+    try:
+        payload = Session.decode(session_string).refresh_jwt_payload
+    except Exception:
+        return False
+    return bool(payload and payload.exp and payload.exp > time.time() + 60)
+
+
+class FileSessionCache:
+    def __init__(self, directory: str = SESSION_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", key) + suffix)
+
+    def load(self, key: str):
+        try:
+            with open(self._path(key, ".session"), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, session_string: str):
+        # Escrita atômica: quem lê nunca vê um arquivo pela metade
+        path = self._path(key, ".session")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(session_string)
+        os.replace(tmp, path)
+
+    @contextmanager
+    def lock(self, key: str):
+        with open(self._path(key, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class MongoSessionCache:
+    def __init__(self, coll):
+        self.coll = coll
+
+    def load(self, key: str):
+        doc = self.coll.find_one({'_id': key}, {'session': 1})
+        return doc.get('session') if doc else None
+
+    def save(self, key: str, session_string: str):
+        self.coll.update_one(
+            {'_id': key},
+            {'$set': {'session': session_string, 'updated_at': datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    @contextmanager
+    def lock(self, key: str):
+        token = f"{os.getpid()}:{time.monotonic_ns()}"
+        deadline = time.monotonic() + LOCK_SECONDS
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                res = self.coll.update_one(
+                    {'_id': key, 'lock_until': {'$not': {'$gt': now}}},
+                    {'$set': {'lock_until': now + timedelta(seconds=LOCK_SECONDS), 'lock_token': token}},
+                    upsert=True
+                )
+                if res.matched_count or res.upserted_id is not None:
+                    break
+            except DuplicateKeyError:
+                # O documento existe e o lock está com outro processo
+                pass
+            if time.monotonic() > deadline:
+                print(f"[WARN] Lock de sessão '{key}' não liberado em {LOCK_SECONDS}s; seguindo sem ele.")
+                break
+            time.sleep(0.25)
+        try:
+            yield
+        finally:
+            self.coll.update_one({'_id': key, 'lock_token': token}, {'$unset': {'lock_until': '', 'lock_token': ''}})
+
+
+def build_session_cache(backend: str, coll=None, directory: str = SESSION_CACHE_DIR):
+    """
+    "file", "mongo" ou vazio/"none" (sem cache: cada processo faz o próprio login).
+    """
+    if backend == "file":
+        return FileSessionCache(directory)
+    if backend == "mongo":
+        return MongoSessionCache(coll)
+    return None
+
+
+class SessionCacheMixin:
+    """
+    Acrescenta o cache de sessão a um `Client` do atproto. Configure `session_cache` e
+    `session_key` e faça o login com `login_cached(login_fn)`.
+    """
+
+    session_cache = None
+    session_key = None
+    _watching = False
+
+    def _watch_session(self):
+        if self._watching:
+            return
+        self._watching = True
+
+        def on_change(event, session):
+            if event in (SessionEvent.CREATE, SessionEvent.REFRESH):
+                self.session_cache.save(self.session_key, self.export_session_string())
+
+        self.on_session_change(on_change)
+
+    def _adopt_cached(self) -> bool:
+        cached = self.session_cache.load(self.session_key)
+        if not cached or not _is_usable(cached):
+            return False
+        self._import_session_string(cached)
+        return True
+
+    def login_cached(self, login_fn):
+        """
+        Importa a sessão do cache ou, se não houver uma utilizável, chama `login_fn(self)` sob o
+        lock, para que só um processo faça o `createSession`.
+        """
+        if self.session_cache is None:
+            return login_fn(self)
+
+        self._watch_session()
+        if self._adopt_cached():
+            print("Sessão reaproveitada do cache")
+            return
+        with self.session_cache.lock(self.session_key):
+            if self._adopt_cached():
+                print("Sessão reaproveitada do cache")
+                return
+            login_fn(self)
+
+    def _refresh_and_set_session(self):
+        if self.session_cache is None:
+            return super()._refresh_and_set_session()
+
+        with self.session_cache.lock(self.session_key):
+            # Outro processo pode ter renovado enquanto esperávamos o lock
+            cached = self.session_cache.load(self.session_key)
+            if cached and cached != self.export_session_string():
+                self._import_session_string(cached)
+                if not self._should_refresh_session():
+                    return None
+            return super()._refresh_and_set_session()
+
+
+class AsyncSessionCacheMixin(SessionCacheMixin):
+    """
+    Versão assíncrona de `SessionCacheMixin`. O cache é bloqueante, então o lock e as leituras
+    rodam em threads para não parar o event loop.
+    """
+
+    async def _adopt_cached(self) -> bool:
+        cached = await asyncio.to_thread(self.session_cache.load, self.session_key)
+        if not cached or not _is_usable(cached):
+            return False
+        await self._import_session_string(cached)
+        return True
+
+    async def login_cached(self, login_fn):
+        if self.session_cache is None:
+            return await login_fn(self)
+
+        self._watch_session()
+        if await self._adopt_cached():
+            print("Sessão reaproveitada do cache (async)")
+            return
+        async with _async_lock(self.session_cache, self.session_key):
+            if await self._adopt_cached():
+                print("Sessão reaproveitada do cache (async)")
+                return
+            await login_fn(self)
+
+    async def _refresh_and_set_session(self):
+        if self.session_cache is None:
+            return await super(SessionCacheMixin, self)._refresh_and_set_session()
+
+        async with _async_lock(self.session_cache, self.session_key):
+            cached = await asyncio.to_thread(self.session_cache.load, self.session_key)
+            if cached and cached != self.export_session_string():
+                await self._import_session_string(cached)
+                if not self._should_refresh_session():
+                    return None
+            return await super(SessionCacheMixin, self)._refresh_and_set_session()
+
+
+class _async_lock:
+    def __init__(self, cache, key: str):
+        self._cm = cache.lock(key)
+
+    async def __aenter__(self):
+        await asyncio.to_thread(self._cm.__enter__)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.to_thread(self._cm.__exit__, exc_type, exc, tb)
+
+
+class CachedSessionClient(SessionCacheMixin, RateLimitedClient):
+    """
+    `RateLimitedClient` com cache de sessão.
+    """
+
+
+class AsyncCachedSessionClient(AsyncSessionCacheMixin, AsyncRateLimitedClient):
+    """
+    `AsyncRateLimitedClient` com cache de sessão.
+    """
@@ -0,0 +1,109 @@
+"""
+Particionamento por hash das tasks entre hosts do crawler.
+
+Usa o mesmo esquema de `compute_shard_for_id` do `detect_lang.py` (primeiro byte do SHA1 do
+valor, módulo o número de shards), aplicado ao DID da task. Cada task guarda:
+
+  - `shard_key`: o byte do hash (0..255), fixo para sempre;
+  - `shard`: `shard_key % num_shards`, o que o crawler consulta (índice `(shard, status)`).
+
+Com `--num-shards N --shard-index i`, o host só reserva tasks com `shard: i`, então hosts
+diferentes nunca disputam os mesmos documentos. Quando N muda, `rebalance` recalcula `shard` com
+no máximo 256 `update_many` (um por valor de `shard_key`, pelo índice), sem reler as tasks, e
+grava N no documento `shards:tasks` da coleção de checkpoints para que os crawlers detectem uma
+configuração divergente.
+
+Como `shard_key` tem só 256 valores, N vai de 1 a 256: acima disso sobrariam shards sem nenhuma
+task (hosts ociosos para sempre), então `check_num_shards` recusa esses valores.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, UpdateOne
+
+CONFIG_ID = "shards:tasks"
+# Valores distintos de `shard_key` (um byte)
+MAX_SHARDS = 256
+
+
+def shard_key(value) -> int:
+    return hashlib.sha1(str(value).encode("utf-8")).digest()[0]
+
+
+def shard_of(value, num_shards: int) -> int:
+    """
+    Igual a `compute_shard_for_id(value, num_shards)` do detect_lang.
+    """
+    return shard_key(value) % num_shards
+
+
+def check_num_shards(num_shards: int) -> int:
+    """
+    Devolve `num_shards` se estiver entre 1 e `MAX_SHARDS`; senão levanta `ValueError`.
+    """
+    if not 1 <= num_shards <= MAX_SHARDS:
+        raise ValueError(f"num_shards deve estar entre 1 e {MAX_SHARDS} (recebido: {num_shards}).")
+    return num_shards
+
+
+def shard_fields(did: str, num_shards: int = 1) -> dict:
+    key = shard_key(did)
+    return {'shard_key': key, 'shard': key % max(num_shards, 1)}
+
+
+def shard_query(num_shards: int, shard_index: int) -> dict:
+    return {'shard': shard_index} if num_shards > 1 else {}
+
+
+def ensure_shard_indexes(coll):
+    try:
+        coll.create_index([("shard", ASCENDING), ("status", ASCENDING)])
+        coll.create_index("shard_key")
+    except Exception as e:
+        print(f"[WARN] create_index(tasks.shard) ignorado: {e}")
+
+
+def configured_shards(config_coll):
+    doc = config_coll.find_one({'_id': CONFIG_ID})
+    return doc.get('num_shards') if doc else None
+
+
+def backfill_shard_keys(coll, num_shards: int, batch_size: int = 1000) -> int:
+    """
+    Preenche `shard_key`/`shard` das tasks criadas antes do particionamento.
+    """
+    total = 0
+    ops = []
+    for doc in coll.find({'shard_key': {'$exists': False}}, {'did': 1}).batch_size(batch_size):
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': shard_fields(doc.get('did') or doc['_id'], num_shards)}))
+        if len(ops) >= batch_size:
+            total += coll.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        total += coll.bulk_write(ops, ordered=False).modified_count
+    return total
+
+
+def rebalance(coll, config_coll, num_shards: int) -> dict:
+    """
+    Reatribui todas as tasks para `num_shards` shards e registra a nova configuração.
+    """
+    check_num_shards(num_shards)
+    ensure_shard_indexes(coll)
+    backfilled = backfill_shard_keys(coll, num_shards)
+
+    moved = 0
+    for key in range(MAX_SHARDS):
+        res = coll.update_many(
+            {'shard_key': key, 'shard': {'$ne': key % num_shards}},
+            {'$set': {'shard': key % num_shards}}
+        )
+        moved += res.modified_count
+
+    config_coll.update_one(
+        {'_id': CONFIG_ID},
+        {'$set': {'num_shards': num_shards, 'updated_at': datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return {'backfilled': backfilled, 'moved': moved}
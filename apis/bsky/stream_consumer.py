@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ingestão em tempo real pelo Jetstream (a versão JSON do firehose de repositórios do ATProto).
+
+Em vez de paginar o `get_author_feed` de cada DID, uma única conexão websocket recebe os
+commits `app.bsky.feed.post` da rede inteira; só os posts de DIDs presentes em
+`MONGO_COLLECTION_TASKS` são gravados, no mesmo layout de armazenamento do crawler
+(`--storage`, ver `feed_collector.py`).
+
+O cursor do Jetstream (`time_us` do último evento processado) é salvo na coleção de checkpoints
+a cada flush, então o consumidor retoma de onde parou depois de um restart. Para que reprocessar
+eventos nunca duplique posts, o layout recomendado é "posts" (upsert por `(did, uri)`).
+O stream não atualiza a marca d'água das tasks (`last_post_uri`/`last_post_at`): se o
+consumidor ficou parado, rode uma coleta `--incremental` para cobrir a lacuna.
+
+Comandos:
+  consume  conecta ao Jetstream (ou a JETSTREAM_URL) e grava os posts (padrão);
+  record   grava as mensagens cruas do stream num arquivo JSONL, para testes;
+  replay   servidor websocket local que reproduz um arquivo gravado com `record`, respeitando
+           `cursor` e `wantedCollections` como o Jetstream.
+
+Exemplo local:
+  python apis/bsky/stream_consumer.py replay --file amostra.jsonl --port 6008
+  python apis/bsky/stream_consumer.py consume --url ws://localhost:6008/subscribe --storage posts
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlparse, parse_qs
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+from websockets.sync.server import serve
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from apis.bsky.feed_collector import FeedCollector, DEFAULT_FIELDS, parse_fields, project_post
+from apis.bsky.posts_store import POSTS_COLLECTION, ensure_posts_indexes
+
+load_dotenv()
+
+JETSTREAM_URL = os.getenv("JETSTREAM_URL", "wss://jetstream2.us-east.bsky.network/subscribe")
+POST_NSID = "app.bsky.feed.post"
+# Posts acumulados, ou segundos desde o último flush, antes de gravar e salvar o cursor
+STREAM_FLUSH_SIZE = int(os.getenv("STREAM_FLUSH_SIZE", 500))
+STREAM_FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", 5))
+# Intervalo entre recargas do conjunto de DIDs acompanhados
+DID_REFRESH_SECONDS = float(os.getenv("STREAM_DID_REFRESH_SECONDS", 600))
+RECONNECT_MAX_SECONDS = 60
+
+
+def stream_url(base: str, cursor: int = None, collections=(POST_NSID,)) -> str:
+    params = [("wantedCollections", c) for c in collections]
+    if cursor:
+        params.append(("cursor", int(cursor)))
+    return f"{base}?{urlencode(params)}"
+
+
+def event_post(event: dict, fields=DEFAULT_FIELDS):
+    """
+    Converte um evento do Jetstream em `(did, post)`, com o post no mesmo formato que o
+    `FeedCollector` produz a partir do author feed. Devolve None para eventos que não são a
+    criação de um post.
+    """
+    commit = event.get("commit") or {}
+    if event.get("kind") != "commit" or commit.get("operation") != "create":
+        return None
+    if commit.get("collection") != POST_NSID:
+        return None
+
+    did = event.get("did")
+    uri = f"at://{did}/{POST_NSID}/{commit.get('rkey')}"
+    return did, project_post(commit.get("record") or {}, uri, commit.get("cid"), False, fields)
+
+
+def parse_event(raw):
+    """
+    Decodifica uma mensagem do stream; devolve None se ela não for um objeto JSON (frame
+    truncado ou corrompido), para que uma mensagem ruim não derrube o consumidor.
+    """
+    try:
+        event = json.loads(raw)
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
+
+
+class TrackedDids:
+    """
+    Conjunto dos DIDs presentes na coleção de tasks, recarregado numa thread em background a cada
+    `refresh_seconds` (a troca do conjunto é atômica, então o loop do stream nunca espera).
+    """
+
+    def __init__(self, tasks_coll, refresh_seconds: float = DID_REFRESH_SECONDS):
+        self._coll = tasks_coll
+        self._refresh_seconds = refresh_seconds
+        self.dids = frozenset()
+
+    def load(self):
+        cursor = self._coll.find({}, {'did': 1, '_id': 0}).batch_size(10_000)
+        self.dids = frozenset(doc['did'] for doc in cursor if doc.get('did'))
+        return self
+
+    def start(self):
+        def run():
+            while True:
+                time.sleep(self._refresh_seconds)
+                try:
+                    self.load()
+                except PyMongoError as e:
+                    print(f"[WARN] Falha ao recarregar os DIDs acompanhados: {e}")
+
+        threading.Thread(target=run, name="tracked-dids", daemon=True).start()
+        return self
+
+    def __contains__(self, did):
+        return did in self.dids
+
+    def __len__(self):
+        return len(self.dids)
+
+
+class StreamWriter:
+    """
+    Agrupa os posts recebidos por DID e grava tudo com um `bulk_write` por flush, salvando o
+    cursor logo depois: o cursor salvo nunca aponta além de um post ainda não gravado.
+    """
+
+    def __init__(self, target, checkpoints, name: str, storage: str, fields=DEFAULT_FIELDS,
+                 flush_size: int = STREAM_FLUSH_SIZE, flush_seconds: float = STREAM_FLUSH_SECONDS):
+        self.target = target
+        self.checkpoints = checkpoints
+        self.checkpoint_id = f"stream:{name}"
+        self.storage = storage
+        self.fields = set(fields) | ({'uri', 'reply', 'repost'} if storage == "posts" else set())
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.pending = {}
+        self.size = 0
+        self.total = 0
+        # Mensagens que não eram JSON válido (ignoradas, sem mexer no cursor)
+        self.skipped = 0
+        # `time_us` do último evento recebido (gravado ou descartado pelo filtro)
+        self.cursor = None
+        self._last_flush = time.monotonic()
+
+    def load_cursor(self):
+        doc = self.checkpoints.find_one({'_id': self.checkpoint_id})
+        return doc.get('cursor') if doc else None
+
+    def add(self, did: str, post: dict):
+        self.pending.setdefault(did, []).append(post)
+        self.size += 1
+
+    def due(self) -> bool:
+        return self.size >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_seconds
+
+    def flush(self) -> int:
+        ops = []
+        for did, posts in self.pending.items():
+            # Cada flush é uma escrita só: nos baldes, sem geração nem baldes parciais
+            collector = FeedCollector(did, storage=self.storage, incremental=True, staged=False)
+            collector.extend(posts)
+            ops.extend(collector.drain(final=True))
+
+        if ops:
+            self.target.bulk_write(ops, ordered=False)
+        if self.cursor:
+            self.checkpoints.update_one(
+                {'_id': self.checkpoint_id},
+                {'$set': {'kind': 'stream', 'cursor': self.cursor, 'updated_at': datetime.now(timezone.utc)},
+                 '$inc': {'posts': self.size}},
+                upsert=True
+            )
+
+        written = self.size
+        self.total += written
+        self.pending = {}
+        self.size = 0
+        self._last_flush = time.monotonic()
+        return written
+
+
+def consume(url: str, writer: StreamWriter, dids: TrackedDids, cursor: int = None, stop: threading.Event = None):
+    """
+    Loop principal: reconecta com backoff exponencial e retoma do último cursor salvo. Roda até
+    `stop` ser marcado (então grava o que estiver pendente e retorna); sem `stop`, para sempre.
+    """
+    stop = stop or threading.Event()
+    writer.cursor = cursor or writer.load_cursor()
+    delay = 1
+
+    while not stop.is_set():
+        print(f"Conectando a {url} (cursor={writer.cursor}, {len(dids)} DIDs acompanhados)…")
+        try:
+            with connect(stream_url(url, writer.cursor), max_size=None) as ws:
+                delay = 1
+                while not stop.is_set():
+                    try:
+                        raw = ws.recv(timeout=writer.flush_seconds)
+                    except TimeoutError:
+                        raw = None
+
+                    if raw:
+                        event = parse_event(raw)
+                        if event is None:
+                            writer.skipped += 1
+                            print(f"[WARN] Mensagem malformada ignorada ({writer.skipped} até agora).")
+                        else:
+                            parsed = event_post(event, writer.fields)
+                            if parsed and parsed[0] in dids:
+                                writer.add(*parsed)
+                            writer.cursor = event.get("time_us", writer.cursor)
+
+                    if writer.due() and writer.flush():
+                        print(f"{writer.total} posts gravados até agora (cursor={writer.cursor}).")
+                writer.flush()
+
+        except (ConnectionClosed, OSError, PyMongoError) as e:
+            # Grava o que já chegou antes de reconectar, para não reprocessar. Com o Mongo fora, os
+            # posts ficam no buffer (o cursor salvo não avança) e o próximo flush tenta de novo
+            try:
+                writer.flush()
+            except PyMongoError as flush_error:
+                print(f"Falha ao gravar {writer.size} posts pendentes ({flush_error}); ficam para o próximo flush.")
+            print(f"Conexão perdida ({e}); reconectando em {delay}s…")
+            stop.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+
+def record(url: str, out: str, limit: int = None, seconds: float = None):
+    """
+    Grava as mensagens cruas do stream (uma por linha) para reproduzir depois com `replay`.
+    """
+    started = time.monotonic()
+    count = 0
+    with connect(stream_url(url), max_size=None) as ws, open(out, "w", encoding="utf-8") as f:
+        while True:
+            if limit and count >= limit:
+                break
+            if seconds and time.monotonic() - started >= seconds:
+                break
+            try:
+                raw = ws.recv(timeout=1)
+            except TimeoutError:
+                continue
+            f.write(raw.strip() + "\n")
+            count += 1
+    print(f"{count} mensagens gravadas em {out}.")
+
+
+def load_events(path: str) -> list:
+    """
+    Lê um arquivo gravado com `record`; linhas que não são um objeto JSON são contadas e puladas.
+    """
+    events = []
+    skipped = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = parse_event(line)
+            if event is None:
+                skipped += 1
+                continue
+            events.append(event)
+    print(f"{len(events)} eventos carregados de {path}" + (f" ({skipped} linhas malformadas ignoradas)." if skipped else "."))
+    return events
+
+
+def replay_handler(events: list, speed: float = 0):
+    """
+    Handler websocket que reproduz `events` respeitando `cursor` e `wantedCollections` da URL.
+    """
+    def handler(ws):
+        query = parse_qs(urlparse(ws.request.path).query)
+        cursor = int(query.get("cursor", ["0"])[0] or 0)
+        wanted = set(query.get("wantedCollections", []))
+
+        previous = None
+        for event in events:
+            if event.get("time_us", 0) <= cursor:
+                continue
+            collection = (event.get("commit") or {}).get("collection")
+            if wanted and collection is not None and collection not in wanted:
+                continue
+            if speed > 0 and previous is not None:
+                time.sleep(max(event.get("time_us", 0) - previous, 0) / 1e6 / speed)
+            previous = event.get("time_us", previous)
+            ws.send(json.dumps(event))
+
+        try:
+            while True:
+                ws.recv()
+        except ConnectionClosed:
+            pass
+
+    return handler
+
+
+def replay_server(path: str, host: str = "localhost", port: int = 6008, speed: float = 0):
+    """
+    Servidor websocket que imita o endpoint `/subscribe` do Jetstream a partir de um arquivo
+    JSONL. `speed` > 0 reproduz os intervalos originais (`time_us`) acelerados por esse fator;
+    0 envia tudo o mais rápido possível. Depois do fim do arquivo a conexão fica aberta e ociosa,
+    como um stream sem eventos novos.
+    """
+    with serve(replay_handler(load_events(path), speed), host, port) as server:
+        print(f"Reproduzindo em ws://{host}:{port}/subscribe")
+        server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ingestão de posts em tempo real pelo Jetstream."
+    )
+    parser.add_argument("command", nargs="?", choices=["consume", "record", "replay"], default="consume",
+                        help="consume: grava os posts dos DIDs acompanhados (padrão); record: grava o stream "
+                             "cru num arquivo; replay: servidor local que reproduz um arquivo gravado.")
+    parser.add_argument("--url", default=JETSTREAM_URL, help=f"Endpoint do Jetstream (padrão: {JETSTREAM_URL}).")
+    parser.add_argument("--storage", choices=["embedded", "buckets", "posts"],
+                        default=os.getenv("STREAM_STORAGE", os.getenv("CRAWL_STORAGE", "posts")),
+                        help="consume: layout de armazenamento, como no crawler (padrão: posts).")
+    parser.add_argument("--fields", type=parse_fields,
+                        default=parse_fields(os.getenv("CRAWL_FIELDS", ",".join(DEFAULT_FIELDS))),
+                        help="consume: campos guardados de cada post, como no crawler "
+                             f"(padrão: {','.join(DEFAULT_FIELDS)}).")
+    parser.add_argument("--name", default=os.getenv("STREAM_NAME", "jetstream"),
+                        help="consume: nome do checkpoint do cursor (padrão: jetstream).")
+    parser.add_argument("--cursor", type=int, default=None,
+                        help="consume: time_us inicial, ignorando o checkpoint salvo.")
+    parser.add_argument("--file", help="record: arquivo de saída; replay: arquivo a reproduzir.")
+    parser.add_argument("--limit", type=int, default=None, help="record: número máximo de mensagens.")
+    parser.add_argument("--seconds", type=float, default=None, help="record: duração máxima da gravação.")
+    parser.add_argument("--port", type=int, default=6008, help="replay: porta do servidor local (padrão: 6008).")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="replay: fator de velocidade sobre os intervalos originais; 0 = sem pausas (padrão).")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.url, args.file, args.limit, args.seconds)
+        return
+    if args.command == "replay":
+        replay_server(args.file, port=args.port, speed=args.speed)
+        return
+
+    uri = (
+        f"mongodb://{os.getenv('MONGO_USER')}:{os.getenv('MONGO_PASS')}@{os.getenv('MONGO_HOST')}:"
+        f"{os.getenv('MONGO_PORT')}/?authSource={os.getenv('MONGO_AUTH_DB')}"
+    )
+    db = MongoClient(uri)[os.getenv("MONGO_DB")]
+    if args.storage == "posts":
+        target = db[POSTS_COLLECTION]
+        ensure_posts_indexes(target)
+    else:
+        target = db[os.getenv("MONGO_COLLECTION_DATA")]
+
+    dids = TrackedDids(db[os.getenv("MONGO_COLLECTION_TASKS")]).load().start()
+    writer = StreamWriter(target, db[os.getenv("MONGO_COLLECTION_CHECKPOINTS", "checkpoints")],
+                          args.name, args.storage, args.fields)
+    try:
+        consume(args.url, writer, dids, args.cursor)
+    except KeyboardInterrupt:
+        writer.flush()
+        print(f"Interrompido: {writer.total} posts gravados.")
+
+
+if __name__ == "__main__":
+    main()
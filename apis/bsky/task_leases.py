@@ -0,0 +1,326 @@
+"""
+Reserva (lease) de tasks em lote na coleção `MONGO_COLLECTION_TASKS`.
+
+Em vez de um `find_one_and_update({'status': 'pending'})` por DID, o worker reserva até N tasks
+em três round-trips fixos:
+
+  1. lê os `_id` de uma janela de tasks pendentes (só o índice de `status`, projeção `_id`) e
+     sorteia N deles, para que workers concorrentes não disputem sempre os mesmos documentos;
+  2. um único `update_many` filtrado por `status: 'pending'` carimba `lease_id`, `locked_by`,
+     `locked_at` e `lease_expires_at` — cada documento continua sendo reservado atomicamente,
+     e quem perdeu a corrida simplesmente não é carimbado;
+  3. lê de volta os documentos que receberam o `lease_id` deste lote.
+
+Se o worker perdeu a corrida por todas as sorteadas (comum no fim da fila, quando todos leem a
+mesma janela), repete com uma nova janela; um lote vazio quer dizer que não há pendentes.
+
+As conclusões são confirmadas com um único `bulk_write` não ordenado, filtrado pelo `lease_id`
+para nunca sobrescrever uma task que já foi reservada por outro worker.
+
+Leases vencem: enquanto processa, o worker renova `locked_at`/`lease_expires_at` das tasks que
+segura, identificadas pelo `lease_id` (`LeaseKeeper`). Se o worker morrer, `reap_expired` devolve
+as tasks vencidas para `pending` com `attempts` incrementado e um `next_attempt_at` com backoff
+exponencial, e as marca como `failed` depois de `max_attempts` tentativas. Erros durante a coleta
+seguem a mesma regra (`retry_op`) em vez de derrubar o worker. Quando só restam tasks em backoff,
+o crawler espera a primeira voltar (`retry_wait`) em vez de encerrar; ele termina quando não há
+mais pendentes.
+"""
+
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+load_dotenv()
+
+LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", 900))
+MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", 5))
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+# Quantas vezes N ler na janela de candidatas antes de sortear
+CLAIM_OVERSAMPLE = 4
+
+
+def pending_filter(extra: dict = None) -> dict:
+    # `$not: {$gt}` também casa tasks sem `next_attempt_at` (nunca falharam)
+    query = {
+        'status':          'pending',
+        'next_attempt_at': {'$not': {'$gt': datetime.now(timezone.utc)}},
+    }
+    if extra:
+        query.update(extra)
+    return query
+
+
+def _seconds_until(doc) -> float:
+    if doc is None:
+        return None
+    when = doc.get('next_attempt_at')
+    if when is None:
+        return 0.0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def retry_wait(coll, query: dict = None) -> float:
+    """
+    Segundos até a primeira task pendente em backoff poder ser reservada de novo (0 se já há
+    alguma disponível), ou None se não há pendentes: o worker espera em vez de encerrar com
+    tasks que falharam ainda por tentar.
+    """
+    return _seconds_until(coll.find_one(
+        {'status': 'pending', **(query or {})}, {'next_attempt_at': 1}, sort=[('next_attempt_at', 1)]
+    ))
+
+
+async def retry_wait_async(coll, query: dict = None) -> float:
+    return _seconds_until(await coll.find_one(
+        {'status': 'pending', **(query or {})}, {'next_attempt_at': 1}, sort=[('next_attempt_at', 1)]
+    ))
+
+
+def backoff_seconds(attempts: int) -> float:
+    """
+    Espera antes da próxima tentativa: exponencial em `attempts`, com teto e jitter de ±20%.
+    """
+    base = min(RETRY_BASE_SECONDS * (2 ** attempts), RETRY_MAX_SECONDS)
+    return base * random.uniform(0.8, 1.2)
+
+
+def _lease_update(worker_id: str, lease_id: str, lease_seconds: int) -> dict:
+    now = datetime.now(timezone.utc)
+    return {'$set': {
+        'status':           'processing',
+        'locked_by':        worker_id,
+        'locked_at':        now,
+        'lease_id':         lease_id,
+        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+    }}
+
+
+def _sample_ids(candidates: list, n: int) -> list:
+    ids = [doc['_id'] for doc in candidates]
+    return random.sample(ids, n) if len(ids) > n else ids
+
+
+def claim_batch(coll, worker_id: str, n: int, lease_seconds: int = LEASE_SECONDS, query: dict = None) -> list:
+    """
+    Reserva até `n` tasks pendentes para `worker_id`. Devolve a lista de documentos reservados
+    (pode ser menor que `n` se outro worker ganhou parte da corrida). Se outros workers levaram
+    todas as sorteadas, tenta de novo com uma nova janela: só devolve vazia se não há pendentes.
+    """
+    while True:
+        flt = pending_filter(query)
+        candidates = list(coll.find(flt, {'_id': 1}).limit(n * CLAIM_OVERSAMPLE))
+        if not candidates:
+            return []
+
+        lease_id = uuid.uuid4().hex
+        ids = _sample_ids(candidates, n)
+        coll.update_many({**flt, '_id': {'$in': ids}}, _lease_update(worker_id, lease_id, lease_seconds))
+        claimed = list(coll.find({'_id': {'$in': ids}, 'lease_id': lease_id}))
+        if claimed:
+            return claimed
+
+
+async def claim_batch_async(coll, worker_id: str, n: int, lease_seconds: int = LEASE_SECONDS, query: dict = None) -> list:
+    """
+    Versão assíncrona de `claim_batch` (AsyncCollection do pymongo).
+    """
+    while True:
+        flt = pending_filter(query)
+        candidates = await coll.find(flt, {'_id': 1}).limit(n * CLAIM_OVERSAMPLE).to_list()
+        if not candidates:
+            return []
+
+        lease_id = uuid.uuid4().hex
+        ids = _sample_ids(candidates, n)
+        await coll.update_many({**flt, '_id': {'$in': ids}}, _lease_update(worker_id, lease_id, lease_seconds))
+        claimed = await coll.find({'_id': {'$in': ids}, 'lease_id': lease_id}).to_list()
+        if claimed:
+            return claimed
+
+
+def ack_op(task: dict, status: str, **fields) -> UpdateOne:
+    """
+    Monta a confirmação de uma task reservada (`done`, `failed`, ...) para o `bulk_write`.
+    """
+    return UpdateOne(
+        {'_id': task['_id'], 'lease_id': task.get('lease_id')},
+        {
+            '$set':   {'status': status, 'processed_at': datetime.now(timezone.utc), **fields},
+            '$unset': {'lease_id': '', 'lease_expires_at': '', 'next_attempt_at': ''},
+        }
+    )
+
+
+def retry_op(task: dict, error: str, max_attempts: int = MAX_ATTEMPTS) -> UpdateOne:
+    """
+    Confirmação de uma task que falhou: volta para `pending` com backoff, ou vai para `failed`
+    se já esgotou `max_attempts`.
+    """
+    attempts = task.get('attempts', 0) + 1
+    now = datetime.now(timezone.utc)
+
+    if attempts >= max_attempts:
+        update = {'status': 'failed', 'processed_at': now}
+    else:
+        update = {'status': 'pending', 'next_attempt_at': now + timedelta(seconds=backoff_seconds(attempts))}
+
+    return UpdateOne(
+        {'_id': task['_id'], 'lease_id': task.get('lease_id')},
+        {
+            '$set':   {**update, 'error': error, 'attempts': attempts, 'locked_by': None},
+            '$unset': {'lease_id': '', 'lease_expires_at': ''},
+        }
+    )
+
+
+def requeue_done(coll, older_than_seconds: float, query: dict = None) -> int:
+    """
+    Devolve para `pending` as tasks concluídas há mais de `older_than_seconds`, para que sejam
+    recoletadas (de forma incremental, se o crawler rodar com `--incremental`).
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than_seconds)
+    res = coll.update_many(
+        {'status': 'done', 'processed_at': {'$lt': cutoff}, **(query or {})},
+        {'$set': {'status': 'pending', 'locked_by': None, 'attempts': 0}}
+    )
+    return res.modified_count
+
+
+def renew_leases(coll, leases: dict, lease_seconds: int = LEASE_SECONDS):
+    """
+    Renova as tasks de `leases` (`_id` -> `lease_id`). O filtro é o `lease_id`, não o
+    `locked_by`: processos no mesmo host têm o mesmo `WORKER_ID`, e uma task que venceu e foi
+    reservada de novo por outro processo não pode ter o lease dele estendido por este.
+    """
+    if not leases:
+        return None
+    now = datetime.now(timezone.utc)
+    return coll.update_many(
+        {'_id': {'$in': list(leases)}, 'lease_id': {'$in': list(set(leases.values()))}, 'status': 'processing'},
+        {'$set': {'locked_at': now, 'lease_expires_at': now + timedelta(seconds=lease_seconds)}}
+    )
+
+
+def reap_expired(coll, max_attempts: int = MAX_ATTEMPTS, lease_seconds: int = LEASE_SECONDS) -> dict:
+    """
+    Recupera tasks presas em `processing` cujo lease venceu (ou, para tasks antigas sem
+    `lease_expires_at`, cujo `locked_at` passou de `lease_seconds`). Devolve as contagens
+    `{'pending': n, 'failed': m}`.
+
+    O backoff depende de `attempts`, então há um `update_many` por faixa de tentativas
+    (no máximo `max_attempts` round-trips).
+    """
+    now = datetime.now(timezone.utc)
+    expired = {
+        'status': 'processing',
+        '$or': [
+            {'lease_expires_at': {'$lt': now}},
+            {'lease_expires_at': {'$exists': False}, 'locked_at': {'$lt': now - timedelta(seconds=lease_seconds)}},
+        ],
+    }
+    release = {'$unset': {'lease_id': '', 'lease_expires_at': ''}}
+    counts = {'pending': 0, 'failed': 0}
+
+    exhausted = {'attempts': {'$gte': max_attempts - 1}} if max_attempts > 1 else {}
+    res = coll.update_many(
+        {**expired, **exhausted},
+        {**release,
+         '$set': {'status': 'failed', 'error': 'lease expired', 'processed_at': now, 'locked_by': None},
+         '$inc': {'attempts': 1}}
+    )
+    counts['failed'] += res.modified_count
+
+    for attempts in range(max_attempts - 1):
+        attempt_filter = {'attempts': attempts} if attempts else {'attempts': {'$in': [0, None]}}
+        res = coll.update_many(
+            {**expired, **attempt_filter},
+            {**release,
+             '$set': {'status': 'pending', 'error': 'lease expired', 'locked_by': None,
+                      'next_attempt_at': now + timedelta(seconds=backoff_seconds(attempts + 1))},
+             '$inc': {'attempts': 1}}
+        )
+        counts['pending'] += res.modified_count
+
+    return counts
+
+
+def start_reaper(coll, interval: float, max_attempts: int = MAX_ATTEMPTS, lease_seconds: int = LEASE_SECONDS,
+                 log=print) -> threading.Thread:
+    """
+    Roda `reap_expired` a cada `interval` segundos numa thread daemon.
+    """
+    def run():
+        while True:
+            try:
+                counts = reap_expired(coll, max_attempts, lease_seconds)
+                if counts['pending'] or counts['failed']:
+                    log(f"[reaper] Leases vencidos: {counts['pending']} de volta a pending, {counts['failed']} failed.")
+            except Exception as e:
+                log(f"[reaper] Erro ao recuperar leases vencidos: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="lease-reaper", daemon=True)
+    thread.start()
+    return thread
+
+
+class LeaseKeeper:
+    """
+    Heartbeat dos leases: renova, a cada `lease_seconds / 3`, todas as tasks que este worker
+    está segurando, pelo `lease_id` com que cada uma foi reservada. Thread-safe, então serve tanto ao modo de threads quanto ao async.
+    """
+
+    def __init__(self, coll, worker_id: str, lease_seconds: int = LEASE_SECONDS, log=print):
+        self._coll = coll
+        self._worker_id = worker_id
+        self._lease_seconds = lease_seconds
+        self._log = log
+        self._held = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def hold(self, tasks: list):
+        with self._lock:
+            self._held.update((t['_id'], t.get('lease_id')) for t in tasks)
+
+    def release(self, tasks: list):
+        with self._lock:
+            for t in tasks:
+                self._held.pop(t['_id'], None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self._lease_seconds / 3):
+            with self._lock:
+                leases = dict(self._held)
+            try:
+                renew_leases(self._coll, leases, self._lease_seconds)
+            except Exception as e:
+                self._log(f"[{self._worker_id}] Falha ao renovar leases: {e}")
+
+
+def ack_batch(coll, ops: list):
+    if ops:
+        return coll.bulk_write(ops, ordered=False)
+
+
+async def ack_batch_async(coll, ops: list):
+    if ops:
+        return await coll.bulk_write(ops, ordered=False)
@@ -0,0 +1,32 @@
+"""
+Testes offline: Mongo em memória (mongomock, com o adaptador de bulk_write do
+`mock_appview.MockCollection`) e o AppView falso. Requer `pip install -r requirements-dev.txt`.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+# detect_lang.py, analise_bsky_prod.py e populate_tasks.py exigem a configuração do Mongo no
+# import; populate_tasks só dispensa o login com o AppView público
+for key, value in (("MONGO_USER", "test"), ("MONGO_PASS", "test"), ("MONGO_HOST", "localhost"),
+                   ("MONGO_PORT", "27017"), ("MONGO_AUTH_DB", "admin"), ("MONGO_DB", "bsky_test"),
+                   ("MONGO_COLLECTION_TASKS", "tasks"), ("MONGO_COLLECTION_DATA", "bsky"),
+                   ("APPVIEW_MODE", "public")):
+    os.environ.setdefault(key, value)
+
+
+@pytest.fixture
+def mongo_db():
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient()["bsky_test"]
+
+
+@pytest.fixture
+def wrap():
+    from apis.bsky.mock_appview import MockCollection
+    return MockCollection
@@ -0,0 +1,56 @@
+"""
+Pool de contas: `pick` nunca entrega uma conta sem sessão.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from apis.bsky.accounts import AccountPool
+
+
+class FakeClient:
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+
+    def login_cached(self, login):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("senha errada")
+
+
+def pool_with(*clients, public: bool = False) -> AccountPool:
+    pool = AccountPool(log=lambda msg: None)
+    for i, client in enumerate(clients):
+        pool.add(f"a{i}.test", "x", client)
+    if public:
+        pool.set_public(FakeClient())
+    return pool
+
+
+def test_pick_waits_for_a_background_login():
+    pool = pool_with(FakeClient(delay=0.2))
+    pool.login_in_background(lambda c, handle, password: None)
+
+    account = pool.pick(authenticated=True)
+
+    assert account.handle == "a0.test" and account.logged_in
+
+
+def test_pick_raises_when_no_account_logged_in():
+    pool = pool_with(FakeClient(fail=True), public=True)
+    pool.login_all(lambda c, handle, password: None, required=False)
+
+    with pytest.raises(RuntimeError):
+        pool.pick(authenticated=True)
+    with pytest.raises(RuntimeError):
+        asyncio.run(pool.pick_async(authenticated=True))
+
+
+def test_quarantined_public_appview_is_still_preferred_to_accounts_without_session():
+    pool = pool_with(FakeClient(), public=True)
+    pool.public.quarantined_until = time.time() + 60
+
+    assert pool.pick() is pool.public
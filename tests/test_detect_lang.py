@@ -0,0 +1,90 @@
+"""
+detect_lang: idiomas declarados, isolamento por documento, pré-classificador pt e gravação por
+post. Sem Mongo real (o `process_documents` não acessa o banco; `lang_update` roda no mongomock).
+"""
+
+import pytest
+
+pytest.importorskip("langdetect")
+
+from apis.bsky.bsky_lang_detection.detect_lang import lang_update, process_documents, pt_prefilter
+
+
+def test_process_documents_uses_declared_and_existing_langs():
+    docs = [{'_id': 1, 'posts': [{'text': "hello there", 'langs': ["en"]}, {'text': "x", 'lang': "pt"}]}]
+
+    resultados = {r[0]: r for r in process_documents(docs)}
+
+    assert resultados[1][2] == {0: "en"}
+    assert resultados[1][3] == {'declarado': 1, 'existente': 1}
+
+
+def test_process_documents_isolates_bad_documents():
+    docs = [
+        {'_id': 1, 'posts': [{'text': "hello there", 'langs': ["en"]}]},
+        {'_id': 2, 'posts': [None]},
+    ]
+
+    resultados = {r[0]: r for r in process_documents(docs)}
+
+    assert resultados[1][2] == {0: "en"}
+    assert resultados[2][2] is None
+
+
+@pytest.mark.parametrize("texto", [
+    "Hoje eu fui ao mercado com a minha mãe",
+    "não sei se vou conseguir ir amanhã",
+    "ele tem um carro e eu tenho uma moto",
+    "kkkkk que isso mano",
+])
+def test_prefilter_accepts_portuguese(texto):
+    assert pt_prefilter(texto) == "pt"
+
+
+@pytest.mark.parametrize("texto", [
+    # Só palavras compartilhadas ("da", "e", "sua", "um") não bastam para um "pt"
+    "Io sono andato da mia madre e sua sorella ieri sera",
+    "Ich gehe um acht Uhr da hin und dann nach Hause",
+    "Eu non sei se isto vai ir ben, moito traballo xa",
+    "Je suis allé au marché avec ma mère et elle était très contente",
+    "The weather is nice and I like it a lot",
+    "Hoy fui al mercado con mi madre y estaba muy contenta",
+])
+def test_prefilter_never_says_pt_for_other_languages(texto):
+    assert pt_prefilter(texto) != "pt"
+
+
+def test_prefilter_leaves_short_or_unclear_text_to_the_backend():
+    assert pt_prefilter("ok") is None
+    assert pt_prefilter("e da um") is None
+    assert pt_prefilter("") is None
+
+
+def test_process_documents_short_circuits_with_the_prefilter():
+    docs = [{'_id': 3, 'posts': [{'text': "Hoje eu fui ao mercado com a minha mãe"}]}]
+
+    resultados = {r[0]: r for r in process_documents(docs, prefilter=True)}
+
+    assert resultados[3][2] == {0: "pt"} and resultados[3][3] == {'prefiltro': 1}
+
+
+def test_lang_update_sets_only_new_langs_and_guards_array_size(mongo_db, wrap):
+    coll = wrap(mongo_db.data)
+    coll.insert_one({'_id': 1, 'posts': [{'text': "a", 'lang': "en"}, {'text': "b"}, {'text': "c"}]})
+
+    coll.bulk_write([lang_update(1, 3, {1: "pt", 2: "es"})])
+    assert [p.get('lang') for p in coll.find_one({'_id': 1})['posts']] == ["en", "pt", "es"]
+
+    # A coleta incremental mesclou um post no meio tempo: os índices mudaram, nada é gravado
+    coll.update_one({'_id': 1}, {'$push': {'posts': {'$each': [{'text': "novo"}], '$position': 0}}})
+    coll.bulk_write([lang_update(1, 3, {0: "fr"})])
+    assert [p.get('lang') for p in coll.find_one({'_id': 1})['posts']] == [None, "en", "pt", "es"]
+
+
+def test_lang_update_posts_layout(mongo_db, wrap):
+    coll = wrap(mongo_db.posts)
+    coll.insert_one({'_id': 7, 'text': "olá"})
+
+    coll.bulk_write([lang_update(7, 1, {0: "pt"}, layout="posts")])
+
+    assert coll.find_one({'_id': 7})['lang'] == "pt"
@@ -0,0 +1,157 @@
+"""
+FeedCollector: coleta incremental, layouts de armazenamento e filtros, sem rede (itens falsos do
+author feed e Mongo em memória).
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from apis.bsky.feed_collector import FeedCollector, task_since
+
+
+def item(i, repost=False, did="did:plc:a"):
+    record = SimpleNamespace(text=f"post {i}", created_at=f"2024-01-{i:02d}T00:00:00Z",
+                             langs=["pt"], reply=None, facets=None, embed=None)
+    reason = SimpleNamespace(py_type="app.bsky.feed.defs#reasonRepost") if repost else None
+    return SimpleNamespace(post=SimpleNamespace(uri=f"at://{did}/app.bsky.feed.post/{i}", cid=f"c{i}", record=record),
+                           reason=reason)
+
+
+def crawl(coll, pages, since=None, storage="embedded", incremental=False, fail_after=None, **budget):
+    """
+    Reproduz o laço do crawler: `drain()` a cada página, `finish()` + `drain(final=True)` no fim.
+    """
+    collector = FeedCollector("did:plc:a", since, storage=storage, incremental=incremental, **budget)
+    for n, page in enumerate(pages, 1):
+        collector.add_page([item(i) for i in page])
+        ops = collector.drain()
+        if ops:
+            coll.bulk_write(ops)
+        if fail_after == n:
+            return collector
+        if collector.done:
+            break
+    collector.finish()
+    ops = collector.drain(final=True)
+    if ops:
+        coll.bulk_write(ops)
+    return collector
+
+
+def texts(coll, query=None):
+    return sorted(p['text'] for d in coll.find(query or {}) for p in d['posts'])
+
+
+def test_watermark_only_after_finish():
+    collector = FeedCollector("did:plc:a")
+    collector.add_page([item(3), item(2)])
+    assert collector.watermark() == {}
+
+    collector.finish()
+
+    assert collector.watermark() == {'last_post_uri': "at://did:plc:a/app.bsky.feed.post/3",
+                                      'last_post_at': "2024-01-03T00:00:00Z"}
+
+
+def test_incremental_run_merges_into_full_crawl_document(mongo_db, wrap):
+    coll = wrap(mongo_db.data)
+    first = crawl(coll, [[3, 2, 1]])
+    task = {'did': "did:plc:a", **first.watermark()}
+
+    second = crawl(coll, [[5, 4, 3, 2]], since=task_since(task), incremental=True)
+
+    assert second.stopped_by == "known"
+    assert coll.count_documents({}) == 1
+    assert [p['text'] for p in coll.find_one({'did': "did:plc:a"})['posts']] == [
+        "post 5", "post 4", "post 3", "post 2", "post 1"]
+
+
+def test_full_crawl_replaces_embedded_document(mongo_db, wrap):
+    coll = wrap(mongo_db.data)
+    crawl(coll, [[3, 2, 1]])
+    crawl(coll, [[4, 3, 2, 1]])
+
+    assert coll.count_documents({}) == 1
+    assert texts(coll) == ["post 1", "post 2", "post 3", "post 4"]
+
+
+def test_reposts_are_skipped_and_not_watermarked():
+    collector = FeedCollector("did:plc:a")
+    collector.add_page([item(5, repost=True), item(4)])
+    collector.finish()
+
+    assert collector.count == 1
+    assert collector.skipped['reposts'] == 1
+    assert collector.watermark()['last_post_uri'].endswith("/4")
+
+
+def test_budget_stops_pagination():
+    collector = FeedCollector("did:plc:a", max_posts=3)
+    collector.add_page([item(i) for i in (9, 8)])
+    collector.add_page([item(i) for i in (7, 6)])
+    assert collector.done and collector.stopped_by == "max_posts" and collector.count == 3
+
+
+def test_incremental_run_ignores_budget_and_leaves_no_gap(mongo_db, wrap):
+    coll = wrap(mongo_db.data)
+    task = {'did': "did:plc:a", **crawl(coll, [[3, 2, 1]]).watermark()}
+
+    second = crawl(coll, [[9, 8], [7, 6], [5, 4, 3]], since=task_since(task), incremental=True,
+                   max_posts=2, max_pages=1)
+    assert second.stopped_by == "known" and second.count == 6
+    task.update(second.watermark())
+
+    third = crawl(coll, [[9, 8, 7]], since=task_since(task), incremental=True, max_posts=2)
+    assert third.count == 0
+    assert texts(coll) == sorted(f"post {i}" for i in range(1, 10))
+
+
+@pytest.mark.parametrize("bucket_max", [2, 1000])
+def test_bucket_crawl_replaces_old_buckets_only_when_complete(mongo_db, wrap, monkeypatch, bucket_max):
+    monkeypatch.setattr("apis.bsky.feed_collector.BUCKET_MAX_POSTS", bucket_max)
+    coll = wrap(mongo_db.data)
+    coll.insert_one({'did': "did:plc:a", 'posts': [{'text': "embedded"}]})
+    pages = [[9, 8, 7], [6, 5, 4], [3, 2, 1]]
+    expected = sorted(f"post {i}" for i in range(1, 10))
+
+    crawl(coll, pages, storage="buckets")
+    assert texts(coll, {'n': {'$exists': True}}) == expected
+
+    # Uma coleta que falha no meio não apaga os baldes completos anteriores
+    crawl(coll, pages, storage="buckets", fail_after=1)
+    assert set(expected) <= set(texts(coll, {'n': {'$exists': True}}))
+
+    crawl(coll, pages, storage="buckets")
+    assert texts(coll, {'n': {'$exists': True}}) == expected
+    assert all(d['n'] <= max(bucket_max, 3) for d in coll.find({'n': {'$exists': True}}))
+    # O documento do layout embutido, na mesma coleção, não é tocado
+    assert texts(coll, {'n': {'$exists': False}}) == ["embedded"]
+
+
+def test_bucket_retries_after_a_failed_attempt_do_not_duplicate_posts(mongo_db, wrap):
+    coll = wrap(mongo_db.data)
+    buckets = {'n': {'$exists': True}}
+    task = {'did': "did:plc:a", **crawl(coll, [[3, 2, 1]], storage="buckets").watermark()}
+    # Uma coleta completa que falha no meio deixa baldes parciais
+    crawl(coll, [[9, 8], [7, 6]], storage="buckets", fail_after=1)
+
+    # A incremental seguinte também falha no meio e a marca d'água não avança
+    failed = crawl(coll, [[9, 8], [7, 6], [5, 4, 3]], since=task_since(task), storage="buckets",
+                   incremental=True, fail_after=1)
+    assert failed.watermark() == {}
+
+    crawl(coll, [[9, 8], [7, 6], [5, 4, 3]], since=task_since(task), storage="buckets", incremental=True)
+    assert texts(coll, buckets) == sorted(f"post {i}" for i in range(1, 10))
+    assert coll.count_documents({**buckets, 'partial': True}) == 0
+
+
+def test_posts_layout_is_idempotent(mongo_db, wrap):
+    coll = wrap(mongo_db.posts)
+    coll.create_index([("did", 1), ("uri", 1)], unique=True)
+
+    crawl(coll, [[3, 2], [1]], storage="posts")
+    crawl(coll, [[3, 2], [1]], storage="posts")
+
+    assert coll.count_documents({}) == 3
+    assert {d['is_reply'] for d in coll.find()} == {False}
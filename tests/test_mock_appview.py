@@ -0,0 +1,27 @@
+import argparse
+
+import pytest
+
+pytest.importorskip("mongomock")
+pytest.importorskip("atproto")
+
+from apis.bsky.mock_appview import run_benchmark
+
+
+def test_benchmark_smoke(monkeypatch):
+    """
+    `mock_appview.py benchmark --dids 20` encolhido: o crawler real, em modo público, contra o
+    AppView falso e o mongomock, com 429 aleatórios.
+    """
+    monkeypatch.setattr("sys.argv", ["mock_appview.py"])
+    args = argparse.Namespace(
+        posts_min=5, posts_max=150, latency=0.0, jitter=0.0, limit=100000, window=300,
+        error_rate=0.05, reset_seconds=0.05, dids=20, client_rate=1000, mongo_uri=None, mongo_db="bsky_bench_test",
+    )
+
+    report = run_benchmark(args, ["--claim-batch", "4"])
+
+    assert report['dids_done'] == 20
+    assert report['dids_pending'] == 0
+    assert report['posts'] > 0
+    assert report['pages'] >= 20
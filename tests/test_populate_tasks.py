@@ -0,0 +1,88 @@
+"""
+Agendamento de tarefas (`populate_tasks`): falhas de escrita não avançam o checkpoint.
+"""
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from apis.bsky import populate_tasks
+
+
+class FailingCollection:
+    """Coleção cujo `bulk_write` falha com um erro que não é de chave duplicada a partir da chamada `fail_at`."""
+
+    def __init__(self, coll, fail_at: int):
+        self._coll = coll
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self._coll, name)
+
+    def bulk_write(self, ops, ordered: bool = True):
+        self.calls += 1
+        if self.calls >= self.fail_at:
+            raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'validation failed'}],
+                                  'nUpserted': 0})
+        return self._coll.bulk_write(ops, ordered=ordered)
+
+
+def profiles(page: int):
+    return [{'did': f"did:plc:p{page}-{i}", 'handle': f"p{page}-{i}.test"} for i in range(3)]
+
+
+@pytest.fixture
+def scheduler(mongo_db, wrap, monkeypatch):
+    def setup(fail_at: int = 1_000):
+        tasks = FailingCollection(wrap(mongo_db["tasks"]), fail_at)
+        monkeypatch.setattr(populate_tasks, "tasks_coll", tasks)
+        monkeypatch.setattr(populate_tasks, "checkpoints_coll", mongo_db["checkpoints"])
+        monkeypatch.setattr(populate_tasks, "FLUSH_SIZE", 3)
+        monkeypatch.setattr(populate_tasks, "resolve_did", lambda handle: "did:plc:seed")
+        pages = [(profiles(n), f"c{n}" if n < 3 else None) for n in range(4)]
+        monkeypatch.setattr(populate_tasks, "iter_graph_pages", lambda did, relation, cursor=None: iter(pages))
+        return tasks
+    return setup
+
+
+def test_rescheduling_known_followers_inserts_nothing(scheduler):
+    scheduler()
+    ops = [populate_tasks.follower_upsert(p) for p in profiles(0)]
+    assert populate_tasks.flush_followers(ops) == 3
+    assert populate_tasks.flush_followers(ops) == 0
+
+
+def test_write_error_keeps_checkpoint_at_last_written_page(scheduler, mongo_db):
+    scheduler(fail_at=3)
+
+    assert populate_tasks.get_all_followers("seed.test") == 6
+
+    checkpoint = mongo_db["checkpoints"].find_one({'_id': "followers:did:plc:seed"})
+    assert checkpoint['status'] == 'running'
+    assert checkpoint['cursor'] == "c1"
+    assert checkpoint['total'] == mongo_db["tasks"].count_documents({}) == 6
+
+
+def graph(did: str):
+    """Grafo sintético: cada nó tem dois vizinhos novos (`<did>.0` e `<did>.1`)."""
+    return [{'did': f"{did}.{i}", 'handle': f"{did}.{i}.test"} for i in range(2)]
+
+
+def test_failed_flush_leaves_dids_unseen_and_resumable(scheduler, mongo_db, monkeypatch):
+    tasks = scheduler(fail_at=2)
+    monkeypatch.setattr(populate_tasks, "iter_graph_pages",
+                        lambda did, relation, cursor=None: iter([(graph(did), None)]))
+    bloom = populate_tasks.BloomFilter(capacity=1_000)
+
+    # The seed's neighbours are written; the flush of the first level-1 node fails
+    populate_tasks.expand_graph(["seed.test"], depth=3, workers=1, bloom=bloom)
+    assert "did:plc:seed.0" in bloom
+    assert "did:plc:seed.0.0" not in bloom
+    assert mongo_db["tasks"].count_documents({'depth': 2}) == 0
+
+    tasks.fail_at = 1_000
+    populate_tasks.expand_graph(["seed.test"], depth=3, workers=1, resume=True)
+    assert mongo_db["tasks"].count_documents({'depth': 1}) == 2
+    assert mongo_db["tasks"].count_documents({'depth': 2}) == 4
+    assert mongo_db["tasks"].count_documents({'depth': 1, 'expanded_at': {'$exists': True}}) == 2
+    assert mongo_db["checkpoints"].find_one({'_id': "expand:did:plc:seed"})['status'] == 'done'
@@ -0,0 +1,28 @@
+"""
+Balde de rate limit no Mongo (`MongoTokenBucket`).
+"""
+
+from apis.bsky.rate_limit import MongoTokenBucket
+
+
+def test_bucket_document_is_recreated_after_deletion(mongo_db):
+    coll = mongo_db["ratelimits"]
+    bucket = MongoTokenBucket(coll, key="k", rate=10, burst=5, margin=0)
+    assert bucket.reserve() == 0
+
+    coll.delete_one({"_id": "k"})
+
+    assert bucket.peek() == 0
+    assert bucket.reserve() == 0
+    assert coll.find_one({"_id": "k"})["version"] >= 1
+
+
+def test_instances_share_the_bucket(mongo_db):
+    coll = mongo_db["ratelimits"]
+    first = MongoTokenBucket(coll, key="k", rate=1, burst=2, margin=0)
+    second = MongoTokenBucket(coll, key="k", rate=1, burst=2, margin=0)
+
+    waits = [first.reserve(), second.reserve(), first.reserve()]
+
+    assert waits[:2] == [0, 0]
+    assert waits[2] > 0.5
@@ -0,0 +1,24 @@
+"""
+Particionamento das tasks: `rebalance` só aceita de 1 a 256 shards.
+"""
+
+import pytest
+
+from apis.bsky.sharding import MAX_SHARDS, rebalance, shard_fields
+
+
+@pytest.mark.parametrize("num_shards", [0, MAX_SHARDS + 1])
+def test_rebalance_rejects_shard_counts_outside_the_key_space(mongo_db, num_shards):
+    with pytest.raises(ValueError):
+        rebalance(mongo_db["tasks"], mongo_db["checkpoints"], num_shards)
+    assert mongo_db["checkpoints"].count_documents({}) == 0
+
+
+def test_rebalance_moves_tasks_to_their_new_shard(mongo_db):
+    tasks = mongo_db["tasks"]
+    tasks.insert_many([{'did': f"did:plc:{i}", **shard_fields(f"did:plc:{i}", 1)} for i in range(50)])
+
+    rebalance(tasks, mongo_db["checkpoints"], MAX_SHARDS)
+
+    assert all(doc['shard'] == doc['shard_key'] for doc in tasks.find())
+    assert mongo_db["checkpoints"].find_one({'_id': "shards:tasks"})['num_shards'] == MAX_SHARDS
@@ -0,0 +1,81 @@
+"""
+Ingestão pelo Jetstream de ponta a ponta: `record` → `replay` → `consume` → `StreamWriter` →
+cursor salvo, com o Mongo em memória e o servidor de replay local.
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("websockets")
+from websockets.sync.server import serve
+
+from apis.bsky.stream_consumer import (
+    StreamWriter, TrackedDids, consume, load_events, record, replay_handler,
+)
+
+TRACKED = "did:plc:tracked"
+
+
+def post_event(did: str, time_us: int, rkey: str) -> dict:
+    return {'did': did, 'time_us': time_us, 'kind': 'commit',
+            'commit': {'operation': 'create', 'collection': 'app.bsky.feed.post', 'rkey': rkey, 'cid': f"c{rkey}",
+                       'record': {'text': f"post {rkey}", 'createdAt': "2026-01-01T00:00:00Z"}}}
+
+
+def serve_in_background(handler):
+    server = serve(handler, "localhost", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"ws://localhost:{server.socket.getsockname()[1]}/subscribe"
+
+
+def run_consumer(mongo_db, wrap, url: str, expected_posts: int):
+    mongo_db["tasks"].insert_one({'did': TRACKED})
+    writer = StreamWriter(wrap(mongo_db["posts"]), mongo_db["checkpoints"], "test", "posts", flush_seconds=0.05)
+    stop = threading.Event()
+    thread = threading.Thread(target=consume, args=(url, writer, TrackedDids(mongo_db["tasks"]).load()),
+                              kwargs={'stop': stop}, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while writer.total < expected_posts and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stop.set()
+    thread.join(timeout=5)
+    return writer
+
+
+def test_record_replay_consume_saves_posts_and_cursor(mongo_db, wrap, tmp_path):
+    source = tmp_path / "source.jsonl"
+    events = [post_event(TRACKED, 10, "a"), post_event("did:plc:other", 20, "b"), post_event(TRACKED, 30, "c")]
+    source.write_text("\n".join([json.dumps(events[0]), "{truncated", *map(json.dumps, events[1:])]) + "\n")
+
+    # A linha malformada é pulada pelo replay; o resto é gravado e reproduzido de novo
+    upstream, upstream_url = serve_in_background(replay_handler(load_events(str(source))))
+    recorded = tmp_path / "recorded.jsonl"
+    record(upstream_url, str(recorded), limit=3)
+    upstream.shutdown()
+    assert [json.loads(line)['time_us'] for line in recorded.read_text().splitlines()] == [10, 20, 30]
+
+    server, url = serve_in_background(replay_handler(load_events(str(recorded))))
+    run_consumer(mongo_db, wrap, url, expected_posts=2)
+    server.shutdown()
+
+    assert sorted(p['uri'].rsplit("/", 1)[1] for p in mongo_db["posts"].find()) == ["a", "c"]
+    assert mongo_db["checkpoints"].find_one({'_id': "stream:test"})['cursor'] == 30
+
+
+def test_malformed_frames_are_counted_and_skipped(mongo_db, wrap):
+    def handler(ws):
+        for frame in ("not json", "[1, 2]", json.dumps(post_event(TRACKED, 40, "d"))):
+            ws.send(frame)
+        ws.recv()
+
+    server, url = serve_in_background(handler)
+    writer = run_consumer(mongo_db, wrap, url, expected_posts=1)
+    server.shutdown()
+
+    assert writer.skipped == 2
+    assert mongo_db["posts"].count_documents({'did': TRACKED}) == 1
+    assert mongo_db["checkpoints"].find_one({'_id': "stream:test"})['cursor'] == 40
@@ -0,0 +1,132 @@
+"""
+Reserva de tasks em lote (cada task é reservada por um único worker), renovação dos leases e
+backoff das tentativas.
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+from apis.bsky.task_leases import LeaseKeeper, claim_batch, ack_op, retry_op, ack_batch, renew_leases, retry_wait
+
+
+def seed(coll, n):
+    coll.insert_many([{'_id': i, 'did': f"did:plc:{i}", 'status': 'pending'} for i in range(n)])
+
+
+def test_concurrent_workers_claim_every_task_once(mongo_db):
+    coll = mongo_db.tasks
+    seed(coll, 120)
+    claimed = {}
+
+    def worker(name):
+        ids = []
+        while batch := claim_batch(coll, name, 5):
+            ids.extend(t['_id'] for t in batch)
+        claimed[name] = ids
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    ids = [i for batch in claimed.values() for i in batch]
+    assert sorted(ids) == list(range(120))
+    assert coll.count_documents({'status': 'pending'}) == 0
+
+
+class StealFirstClaim:
+    """
+    Outro worker reserva todas as candidatas entre o find e o update_many do primeiro lote.
+    """
+
+    def __init__(self, coll):
+        self._coll = coll
+        self.stolen = False
+
+    def __getattr__(self, name):
+        return getattr(self._coll, name)
+
+    def update_many(self, flt, update, **kwargs):
+        if not self.stolen:
+            self.stolen = True
+            self._coll.update_many(flt, {'$set': {'status': 'processing', 'locked_by': 'rival', 'lease_id': 'x'}})
+        return self._coll.update_many(flt, update, **kwargs)
+
+
+def test_lost_race_retries_instead_of_reporting_empty_queue(mongo_db):
+    coll = mongo_db.tasks
+    seed(coll, 30)
+    racing = StealFirstClaim(coll)
+
+    batch = claim_batch(racing, "w1", 5)
+
+    assert racing.stolen
+    assert len(batch) == 5
+    assert all(t['locked_by'] == "w1" for t in batch)
+
+
+def test_claim_returns_empty_only_without_pending(mongo_db):
+    coll = mongo_db.tasks
+    assert claim_batch(coll, "w1", 5) == []
+
+
+def test_ack_ignores_tasks_reclaimed_by_another_lease(mongo_db, wrap):
+    coll = wrap(mongo_db.tasks)
+    seed(coll, 1)
+    task = claim_batch(coll, "w1", 1)[0]
+    coll.update_one({'_id': task['_id']}, {'$set': {'lease_id': 'other'}})
+
+    ack_batch(coll, [ack_op(task, 'done')])
+
+    assert coll.find_one({'_id': task['_id']})['status'] == 'processing'
+
+
+def test_failed_task_backs_off_and_retry_wait_reports_it(mongo_db, wrap):
+    coll = wrap(mongo_db.tasks)
+    seed(coll, 1)
+    task = claim_batch(coll, "w1", 1)[0]
+
+    ack_batch(coll, [retry_op(task, "boom", max_attempts=5)])
+
+    doc = coll.find_one({'_id': task['_id']})
+    assert doc['status'] == 'pending' and doc['attempts'] == 1
+    assert claim_batch(coll, "w1", 1) == []
+    assert 0 < retry_wait(coll) <= 60 * 2 * 1.2
+
+
+def test_retry_wait(mongo_db):
+    coll = mongo_db.tasks
+    assert retry_wait(coll) is None
+    coll.insert_one({'_id': 1, 'status': 'pending', 'next_attempt_at': datetime.now(timezone.utc) + timedelta(hours=1)})
+    assert retry_wait(coll) > 3500
+    coll.insert_one({'_id': 2, 'status': 'pending'})
+    assert retry_wait(coll) == 0
+
+
+def test_exhausted_task_fails(mongo_db, wrap):
+    coll = wrap(mongo_db.tasks)
+    coll.insert_one({'_id': 1, 'did': 'did:plc:1', 'status': 'pending', 'attempts': 4})
+    task = claim_batch(coll, "w1", 1)[0]
+
+    ack_batch(coll, [retry_op(task, "boom", max_attempts=5)])
+
+    assert coll.find_one({'_id': 1})['status'] == 'failed'
+    assert retry_wait(coll) is None
+
+
+def test_renewal_only_extends_leases_still_held(mongo_db):
+    coll = mongo_db.tasks
+    seed(coll, 2)
+    mine, lost = claim_batch(coll, "host", 2)
+    # `lost` venceu e foi reservada de novo por outro processo do mesmo host
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    coll.update_many({}, {'$set': {'lease_expires_at': past}})
+    coll.update_one({'_id': lost['_id']}, {'$set': {'lease_id': 'other-process'}})
+    keeper = LeaseKeeper(coll, "host")
+    keeper.hold([mine, lost])
+
+    renew_leases(coll, dict(keeper._held), lease_seconds=600)
+
+    renewed = {doc['_id'] for doc in coll.find({'lease_expires_at': {'$gt': datetime.now(timezone.utc)}})}
+    assert renewed == {mine['_id']}